@@ -0,0 +1,453 @@
+"""
+module archive provides a SQLite index of finished games, for queries across many games
+
+Games are ingested from .catan logs (see module logstream), or from the spectator when a game is
+ended with the End Game button (see --archive in main.py). Each game is also replayed (see module
+replay) for its final state. Tables:
+
+- files (path, mtime, size): logs already ingested. Ingesting a directory again only reads the
+  logs which are new or have changed since.
+- games (id, source, game_index, timestamp, version, num_players, num_turns, num_actions,
+  winner_seat, replayed, setup_hash): one row per game. num_turns counts rolls; winner_seat is
+  null if nobody won; replayed is 0 if the log couldn't be replayed, leaving final state columns
+  null. setup_hash identifies the board setup, see module zobrist.
+- players (game_id, seat, name, color, vp, settlements, cities, roads, road_length, knights,
+  vp_cards, longest_road, largest_army, won): each player's final state
+- openings (game_id, seat, placement, node, numbers, pips, resources): each player's pregame
+  settlements, placement 1 or 2. numbers are the tiles' numbers ascending, eg '5-6-8'.
+- tiles (setup_hash, tile_id, terrain, number), ports (setup_hash, tile_id, direction, type):
+  board setups, stored once however many games were played on them
+- actions (game_id, n, turn, seat, kind, roll, location, line): every action line. kind is a
+  logstream record kind, turn counts rolls before the line, location is eg '(1 NW)'.
+
+Usage:
+    $ python3 archive.py games.db ingest log/
+    $ python3 archive.py games.db winners-opening 6-8-5
+    $ python3 archive.py games.db turns-by-seat
+    $ python3 archive.py games.db query "SELECT color, AVG(vp) FROM players GROUP BY color"
+"""
+import argparse
+import collections
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+import hexgrid
+from catan.pieces import PieceType
+
+import gridtables
+import logstream
+import longestroad
+import replay
+import zobrist
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS games (
+    id INTEGER PRIMARY KEY,
+    source TEXT NOT NULL,
+    game_index INTEGER NOT NULL,
+    timestamp TEXT,
+    version TEXT,
+    num_players INTEGER NOT NULL,
+    num_turns INTEGER NOT NULL,
+    num_actions INTEGER NOT NULL,
+    winner_seat INTEGER,
+    replayed INTEGER NOT NULL,
+    setup_hash INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS players (
+    game_id INTEGER NOT NULL REFERENCES games(id),
+    seat INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    color TEXT NOT NULL,
+    vp INTEGER,
+    settlements INTEGER,
+    cities INTEGER,
+    roads INTEGER,
+    road_length INTEGER,
+    knights INTEGER,
+    vp_cards INTEGER,
+    longest_road INTEGER,
+    largest_army INTEGER,
+    won INTEGER NOT NULL,
+    PRIMARY KEY (game_id, seat)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS openings (
+    game_id INTEGER NOT NULL REFERENCES games(id),
+    seat INTEGER NOT NULL,
+    placement INTEGER NOT NULL,
+    node INTEGER NOT NULL,
+    numbers TEXT NOT NULL,
+    pips INTEGER NOT NULL,
+    resources TEXT NOT NULL,
+    PRIMARY KEY (game_id, seat, placement)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS tiles (
+    setup_hash INTEGER NOT NULL,
+    tile_id INTEGER NOT NULL,
+    terrain TEXT NOT NULL,
+    number INTEGER,
+    PRIMARY KEY (setup_hash, tile_id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS ports (
+    setup_hash INTEGER NOT NULL,
+    tile_id INTEGER NOT NULL,
+    direction TEXT NOT NULL,
+    type TEXT NOT NULL,
+    PRIMARY KEY (setup_hash, tile_id, direction)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS actions (
+    game_id INTEGER NOT NULL REFERENCES games(id),
+    n INTEGER NOT NULL,
+    turn INTEGER NOT NULL,
+    seat INTEGER,
+    kind TEXT NOT NULL,
+    roll INTEGER,
+    location TEXT,
+    line TEXT NOT NULL,
+    PRIMARY KEY (game_id, n)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS games_source ON games (source);
+CREATE INDEX IF NOT EXISTS games_winner ON games (winner_seat, num_turns);
+CREATE INDEX IF NOT EXISTS games_setup ON games (setup_hash);
+CREATE INDEX IF NOT EXISTS players_color ON players (color);
+CREATE INDEX IF NOT EXISTS players_name ON players (name);
+CREATE INDEX IF NOT EXISTS openings_numbers ON openings (numbers, game_id, seat);
+CREATE INDEX IF NOT EXISTS tiles_terrain ON tiles (terrain, number);
+CREATE INDEX IF NOT EXISTS actions_kind ON actions (kind, roll);
+"""
+
+QUERIES = collections.OrderedDict([
+    ('winners-opening', (
+        'games won by a player with a pregame settlement on NUMBERS, eg 6-8-5',
+        """SELECT g.id, g.source, p.color, p.name, g.num_turns
+           FROM openings o
+           JOIN games g ON g.id = o.game_id AND g.winner_seat = o.seat
+           JOIN players p ON p.game_id = o.game_id AND p.seat = o.seat
+           WHERE o.numbers = :numbers
+           GROUP BY g.id
+           ORDER BY g.id""")),
+    ('turns-by-seat', (
+        'average turns to win, by the seat of the winner',
+        """SELECT winner_seat AS seat, COUNT(*) AS wins, AVG(num_turns) AS average_turns
+           FROM games
+           WHERE winner_seat IS NOT NULL
+           GROUP BY winner_seat
+           ORDER BY winner_seat""")),
+    ('wins-by-color', (
+        'games and wins by color',
+        """SELECT color, COUNT(*) AS games, SUM(won) AS wins, AVG(vp) AS average_vp
+           FROM players
+           GROUP BY color
+           ORDER BY wins DESC""")),
+    ('repeated-setups', (
+        'board setups played more than once, and how the seats fared on them',
+        """SELECT setup_hash, COUNT(*) AS games, GROUP_CONCAT(winner_seat) AS winner_seats
+           FROM games
+           GROUP BY setup_hash
+           HAVING COUNT(*) > 1
+           ORDER BY games DESC""")),
+])
+
+_TABLES = ['actions', 'openings', 'players']  # tables of per game rows; board setups are shared
+
+
+class Archive(object):
+    """
+    class Archive is a SQLite database of games.
+
+    :param path: path to the database, created if it doesn't exist
+    """
+    def __init__(self, path):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode = WAL')
+        self.db.execute('PRAGMA synchronous = NORMAL')
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def ingest_paths(self, paths):
+        """
+        Ingest the logs at paths, and the .catan logs under any directories among them, skipping
+        logs which haven't changed since they were last ingested.
+
+        :param paths: list of paths to .catan logs or directories
+        :return: (number of logs ingested, number of logs skipped as unchanged)
+        """
+        ingested = skipped = 0
+        for path in _log_paths(paths):
+            if self.ingest_file(path):
+                ingested += 1
+            else:
+                skipped += 1
+        return ingested, skipped
+
+    def ingest_file(self, path):
+        """
+        Ingest the games of one log, replacing them if the log was ingested before and has changed.
+
+        :param path: path to a .catan log
+        :return: True if the log was ingested, False if it was unchanged
+        """
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        row = self.db.execute('SELECT mtime, size FROM files WHERE path = ?', (path,)).fetchone()
+        if row is not None and row == (stat.st_mtime, stat.st_size):
+            return False
+        with open(path) as fp, self.db:
+            self._delete_source(path)
+            for game_index, records in enumerate(logstream.read_games(fp)):
+                self._insert_game(path, game_index, records)
+            self.db.execute('INSERT OR REPLACE INTO files (path, mtime, size) VALUES (?, ?, ?)',
+                            (path, stat.st_mtime, stat.st_size))
+        return True
+
+    def ingest_text(self, text, source):
+        """
+        Ingest the games of a log held in memory, eg catanlog.CatanLog.dump(), replacing any games
+        ingested from the same source before.
+
+        :param text: log text
+        :param source: name for the games' source, str
+        """
+        with self.db:
+            self._delete_source(source)
+            for game_index, records in enumerate(logstream.read_games(text.splitlines())):
+                self._insert_game(source, game_index, records)
+
+    def ingest_game(self, game):
+        """
+        Ingest a game just ended in the spectator. The game's log file is ingested if it was
+        written to one, so ingesting the log directory later skips it.
+
+        :param game: catan.game.Game
+        """
+        path = game.catanlog.logpath()
+        if os.path.exists(path):
+            self.ingest_file(path)
+        else:
+            self.ingest_text(game.catanlog.dump(), os.path.abspath(path))
+        logging.info('archive: ingested {} into {}'.format(path, self.path))
+
+    def query(self, sql, params=()):
+        """
+        :param sql: SQL, str
+        :param params: parameters of the SQL, tuple or dict
+        :return: (column names, list of rows)
+        """
+        cursor = self.db.execute(sql, params)
+        return [column[0] for column in cursor.description or ()], cursor.fetchall()
+
+    def _delete_source(self, source):
+        game_ids = [row[0] for row in self.db.execute('SELECT id FROM games WHERE source = ?', (source,))]
+        for game_id in game_ids:
+            for table in _TABLES:
+                self.db.execute('DELETE FROM {} WHERE game_id = ?'.format(table), (game_id,))
+        self.db.execute('DELETE FROM games WHERE source = ?', (source,))
+
+    def _insert_game(self, source, game_index, records):
+        header_lines = [record.args[0] for record in records if record.kind == 'header']
+        actions = [record for record in records if record.kind != 'header']
+        try:
+            header, _ = replay.read_header(header_lines)
+        except replay.ReplayError as e:
+            logging.warning('archive: skipping game {} of {}: {}'.format(game_index, source, e))
+            return
+        version = timestamp = None
+        for line in header_lines:
+            if line.startswith('catanlog v'):
+                version = line[len('catanlog v'):]
+            elif line.startswith('timestamp: '):
+                timestamp = line[len('timestamp: '):]
+
+        seats = dict((player.color, i) for i, player in enumerate(header.players))
+        final = _final_state(header, actions)
+        winner = next((seats.get(record.color) for record in actions if record.kind == 'wins'), None)
+        num_turns = sum(1 for record in actions if record.kind == 'roll')
+
+        setup_hash = zobrist.signed(zobrist.setup_hash(header.terrain, header.numbers, header.ports))
+
+        cursor = self.db.execute(
+            'INSERT INTO games (source, game_index, timestamp, version, num_players, num_turns, num_actions,'
+            ' winner_seat, replayed, setup_hash) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            (source, game_index, timestamp, version, len(header.players), num_turns, len(actions),
+             winner, int(final is not None), setup_hash))
+        game_id = cursor.lastrowid
+
+        self.db.executemany(
+            'INSERT INTO players VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(game_id, seat, player.name, player.color) + (final[seat] if final else (None,) * 9) +
+             (int(seat == winner),)
+             for seat, player in enumerate(header.players)])
+        if self.db.execute('SELECT 1 FROM tiles WHERE setup_hash = ?', (setup_hash,)).fetchone() is None:
+            self.db.executemany(
+                'INSERT INTO tiles VALUES (?, ?, ?, ?)',
+                [(setup_hash, tile_id, terrain.value, number)
+                 for tile_id, terrain, number in zip(gridtables.TILE_IDS, header.terrain, header.numbers)])
+            self.db.executemany(
+                'INSERT OR IGNORE INTO ports VALUES (?, ?, ?, ?)',
+                [(setup_hash, port.tile_id, port.direction, port.type.value) for port in header.ports])
+        self.db.executemany(
+            'INSERT OR IGNORE INTO openings VALUES (?, ?, ?, ?, ?, ?, ?)',
+            [(game_id,) + opening for opening in _openings(header, actions, seats)])
+
+        rows = list()
+        turn = 0
+        for n, record in enumerate(actions):
+            location = None
+            if record.kind == 'build':
+                location = '({} {})'.format(*record.args[1])
+            rows.append((game_id, n, turn, seats.get(record.color), record.kind,
+                         record.args[0] if record.kind == 'roll' else None,
+                         location, logstream.format_record(record)))
+            if record.kind == 'roll':
+                turn += 1
+        self.db.executemany('INSERT INTO actions VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+
+
+def _openings(header, actions, seats):
+    """
+    :return: list of (seat, placement, node, numbers, pips, resources) for the pregame settlements
+    """
+    openings = list()
+    placements = collections.Counter()
+    for record in actions:
+        if record.kind == 'roll':
+            break
+        if record.kind != 'build' or record.args[0] != 'settlement' or record.color not in seats:
+            continue
+        seat = seats[record.color]
+        placements[seat] += 1
+        tile_id, direction = record.args[1]
+        if tile_id is None:
+            continue
+        node = hexgrid.from_location(hexgrid.NODE, tile_id, direction)
+        numbers = sorted(header.numbers[t - 1] for t in gridtables.NODE_TILES.get(node, ())
+                         if header.numbers[t - 1] is not None)
+        resources = sorted(header.terrain[t - 1].value for t in gridtables.NODE_TILES.get(node, ())
+                           if header.numbers[t - 1] is not None)
+        openings.append((seat, placements[seat], node, '-'.join(str(n) for n in numbers),
+                         sum(gridtables.PIPS[n] for n in numbers), '-'.join(resources)))
+    return openings
+
+
+def _final_state(header, actions):
+    """
+    Replay the game for each player's final state.
+
+    :return: list per seat of (vp, settlements, cities, roads, road_length, knights, vp_cards,
+    longest_road, largest_army), or None if the game couldn't be replayed
+    """
+    replayer = replay.Replayer(replay.new_game(header))
+    game = replayer.game
+    longest_road = longestroad.LongestRoadIndex(game)
+    seats = dict((player.color, i) for i, player in enumerate(header.players))
+    knights = [0] * len(header.players)
+    vp_cards = [0] * len(header.players)
+    largest_army = None
+    try:
+        for record in actions:
+            replayer.apply(logstream.format_record(record))
+            if record.kind in ('build', 'road_builder'):
+                longest_road.holder()  # the holder depends on the order roads were built in
+            elif record.kind == 'knight':
+                seat = seats[record.color]
+                knights[seat] += 1
+                if knights[seat] >= 3 and (largest_army is None or knights[seat] > knights[largest_army]):
+                    largest_army = seat
+            elif record.kind == 'victory_point':
+                vp_cards[seats[record.color]] += 1
+    except (replay.ReplayError, KeyError) as e:
+        logging.warning('archive: could not replay game: {}'.format(e))
+        game.observers.discard(longest_road)
+        return None
+
+    counts = collections.defaultdict(collections.Counter)
+    for (_, _), piece in game.board.pieces.items():
+        if piece.owner is not None and piece.owner.color in seats:
+            counts[seats[piece.owner.color]][piece.type] += 1
+    holder = longest_road.holder()
+    game.observers.discard(longest_road)
+
+    final = list()
+    for seat, player in enumerate(header.players):
+        settlements = counts[seat][PieceType.settlement]
+        cities = counts[seat][PieceType.city]
+        has_longest_road = holder is not None and holder.color == player.color
+        vp = settlements + 2 * cities + vp_cards[seat] + 2 * has_longest_road + 2 * (largest_army == seat)
+        final.append((vp, settlements, cities, counts[seat][PieceType.road], longest_road.length(player),
+                      knights[seat], vp_cards[seat], int(has_longest_road), int(largest_army == seat)))
+    return final
+
+
+def _log_paths(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                for name in sorted(names):
+                    if name.endswith('.catan'):
+                        yield os.path.join(directory, name)
+        else:
+            yield path
+
+
+def _print_rows(columns, rows, elapsed):
+    if columns:
+        print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join('' if value is None else str(value) for value in row))
+    print('({} rows in {:.1f}ms)'.format(len(rows), elapsed * 1000), file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='index .catan logs in a SQLite database, and query it')
+    parser.add_argument('db', help='path to the database, created if it does not exist')
+    subparsers = parser.add_subparsers(dest='command')
+    ingest = subparsers.add_parser('ingest', help='ingest new and changed logs')
+    ingest.add_argument('paths', nargs='+', help='.catan logs, or directories of them')
+    query = subparsers.add_parser('query', help='run SQL against the database')
+    query.add_argument('sql')
+    for name, (description, _) in QUERIES.items():
+        canned = subparsers.add_parser(name, help=description)
+        if ':numbers' in QUERIES[name][1]:
+            canned.add_argument('numbers', help="opening numbers in any order, eg '6-8-5'")
+    args = parser.parse_args()
+
+    with Archive(args.db) as archive:
+        start = time.perf_counter()
+        if args.command == 'ingest':
+            ingested, skipped = archive.ingest_paths(args.paths)
+            print('ingested {} logs, skipped {} unchanged, in {:.1f}s'.format(
+                ingested, skipped, time.perf_counter() - start))
+        elif args.command == 'query':
+            columns, rows = archive.query(args.sql)
+            _print_rows(columns, rows, time.perf_counter() - start)
+        elif args.command in QUERIES:
+            params = dict()
+            if getattr(args, 'numbers', None):
+                params['numbers'] = '-'.join(sorted(args.numbers.split('-'), key=int))
+            columns, rows = archive.query(QUERIES[args.command][1], params)
+            _print_rows(columns, rows, time.perf_counter() - start)
+        else:
+            parser.print_help()
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""
+module autoplay provides watching a logged game back in the spectator, at a chosen speed
+
+Autoplay applies the action lines of a .catan log (see module replay) to the spectator's game
+on the Tk event loop, at speed actions per second, from MIN_SPEED to MAX_SPEED. Each frame
+applies the actions which have come due since the last one with the views' notifies held back
+(see changeevents.ChangePublisher.held), so the views draw once per frame, however many actions
+it took.
+
+Frames are at most as frequent as the board can draw them: the time BoardFrame took to draw
+(its board.redraw and board.update timings) and Tk took to repaint is averaged over the frames,
+and the next frame is not before FRAME_HEADROOM times that, which leaves the rest for the
+operator's input. When actions come due faster than that, the in-between positions are never
+drawn, and playback keeps to the chosen speed rather than falling behind.
+
+Jumping to a turn before the current one loads the game afresh and applies the lines up to the
+turn, in one frame. Since that's how to go back, the watched game keeps no undo history, so an
+action costs what replaying it does and no copy of the game (see undohistory.NoHistory).
+
+Usage:
+    $ python3 main.py --watch log/2016-01-01T12-00-00-a-b-c-d.catan --watch-speed 20
+"""
+import logging
+import time
+
+import logstream
+import replay
+from instrumentation import timings
+
+MIN_SPEED = 1
+MAX_SPEED = 100
+FRAME_HEADROOM = 2.0
+DRAW_SMOOTHING = 0.2  # weight of the latest frame in the average frame cost
+BOARD_TIMINGS = ('board.redraw', 'board.update')
+
+
+class Autoplay(object):
+    """
+    class Autoplay plays the lines of a log onto a game, a frame at a time.
+
+    :param widget: any Tk widget, to schedule frames with
+    :param changes: the views' changeevents.ChangePublisher
+    :param lines: the lines of a .catan log
+    :param load_game: called with a fresh catan.game.Game, to make it the game the views show
+    :param speed: actions per second
+    :param on_frame: called with no arguments after every frame, and when playback stops
+    """
+    def __init__(self, widget, changes, lines, load_game, speed=10, on_frame=None):
+        self.widget = widget
+        self.changes = changes
+        self.load_game = load_game
+        self.on_frame = on_frame
+        self.header, start = replay.read_header(lines)
+        self.lines = [line for line in lines[start:] if line.strip()]
+        self.turn_starts = [0]  # position each turn starts at, the first turn is turn 1
+        for i, line in enumerate(self.lines):
+            if logstream.parse_line(line).kind == 'end_turn':
+                self.turn_starts.append(i + 1)
+        self.speed = clamp_speed(speed)
+        self.position = 0  # lines applied
+        self.playing = False
+        self.frames = 0
+        self.dropped = 0  # positions which were never drawn
+        self.frame_cost = 0.0  # seconds, averaged
+        self.error = None
+        self._replayer = None
+        self._after = None
+        self._t0 = None
+        self._base = 0  # position at _t0
+
+    def start(self, playing=True):
+        """
+        Load the log's game at its first line, and play it if playing.
+        """
+        self._frame(0, reset=True)
+        if playing:
+            self.play()
+
+    def play(self):
+        if self.playing or self.error is not None or self.position >= len(self.lines):
+            return
+        self.playing = True
+        self._rebase()
+        self._schedule(0)
+
+    def pause(self):
+        self.playing = False
+        self._cancel()
+        self._notify()
+
+    def toggle(self):
+        if self.playing:
+            self.pause()
+        else:
+            self.play()
+
+    def set_speed(self, speed):
+        """
+        :param speed: actions per second, clamped to MIN_SPEED..MAX_SPEED
+        """
+        self.speed = clamp_speed(speed)
+        self._rebase()
+
+    def jump_to_turn(self, turn):
+        """
+        Show the position at the start of a turn, and carry on playing from there if playing.
+
+        :param turn: turn number, from 1, as in the log's turn box
+        """
+        target = self.turn_starts[max(0, min(turn - 1, len(self.turn_starts) - 1))]
+        if target < self.position:
+            self._frame(target, reset=True)
+        else:
+            self._frame(target - self.position)
+        self._rebase()
+        if self.playing:
+            self._cancel()
+            self._schedule(0)
+
+    def current_turn(self):
+        """
+        :return: number of the turn the next line is in, from 1
+        """
+        return sum(1 for start in self.turn_starts if start <= self.position)
+
+    def stop(self):
+        self.playing = False
+        self._cancel()
+
+    def _reset(self):
+        self.load_game(replay.new_game(self.header))
+        self._replayer = replay.Replayer(self.changes.game)
+        self.position = 0
+
+    def _rebase(self):
+        self._t0 = time.perf_counter()
+        self._base = self.position
+
+    def _tick(self):
+        self._after = None
+        if not self.playing:
+            return
+        start = time.perf_counter()
+        due = min(len(self.lines), self._base + int((start - self._t0) * self.speed)) - self.position
+        if due > 0:
+            self._frame(due)
+        if self.error is not None or self.position >= len(self.lines):
+            self.playing = False
+            self._notify()
+            return
+        next_due = self._t0 + (self.position + 1 - self._base) / self.speed
+        now = time.perf_counter()
+        self._schedule(max(next_due - now, FRAME_HEADROOM * self.frame_cost - (now - start)))
+
+    def _frame(self, count, reset=False):
+        """
+        Apply count lines with the views held, then let them draw once.
+
+        :param reset: load the game afresh first, and apply the lines from the first
+        """
+        with timings.measure('autoplay.frame'):
+            drawn = self._board_seconds()
+            with self.changes.held():
+                if reset:
+                    self._reset()
+                for _ in range(count):
+                    if not self._apply_next():
+                        break
+            # the views drew as the notifies were let go, and Tk repaints on idle
+            repaint = time.perf_counter()
+            self.widget.update_idletasks()
+            cost = self._board_seconds() - drawn + time.perf_counter() - repaint
+        self.dropped += max(0, count - 1)
+        self.frames += 1
+        self.frame_cost = cost if self.frames == 1 else (1 - DRAW_SMOOTHING) * self.frame_cost + DRAW_SMOOTHING * cost
+        self._notify()
+
+    def _apply_next(self):
+        line = self.lines[self.position]
+        try:
+            with timings.measure('autoplay.apply'):
+                self._replayer.apply(line)
+        except replay.ReplayError as e:
+            self.error = 'line {}: {}'.format(self.position + 1, e)
+            logging.warning('autoplay: stopped at {}'.format(self.error))
+            self.playing = False
+            return False
+        self.position += 1
+        return True
+
+    def _board_seconds(self):
+        return sum(timings.get(name).total for name in BOARD_TIMINGS if timings.get(name) is not None)
+
+    def _schedule(self, seconds):
+        self._after = self.widget.after(max(1, int(seconds * 1000)), self._tick)
+
+    def _cancel(self):
+        if self._after is not None:
+            self.widget.after_cancel(self._after)
+            self._after = None
+
+    def _notify(self):
+        if self.on_frame is not None:
+            self.on_frame()
+
+
+def clamp_speed(speed):
+    return max(MIN_SPEED, min(MAX_SPEED, speed))
+
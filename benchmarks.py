@@ -0,0 +1,388 @@
+"""
+module benchmarks provides performance benchmarks for catan-spectator, with pass/fail targets
+
+Currently, it provides
+- startup: cold start (fresh process) to first paint of the main window
+- longest-road: longest road updates on pathological boards of 15 roads in a tight mesh
+- boardgen: random boards generated per second, under the strictest rules
+- fairness: scoring a batch of random boards in one vectorized pass
+- logstream: streaming parse and binary packing of a synthetic archive, and random access to its actions
+- undo-history: actions with bounded undo history spilling to disk, after an undo, with a view which can't be pickled
+
+Usage:
+    $ python3 benchmarks.py startup --runs 5 --target 2.0
+    $ python3 benchmarks.py longest-road --target 5.0
+    $ python3 benchmarks.py boardgen --count 5000 --target 1000
+    $ python3 benchmarks.py fairness --count 10000 --target 1.0
+    $ python3 benchmarks.py logstream --games 1000 --target 50
+    $ python3 benchmarks.py undo-history --actions 500 --target 10.0
+
+Each benchmark prints its measurements and exits non-zero if the target is missed.
+"""
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+STARTUP_OPTS = ['--terrain', 'random', '--numbers', 'random', '--ports', 'preset',
+                '--pieces', 'preset', '--players', 'preset']
+
+
+def bench_startup(runs, target):
+    """
+    Launch the spectator `runs` times in fresh processes with --startup-profile, and measure the
+    time from process launch until the first paint is reported.
+
+    :param runs: number of cold starts, int
+    :param target: maximum allowed median seconds to first paint, float
+    :return: True if the median is under target
+    """
+    samples = list()
+    for run in range(runs):
+        start = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, os.path.join(HERE, 'main.py'), '--startup-profile'] + STARTUP_OPTS,
+                                cwd=HERE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                universal_newlines=True)
+        first_paint = None
+        report = list()
+        for line in proc.stdout:
+            report.append(line.rstrip())
+            if line.startswith('startup.first_paint') and first_paint is None:
+                first_paint = time.perf_counter() - start
+        proc.wait()
+        if proc.returncode != 0 or first_paint is None:
+            print('run {}: spectator exited with code={} before reporting a first paint'.format(run, proc.returncode))
+            return False
+        samples.append(first_paint)
+        print('run {}: {:.3f}s to first paint'.format(run, first_paint))
+        for line in report:
+            print('    {}'.format(line))
+
+    median = statistics.median(samples)
+    passed = median <= target
+    print('startup: median={:.3f}s, best={:.3f}s, target={:.3f}s -> {}'.format(
+        median, min(samples), target, 'PASS' if passed else 'FAIL'
+    ))
+    return passed
+
+
+def _mesh_boards():
+    """
+    Boards where one player's 15 roads are the edges of three mutually adjacent tiles: three
+    loops sharing edges, which is about as many trails as 15 roads can make.
+
+    :return: list of tuples of edge coords
+    """
+    import gridtables
+    meshes = set()
+    for a in gridtables.TILE_IDS:
+        for b in gridtables.TILE_NEIGHBOURS[a]:
+            for c in gridtables.TILE_NEIGHBOURS[a]:
+                if c in gridtables.TILE_NEIGHBOURS[b]:
+                    edges = set(gridtables.TILE_EDGES[a]) | set(gridtables.TILE_EDGES[b]) | set(gridtables.TILE_EDGES[c])
+                    if len(edges) == 15:
+                        meshes.add(tuple(sorted(edges)))
+    return sorted(meshes)
+
+
+def bench_longest_road(target):
+    """
+    On each pathological board, time a cold longest road search, then place and remove an
+    opponent settlement on every node of the mesh, timing each update of the index.
+
+    :param target: maximum allowed median milliseconds per update, float
+    :return: True if the median update is under target
+    """
+    from catan.board import Board
+    from catan.game import Game, Player
+    from catan.pieces import Piece, PieceType
+    import gridtables
+    import longestroad
+
+    red, blue = Player(1, 'red', 'red'), Player(2, 'blue', 'blue')
+    cold = list()
+    updates = list()
+    memo_hits = memo_misses = 0
+    for edges in _mesh_boards():
+        game = Game(board=Board(terrain='preset', numbers='preset', ports='preset', pieces='empty'))
+        for edge in edges:
+            game.board.place_piece(Piece(PieceType.road, red), edge)
+
+        start = time.perf_counter()
+        index = longestroad.LongestRoadIndex(game)
+        cold.append(time.perf_counter() - start)
+        full = index.length(red)
+
+        nodes = sorted(set(node for edge in edges for node in gridtables.EDGE_NODES[edge]))
+        for node in nodes:
+            settlement = Piece(PieceType.settlement, blue)
+            game.board.place_piece(settlement, node)
+            start = time.perf_counter()
+            index.sync()
+            updates.append(time.perf_counter() - start)
+
+            game.board.remove_piece(settlement, node)
+            start = time.perf_counter()
+            index.sync()
+            updates.append(time.perf_counter() - start)
+            assert index.length(red) == full
+        game.observers.discard(index)
+        memo_hits += index.memo_hits
+        memo_misses += index.memo_misses
+
+    median = statistics.median(updates) * 1000
+    print('longest-road: {} boards, cold search median={:.3f}ms max={:.3f}ms'.format(
+        len(cold), statistics.median(cold) * 1000, max(cold) * 1000
+    ))
+    passed = median <= target
+    print('longest-road: {} updates, median={:.3f}ms max={:.3f}ms, memo hits={} misses={}, target={:.3f}ms -> {}'.format(
+        len(updates), median, max(updates) * 1000, memo_hits, memo_misses, target,
+        'PASS' if passed else 'FAIL'
+    ))
+    return passed
+
+
+def bench_boardgen(count, target):
+    """
+    Generate boards under the default rules, and under every rule with terrain clusters of at
+    most 2, checking each board against its rules.
+
+    :param count: boards per set of rules, int
+    :param target: minimum boards per second under the strictest rules, float
+    :return: True if the strictest rules generate at least target boards per second
+    """
+    import boardgen
+
+    short_forms = dict((short, terrain) for terrain, short in boardgen._short_forms.items())
+    rate = None
+    for rules in (boardgen.Rules(), boardgen.Rules(spread_2_12=True, spread_same_numbers=True, max_cluster=2)):
+        start = time.perf_counter()
+        boards = list(boardgen.generate_boards(count, rules, seed=0))
+        rate = count / (time.perf_counter() - start)
+        for board in boards:
+            codes = board.split(' ')
+            terrain = [short_forms[code] for code in codes[:19]]
+            numbers = [None if code == 'None' else int(code) for code in codes[19:]]
+            assert not boardgen.check(terrain, numbers, rules), board
+        print('boardgen: {}: {:.0f} boards/s'.format(rules, rate))
+
+    passed = rate >= target
+    print('boardgen: strictest rules {:.0f} boards/s, target={:.0f} boards/s -> {}'.format(
+        rate, target, 'PASS' if passed else 'FAIL'
+    ))
+    return passed
+
+
+def bench_fairness(count, target):
+    """
+    Encode and score a batch of random boards.
+
+    :param count: boards in the batch, int
+    :param target: maximum seconds to encode and score the batch, float
+    :return: True if under target
+    """
+    import boardgen
+    import fairness
+
+    boards = list(boardgen.generate_boards(count, seed=0))
+    start = time.perf_counter()
+    encoded = fairness.encode(boards)
+    encoding = time.perf_counter() - start
+    scores = fairness.score(encoded)
+    total = time.perf_counter() - start
+
+    passed = total <= target
+    print('fairness: {} boards, encode={:.3f}s score={:.3f}s total={:.3f}s, target={:.3f}s -> {}'.format(
+        count, encoding, total - encoding, total, target, 'PASS' if passed else 'FAIL'
+    ))
+    print('fairness: fairest {}'.format(fairness.describe(scores, fairness.rank(scores)[0])))
+    return passed
+
+
+def _synthetic_log(rng):
+    """
+    :param rng: random.Random
+    :return: the text of a plausible .catan log of about 250 actions
+    """
+    colors = ['red', 'blue', 'green', 'orange']
+    resources = ['wood', 'brick', 'wheat', 'sheep', 'ore']
+    lines = ['catanlog v0.10.0', 'timestamp: 2016-01-01 12:00:00', 'players: 4']
+    lines.extend('name: {0}, color: {0}, seat: {1}'.format(color, seat) for seat, color in enumerate(colors, 1))
+    lines.extend(['terrain: ' + ' '.join(['wood'] * 18 + ['desert']),
+                  'numbers: ' + ' '.join(['6'] * 18 + ['None']),
+                  'ports: 3:1(1 NW) wood(2 W)',
+                  '...CATAN!'])
+    for turn in range(60):
+        color = colors[turn % 4]
+        roll = rng.randint(2, 12)
+        lines.append('{} rolls {}{}'.format(color, roll, ' ...DEUCES!' if roll == 2 else ''))
+        if roll == 7:
+            lines.append('{} moves robber to {}, steals from {}'.format(color, rng.randint(1, 19), rng.choice(colors)))
+        lines.append('{} buys road, builds at ({} NW)'.format(color, rng.randint(1, 19)))
+        lines.append('{} trades [2 {}] to port 3:1 for [1 {}]'.format(color, rng.choice(resources), rng.choice(resources)))
+        lines.append('{} ends turn after {}s'.format(color, rng.randint(5, 120)))
+    return '\n'.join(lines) + '\n'
+
+
+def bench_logstream(games, target):
+    """
+    Stream-parse and pack an archive of synthetic logs, then read random actions of random games
+    back from the binary file.
+
+    :param games: number of games in the archive, int
+    :param target: maximum allowed median microseconds per random access, float
+    :return: True if the median random access is under target
+    """
+    import random
+    import tempfile
+    import logstream
+
+    rng = random.Random(0)
+    directory = tempfile.mkdtemp()
+    text_path = os.path.join(directory, 'archive.catan')
+    binary_path = os.path.join(directory, 'archive.catanb')
+    with open(text_path, 'w') as fp:
+        for _ in range(games):
+            fp.write(_synthetic_log(rng))
+
+    start = time.perf_counter()
+    with open(text_path) as fp:
+        lines = sum(1 for _ in logstream.parse(fp))
+    parsing = time.perf_counter() - start
+    start = time.perf_counter()
+    logstream.pack([text_path], binary_path)
+    packing = time.perf_counter() - start
+    print('logstream: {} games, {} lines, parse={:.0f} lines/s, pack={:.3f}s, {:.0f}KB text -> {:.0f}KB binary'.format(
+        games, lines, lines / parsing, packing,
+        os.path.getsize(text_path) / 1024, os.path.getsize(binary_path) / 1024
+    ))
+
+    samples = list()
+    with logstream.BinaryLog(binary_path) as log:
+        for _ in range(10000):
+            game = rng.randrange(len(log))
+            n = rng.randrange(log.num_actions(game))
+            start = time.perf_counter()
+            log.action(game, n)
+            samples.append(time.perf_counter() - start)
+        with open(text_path) as fp:
+            first = next(logstream.read_games(fp))
+        assert log.records(0) == first
+    os.remove(text_path)
+    os.remove(binary_path)
+    os.rmdir(directory)
+
+    median = statistics.median(samples) * 1e6
+    passed = median <= target
+    print('logstream: {} random accesses, median={:.1f}us max={:.1f}us, target={:.1f}us -> {}'.format(
+        len(samples), median, max(samples) * 1e6, target, 'PASS' if passed else 'FAIL'
+    ))
+    return passed
+
+
+def bench_undo_history(actions, target):
+    """
+    Play a headless game with a ChangePublisher subscriber which can't be pickled, as views can't,
+    undo once, then play more than the undo depth, so the restore points taken after the undo are
+    spilled. Checks that no action fails and every restore point could be spilled.
+
+    :param actions: actions to play after the undo, int
+    :param target: maximum allowed median milliseconds per action, float
+    :return: True if nothing failed and the median action is under target
+    """
+    import threading
+    import changeevents
+    import loadgen
+    import undohistory
+
+    class View(object):
+        def __init__(self):
+            self.lock = threading.Lock()
+
+        def on_changes(self, events):
+            pass
+
+    game = loadgen.headless_game()
+    undo_history = game.undo_manager = undohistory.UndoHistory(depth=20)
+    publisher = next(o for o in game.observers if isinstance(o, changeevents.ChangePublisher))
+    publisher.subscribe(View().on_changes, *changeevents.BOARD_EVENTS)
+    loadgen.start_game(game)
+    generator = loadgen.LoadGenerator(game, seed=0, undo_rate=0)
+    for _ in range(30):
+        generator.step()
+    game.undo()
+
+    samples = list()
+    failed = 0
+    for _ in range(actions):
+        start = time.perf_counter()
+        try:
+            generator.step()
+        except Exception:
+            # eg a restore point which failed to pickle, which used to take the action with it
+            failed += 1
+        samples.append(time.perf_counter() - start)
+    undo_history.close()
+
+    median = statistics.median(samples) * 1000
+    kept = undo_history._spill_error is None
+    passed = failed == 0 and kept and median <= target
+    print('undo-history: {} actions, {} failed, {} spilled, {} in memory, median={:.3f}ms max={:.3f}ms, '
+          'target={:.3f}ms -> {}'.format(actions, failed, len(undo_history._spilled), len(undo_history._undo_stack),
+                                         median, max(samples) * 1000, target, 'PASS' if passed else 'FAIL'))
+    return passed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='catan-spectator benchmarks')
+    subparsers = parser.add_subparsers(dest='benchmark')
+
+    startup = subparsers.add_parser('startup', help='cold start to first paint')
+    startup.add_argument('--runs', type=int, default=5, help='number of cold starts, default 5')
+    startup.add_argument('--target', type=float, default=2.0, help='median seconds to first paint, default 2.0')
+
+    longest_road = subparsers.add_parser('longest-road', help='longest road updates on pathological boards')
+    longest_road.add_argument('--target', type=float, default=5.0, help='median milliseconds per update, default 5.0')
+
+    boardgen = subparsers.add_parser('boardgen', help='random boards generated per second')
+    boardgen.add_argument('--count', type=int, default=5000, help='boards per set of rules, default 5000')
+    boardgen.add_argument('--target', type=float, default=1000, help='boards per second, default 1000')
+
+    fairness = subparsers.add_parser('fairness', help='scoring a batch of boards')
+    fairness.add_argument('--count', type=int, default=10000, help='boards in the batch, default 10000')
+    fairness.add_argument('--target', type=float, default=1.0, help='seconds to encode and score, default 1.0')
+
+    logstream = subparsers.add_parser('logstream', help='log parsing, packing and random access')
+    logstream.add_argument('--games', type=int, default=1000, help='games in the archive, default 1000')
+    logstream.add_argument('--target', type=float, default=50.0,
+                           help='median microseconds per random access, default 50')
+
+    undo_history = subparsers.add_parser('undo-history', help='undo history spilling to disk after an undo')
+    undo_history.add_argument('--actions', type=int, default=500, help='actions after the undo, default 500')
+    undo_history.add_argument('--target', type=float, default=10.0, help='median milliseconds per action, default 10.0')
+
+    args = parser.parse_args()
+    if args.benchmark == 'startup':
+        passed = bench_startup(args.runs, args.target)
+    elif args.benchmark == 'longest-road':
+        passed = bench_longest_road(args.target)
+    elif args.benchmark == 'boardgen':
+        passed = bench_boardgen(args.count, args.target)
+    elif args.benchmark == 'fairness':
+        passed = bench_fairness(args.count, args.target)
+    elif args.benchmark == 'logstream':
+        passed = bench_logstream(args.games, args.target)
+    elif args.benchmark == 'undo-history':
+        passed = bench_undo_history(args.actions, args.target)
+    else:
+        parser.print_help()
+        return 2
+    return 0 if passed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
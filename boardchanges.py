@@ -0,0 +1,48 @@
+"""
+module boardchanges provides change detection for a catan board
+
+The board and game notify observers without saying what changed. BoardWatcher remembers what
+the board looked like at the last poll, and returns only the differences: pieces placed, pieces
+removed, and tiles edited. Undo (Game.restore) swaps whole objects on the board, and shows up
+here as the pieces and tiles which differ before and after.
+
+A poll is one pass over board.pieces and board.tiles (tens of entries), so indexes built on it
+can be kept up to date on every notify and only do work for what actually changed.
+"""
+import collections
+
+BoardChanges = collections.namedtuple('BoardChanges', ['placed', 'removed', 'edited'])
+BoardChanges.__doc__ = """
+placed: list of ((hexgrid type, coord), (PieceType, owner)), pieces which are new at a location
+removed: list of ((hexgrid type, coord), (PieceType, owner)), pieces which are gone from a location
+edited: list of tile identifiers whose terrain or number changed
+
+An upgrade (settlement -> city) is a removal and a placement at the same location.
+"""
+
+
+class BoardWatcher(object):
+    """
+    class BoardWatcher diffs a board against its state at the previous poll.
+
+    The first poll reports everything on the board as placed, and every tile as edited.
+    """
+    def __init__(self):
+        self._pieces = dict()
+        self._tiles = dict()
+
+    def poll(self, board):
+        """
+        :param board: catan.board.Board
+        :return: BoardChanges since the previous poll
+        """
+        pieces = dict((index, (piece.type, piece.owner)) for index, piece in board.pieces.items())
+        placed = [(index, value) for index, value in pieces.items() if self._pieces.get(index) != value]
+        removed = [(index, value) for index, value in self._pieces.items() if pieces.get(index) != value]
+
+        tiles = dict((tile.tile_id, (tile.terrain, tile.number)) for tile in board.tiles)
+        edited = [tile_id for tile_id, value in tiles.items() if self._tiles.get(tile_id) != value]
+
+        self._pieces = pieces
+        self._tiles = tiles
+        return BoardChanges(placed, removed, edited)
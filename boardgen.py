@@ -0,0 +1,275 @@
+"""
+module boardgen provides a constrained random board generator
+
+Boards are generated directly under the rules, rather than by shuffling and rejecting:
+- terrain is assigned tile by tile, only ever choosing a terrain that keeps every group of
+  adjacent same-terrain tiles within the cluster limit, backtracking on a dead end
+- numbers are placed most constrained first (6s and 8s, then 2s and 12s, then the rest). Each
+  placement forbids the conflicting numbers on the neighbouring tiles, and a placement is undone
+  as soon as some number left to place has fewer allowed tiles than copies left
+
+Tiles are sets of bits (bit i is tile identifier i), so propagation is a few integer operations.
+Adjacency comes from module gridtables.
+
+Use #reset in place of Board.reset to regenerate whichever parts of a board its options make
+random. Use #generate_boards for board strings in the --board format, e.g. for seeding tournaments.
+"""
+import collections
+import random
+
+from catan import boardbuilder
+from catan.board import Terrain, HexNumber
+
+import gridtables
+
+TERRAIN_COUNTS = collections.OrderedDict([
+    (Terrain.wood, 4),
+    (Terrain.brick, 3),
+    (Terrain.wheat, 4),
+    (Terrain.sheep, 4),
+    (Terrain.ore, 3),
+    (Terrain.desert, 1),
+])
+NUMBER_COUNTS = collections.OrderedDict([
+    (6, 2), (8, 2), (2, 1), (12, 1),
+    (3, 2), (4, 2), (5, 2), (9, 2), (10, 2), (11, 2),
+])
+RED_NUMBERS = (6, 8)
+
+_short_forms = {
+    Terrain.wood: 'w',
+    Terrain.brick: 'b',
+    Terrain.wheat: 'h',
+    Terrain.sheep: 's',
+    Terrain.ore: 'o',
+    Terrain.desert: 'd',
+}
+
+_neighbours = dict((tile_id, sum(1 << n for n in gridtables.TILE_NEIGHBOURS[tile_id]))
+                   for tile_id in gridtables.TILE_IDS)
+
+# tile identifiers spiral from the outside in, so each tile assigned has assigned neighbours to check against
+_assignment_order = list(gridtables.TILE_IDS)
+
+
+class BoardGenerationError(Exception):
+    pass
+
+
+class Rules(object):
+    """
+    class Rules holds the constraints on generated boards. 6s and 8s are never adjacent.
+
+    :param spread_2_12: 2s and 12s are not adjacent to each other, bool
+    :param spread_same_numbers: no two tiles with the same number are adjacent, bool
+    :param max_cluster: largest group of adjacent tiles with the same terrain, int or None for no limit
+    """
+    def __init__(self, spread_2_12=False, spread_same_numbers=False, max_cluster=None):
+        self.spread_2_12 = spread_2_12
+        self.spread_same_numbers = spread_same_numbers
+        self.max_cluster = max_cluster
+
+    def conflicts(self, number):
+        """
+        :param number: int
+        :return: the numbers which may not be adjacent to number, set
+        """
+        conflicts = set()
+        if number in RED_NUMBERS:
+            conflicts.update(RED_NUMBERS)
+        if self.spread_2_12 and number in (2, 12):
+            conflicts.update((2, 12))
+        if self.spread_same_numbers:
+            conflicts.add(number)
+        return conflicts
+
+    def __repr__(self):
+        return 'Rules(spread_2_12={}, spread_same_numbers={}, max_cluster={})'.format(
+            self.spread_2_12, self.spread_same_numbers, self.max_cluster
+        )
+
+
+def generate_terrain(rules=None, rng=random):
+    """
+    :param rules: Rules, default Rules()
+    :param rng: random.Random or the random module
+    :return: list of Terrain, one per tile in tile identifier order
+    """
+    rules = rules or Rules()
+    terrain = list()
+    for terrain_type, count in TERRAIN_COUNTS.items():
+        terrain.extend([terrain_type] * count)
+    if rules.max_cluster is None:
+        rng.shuffle(terrain)
+        return terrain
+
+    assignment = dict()
+    counts = dict(TERRAIN_COUNTS)
+    if not _assign_terrain(0, assignment, counts, rules.max_cluster, rng):
+        raise BoardGenerationError('No terrain layout satisfies {}'.format(rules))
+    return [assignment[tile_id] for tile_id in gridtables.TILE_IDS]
+
+
+def _assign_terrain(i, assignment, counts, max_cluster, rng):
+    if i == len(_assignment_order):
+        return True
+    tile_id = _assignment_order[i]
+    choices = [t for t, count in counts.items() if count > 0]
+    rng.shuffle(choices)
+    for terrain in choices:
+        if terrain != Terrain.desert and _cluster_size(tile_id, terrain, assignment) > max_cluster:
+            continue
+        assignment[tile_id] = terrain
+        counts[terrain] -= 1
+        if _assign_terrain(i + 1, assignment, counts, max_cluster, rng):
+            return True
+        counts[terrain] += 1
+        del assignment[tile_id]
+    return False
+
+
+def _cluster_size(tile_id, terrain, assignment):
+    seen = {tile_id}
+    frontier = [tile_id]
+    while frontier:
+        for neighbour in gridtables.TILE_NEIGHBOURS[frontier.pop()]:
+            if neighbour not in seen and assignment.get(neighbour) == terrain:
+                seen.add(neighbour)
+                frontier.append(neighbour)
+    return len(seen)
+
+
+def generate_numbers(terrain, rules=None, rng=random):
+    """
+    :param terrain: list of Terrain, one per tile in tile identifier order, with one desert
+    :param rules: Rules, default Rules()
+    :param rng: random.Random or the random module
+    :return: list of int or None (the desert), one per tile in tile identifier order
+    """
+    rules = rules or Rules()
+    free = 0
+    for tile_id, terrain_type in zip(gridtables.TILE_IDS, terrain):
+        if terrain_type != Terrain.desert:
+            free |= 1 << tile_id
+
+    tokens = list()
+    for number, count in NUMBER_COUNTS.items():
+        tokens.extend([number] * count)
+    if _popcount(free) != len(tokens):
+        raise BoardGenerationError('Terrain must have exactly one desert, got {}'.format(terrain))
+    conflicts = dict((number, rules.conflicts(number)) for number in NUMBER_COUNTS)
+    # the copies of each number still to be placed after tokens[i]
+    remaining = list()
+    for i in range(len(tokens)):
+        remaining.append(collections.Counter(tokens[i + 1:]))
+
+    assignment = dict()
+    if not _place_numbers(0, tokens, remaining, conflicts, free, dict(), assignment, rng):
+        raise BoardGenerationError('No number layout satisfies {} on terrain {}'.format(rules, terrain))
+    return [assignment.get(tile_id) for tile_id in gridtables.TILE_IDS]
+
+
+def _place_numbers(i, tokens, remaining, conflicts, free, forbidden, assignment, rng):
+    if i == len(tokens):
+        return True
+    number = tokens[i]
+    candidates = _tiles(free & ~forbidden.get(number, 0))
+    rng.shuffle(candidates)
+    for tile_id in candidates:
+        next_free = free & ~(1 << tile_id)
+        next_forbidden = dict(forbidden)
+        for other in conflicts[number]:
+            next_forbidden[other] = next_forbidden.get(other, 0) | _neighbours[tile_id]
+        if any(_popcount(next_free & ~next_forbidden.get(n, 0)) < count for n, count in remaining[i].items()):
+            continue
+        assignment[tile_id] = number
+        if _place_numbers(i + 1, tokens, remaining, conflicts, next_free, next_forbidden, assignment, rng):
+            return True
+        del assignment[tile_id]
+    return False
+
+
+def _tiles(bits):
+    return [tile_id for tile_id in gridtables.TILE_IDS if bits & (1 << tile_id)]
+
+
+def _popcount(bits):
+    return bin(bits).count('1')
+
+
+def check(terrain, numbers, rules=None):
+    """
+    :param terrain: list of Terrain, one per tile in tile identifier order
+    :param numbers: list of int or None, one per tile in tile identifier order
+    :param rules: Rules, default Rules()
+    :return: list of str describing each broken rule, empty if the board satisfies the rules
+    """
+    rules = rules or Rules()
+    terrain = dict(zip(gridtables.TILE_IDS, terrain))
+    numbers = dict(zip(gridtables.TILE_IDS, numbers))
+    broken = list()
+    for tile_id in gridtables.TILE_IDS:
+        for neighbour in gridtables.TILE_NEIGHBOURS[tile_id]:
+            if neighbour < tile_id or numbers[tile_id] is None:
+                continue
+            if numbers[neighbour] in rules.conflicts(numbers[tile_id]):
+                broken.append('tiles {} and {} are adjacent with {} and {}'.format(
+                    tile_id, neighbour, numbers[tile_id], numbers[neighbour]))
+        if rules.max_cluster is not None and terrain[tile_id] != Terrain.desert:
+            size = _cluster_size(tile_id, terrain[tile_id], terrain)
+            if size > rules.max_cluster:
+                broken.append('tile {} is in a group of {} {} tiles'.format(tile_id, size, terrain[tile_id].value))
+    return broken
+
+
+def board_string(terrain, numbers):
+    """
+    :param terrain: list of Terrain, one per tile in tile identifier order
+    :param numbers: list of int or None, one per tile in tile identifier order
+    :return: the board in the --board format, e.g. 'w w h b s o w w b ... 2 None 9 3 4 6 ...'
+    """
+    return ' '.join([_short_forms[t] for t in terrain] + [str(n) for n in numbers])
+
+
+def generate_boards(count, rules=None, seed=None):
+    """
+    :param count: number of boards, int
+    :param rules: Rules, default Rules()
+    :param seed: random seed, for reproducible boards
+    :return: generator of board strings in the --board format
+    """
+    rng = random.Random(seed)
+    for _ in range(count):
+        terrain = generate_terrain(rules, rng)
+        yield board_string(terrain, generate_numbers(terrain, rules, rng))
+
+
+def reset(board, rules=None):
+    """
+    Reset the board like Board.reset does, but generate whichever of terrain and numbers the
+    board's options make random under the rules. The board's options are left as they were,
+    so resetting again generates a new board.
+
+    :param board: catan.board.Board
+    :param rules: Rules, default Rules()
+    """
+    opts = boardbuilder.get_opts(dict(board.opts))
+    board.reset()
+    random_opts = (boardbuilder.Opt.random, boardbuilder.Opt.debug)
+    random_terrain = opts['terrain'] in random_opts
+    random_numbers = opts['numbers'] in random_opts
+    if opts['board'] is not None or not (random_terrain or random_numbers):
+        return
+
+    terrain = [tile.terrain for tile in board.tiles]
+    if random_terrain:
+        terrain = generate_terrain(rules)
+    if terrain.count(Terrain.desert) != 1:
+        return
+    if random_numbers:
+        numbers = generate_numbers(terrain, rules)
+    else:
+        # like boardbuilder: the same numbers in the same order, skipping the desert
+        numbers = [tile.number.value for tile in board.tiles if tile.number != HexNumber.none]
+        numbers.insert(terrain.index(Terrain.desert), None)
+    board.reset(board=board_string(terrain, numbers))
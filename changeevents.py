@@ -0,0 +1,285 @@
+"""
+module changeevents provides typed events describing what changed in the game, for the views
+
+The game notifies its observers without saying what changed, so every view used to redraw or
+recheck everything on every notify. ChangePublisher is the only view-facing observer of the
+game: on each notify it works out what changed since the last one, and hands each subscriber
+the events of the types it subscribed to, as one batch per notify. A subscriber whose types
+don't change costs nothing.
+
+Events:
+- PiecePlaced(coord, type, owner), PieceRemoved(coord, type, owner): a road, settlement or
+  city. An upgrade is a settlement removed and a city placed at the same coord
+- RobberMoved(old, new): tile identifiers, either can be None
+- BoardEdited(tile_id): a tile's terrain or number changed
+- PortsChanged(): a port was added, removed or changed
+- Rolled(n), TurnEnded(color), TradeMade(color, giving, partner, getting): a new log line (see
+  module logstream for the arguments)
+- LogChanged(): the log changed, including by undo
+- StateChanged(old, new): Phase of the game before and after. Every can_* of the game state
+  depends only on the phase, so views which enable and disable buttons only need this
+- PlayerChanged(old, new): current player's color, None before the game starts
+- UndoApplied(range): positions in the undo history which were undone
+- HistoryChanged(can_undo, can_redo)
+
+Board changes come from a BoardDiff, and log lines are parsed as they're appended, so working
+out what changed costs the same however long the game runs.
+
+The indexes the views query (production, longest road, ports, position hash) subscribe with
+#ChangePublisher.subscribe_index, and get each batch before any view does, so a view can query
+them from its own callback. Kept without a publisher, eg on a game being replayed, an index
+gets the same events from a BoardDiff of its own. For the same
+reason, notifies can be held back while the game changes many times (see ChangePublisher.held),
+and the views then get what changed over all of them as one batch.
+"""
+import collections
+import contextlib
+
+import hexgrid
+from catan.pieces import PieceType
+
+import boardchanges
+import logstream
+from instrumentation import timings
+
+PiecePlaced = collections.namedtuple('PiecePlaced', ['coord', 'type', 'owner'])
+PieceRemoved = collections.namedtuple('PieceRemoved', ['coord', 'type', 'owner'])
+RobberMoved = collections.namedtuple('RobberMoved', ['old', 'new'])
+BoardEdited = collections.namedtuple('BoardEdited', ['tile_id'])
+PortsChanged = collections.namedtuple('PortsChanged', [])
+Rolled = collections.namedtuple('Rolled', ['n'])
+TurnEnded = collections.namedtuple('TurnEnded', ['color'])
+TradeMade = collections.namedtuple('TradeMade', ['color', 'giving', 'partner', 'getting'])
+LogChanged = collections.namedtuple('LogChanged', [])
+StateChanged = collections.namedtuple('StateChanged', ['old', 'new'])
+PlayerChanged = collections.namedtuple('PlayerChanged', ['old', 'new'])
+UndoApplied = collections.namedtuple('UndoApplied', ['range'])
+HistoryChanged = collections.namedtuple('HistoryChanged', ['can_undo', 'can_redo'])
+
+PIECE_EVENTS = (PiecePlaced, PieceRemoved, RobberMoved)
+BOARD_EVENTS = PIECE_EVENTS + (BoardEdited, PortsChanged)
+
+Phase = collections.namedtuple('Phase', ['state', 'piece_type', 'dev_card_state'])
+Phase.__doc__ = """
+state: name of the game state class, eg 'GameStateBeginTurn'
+piece_type: PieceType being placed, for states which place pieces, else None
+dev_card_state: name of the dev card state class
+"""
+
+
+def phase(game):
+    """
+    :param game: catan.game.Game
+    :return: Phase of the game
+    """
+    # GameState answers every unknown attribute from __getattr__, so look in the instance itself
+    return Phase(type(game.state).__name__,
+                 vars(game.state).get('piece_type'),
+                 type(game.dev_card_state).__name__)
+
+
+class BoardDiff(object):
+    """
+    class BoardDiff works out the board events (BOARD_EVENTS) since the last call.
+
+    The first call describes the whole board: every piece placed, every tile edited, and the ports changed.
+    """
+    def __init__(self):
+        self._watcher = boardchanges.BoardWatcher()
+        self._ports = None
+
+    def events(self, board):
+        """
+        :param board: catan.board.Board
+        :return: list of events since the last call
+        """
+        events = list()
+        changes = self._watcher.poll(board)
+        robber = [None, None]
+        for (_, coord), (piece_type, owner) in changes.removed:
+            if piece_type == PieceType.robber:
+                robber[0] = hexgrid.tile_id_from_coord(coord)
+            else:
+                events.append(PieceRemoved(coord, piece_type, owner))
+        for (_, coord), (piece_type, owner) in changes.placed:
+            if piece_type == PieceType.robber:
+                robber[1] = hexgrid.tile_id_from_coord(coord)
+            else:
+                events.append(PiecePlaced(coord, piece_type, owner))
+        if robber != [None, None]:
+            events.append(RobberMoved(*robber))
+        events.extend(BoardEdited(tile_id) for tile_id in changes.edited)
+
+        # ports are cycled in place during setup; there are only nine, so compare them all
+        ports = frozenset((port.tile_id, port.direction, port.type) for port in board.ports)
+        if ports != self._ports:
+            events.append(PortsChanged())
+            self._ports = ports
+        return events
+
+
+class ChangePublisher(object):
+    """
+    class ChangePublisher observes the game and publishes what changed to its subscribers.
+
+    :param game: catan.game.Game
+    """
+    def __init__(self, game):
+        self.game = game
+        self._indexes = collections.defaultdict(list)  # event type -> callbacks, handed events first
+        self._subscribers = collections.defaultdict(list)  # event type -> callbacks
+        self._board = BoardDiff()
+        self._board.events(game.board)
+        self._phase = phase(game)
+        self._player = self._player_color()
+        self._history = self._history_counts()
+        self._log = game.catanlog.dump()
+        self._log_end = self._log.rfind('\n') + 1  # end of the last complete line looked at
+        self._in_header = logstream.START + '\n' not in self._log
+        self._held = 0
+        self.game.observers.add(self)
+
+    def subscribe(self, callback, *event_types):
+        """
+        :param callback: called with the list of events of the given types, in the order they
+        happened, once per notify in which there were any
+        :param event_types: event classes, eg PiecePlaced
+        """
+        for event_type in event_types:
+            if callback not in self._subscribers[event_type]:
+                self._subscribers[event_type].append(callback)
+
+    def subscribe_index(self, callback, *event_types):
+        """
+        Subscribe an index which views query. Indexes are handed each batch before any subscriber is,
+        in the order they subscribed.
+
+        :param callback: called as for #subscribe
+        :param event_types: event classes, eg PiecePlaced
+        """
+        for event_type in event_types:
+            if callback not in self._indexes[event_type]:
+                self._indexes[event_type].append(callback)
+
+    def unsubscribe(self, callback):
+        for callbacks in list(self._indexes.values()) + list(self._subscribers.values()):
+            if callback in callbacks:
+                callbacks.remove(callback)
+
+    @contextlib.contextmanager
+    def held(self):
+        """
+        Hold back publishing while the game changes, eg while many actions are replayed between
+        two frames, and publish what changed over all of them as one batch when done.
+        """
+        self._held += 1
+        try:
+            yield
+        finally:
+            self._held -= 1
+            if not self._held:
+                self.notify(self.game)
+
+    def notify(self, observable):
+        if self._held:
+            return
+        with timings.measure('changes.diff'):
+            events = self.changes()
+        if not events:
+            return
+        for subscribers in (self._indexes, self._subscribers):
+            batches = collections.OrderedDict()
+            for event in events:
+                for callback in subscribers.get(type(event), ()):
+                    batches.setdefault(callback, list()).append(event)
+            for callback, batch in batches.items():
+                callback(batch)
+
+    def changes(self):
+        """
+        :return: list of events since the last call
+        """
+        events = self._board.events(self.game.board)
+        self._log_changes(events)
+
+        new_phase = phase(self.game)
+        if new_phase != self._phase:
+            events.append(StateChanged(self._phase, new_phase))
+            self._phase = new_phase
+        player = self._player_color()
+        if player != self._player:
+            events.append(PlayerChanged(self._player, player))
+            self._player = player
+
+        (done, undone) = history = self._history_counts()
+        if history != self._history:
+            if done < self._history[0] and undone > self._history[1]:
+                events.append(UndoApplied(range(done, self._history[0])))
+            events.append(HistoryChanged(done > 0, undone > 0))
+            self._history = history
+        return events
+
+    def _log_changes(self, events):
+        text = self.game.catanlog.dump()
+        if text is self._log:
+            return
+        extends = self._extends(text)
+        if extends and len(text) == len(self._log) and text[self._log_end:] == self._log[self._log_end:]:
+            return
+        events.append(LogChanged())
+        if not extends:
+            # undo, or a new game: nothing new was logged, skip to the end
+            self._log = text
+            self._log_end = text.rfind('\n') + 1
+            self._in_header = logstream.START + '\n' not in text
+            return
+        end = text.rfind('\n') + 1
+        for line in text[self._log_end:end].split('\n')[:-1]:
+            if line.startswith('catanlog v'):
+                self._in_header = True
+            elif self._in_header:
+                self._in_header = line != logstream.START
+            else:
+                self._log_event(events, logstream.parse_line(line))
+        self._log = text
+        self._log_end = end
+
+    def _extends(self, text):
+        """
+        Whether text is the log we looked at last with more appended. Like module logindex, compare
+        only the first two lines (a new game changes the timestamp line) and the last complete line
+        (undo restores an earlier copy, which is shorter or ends differently), so a notify doesn't
+        cost more as the log grows.
+        """
+        end = self._log_end
+        if end == 0:
+            return True
+        if len(text) < end:
+            return False
+        second = self._log.find('\n', self._log.find('\n', 0, end) + 1, end)
+        head_end = end if second < 0 else second + 1
+        last_start = self._log.rfind('\n', 0, end - 1) + 1
+        return text[:head_end] == self._log[:head_end] and text[last_start:end] == self._log[last_start:end]
+
+    def _log_event(self, events, record):
+        if record.kind == 'roll':
+            events.append(Rolled(record.args[0]))
+        elif record.kind == 'end_turn':
+            events.append(TurnEnded(record.color))
+        elif record.kind == 'trade':
+            giving, _, partner, getting = record.args
+            events.append(TradeMade(record.color, giving, partner, getting))
+
+    def _player_color(self):
+        if not self.game.players:
+            return None
+        return self.game.get_cur_player().color
+
+    def _history_counts(self):
+        """
+        :return: (commands which can be undone, commands which can be redone). An
+        undohistory.UndoHistory can undo the commands it has spilled to disk, too
+        """
+        undo_manager = self.game.undo_manager
+        done = len(undo_manager._undo_stack) + len(getattr(undo_manager, '_spilled', ()))
+        return done, len(undo_manager._redo_stack)
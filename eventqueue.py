@@ -0,0 +1,206 @@
+"""
+module eventqueue provides a second tier of game observers, run off the UI thread
+
+game.observers are notified synchronously, on the Tk thread, inside whatever changed the game, so
+anything slow among them delays the operator's next click. Views have to be there, since they
+draw, but consumers which only record or analyse the game (stats, exporters, loggers) don't.
+
+EventPublisher observes the game itself, and on each change builds an immutable GameEvent and
+offers it to each subscribed consumer's bounded queue. Each consumer runs on its own worker
+thread, or in its own process, and takes events off its queue at its own pace.
+
+When a consumer's queue is full, its policy decides what happens to a new event:
+- DROP_OLDEST: drop the oldest queued event to make room. Every event carries the whole log, so
+  a consumer which only needs the latest state of the game loses nothing but intermediate states
+- DROP_NEWEST: drop the new event
+- BLOCK: wait for room. This is the only policy which can delay the UI, so it's for consumers
+  which must see every event, with a queue long enough that they never fall that far behind
+
+A consumer is an object with on_event(event), and optionally close(), which is called on its
+worker once the events queued before EventPublisher.close() have been handled. A consumer run in a
+process must be picklable; it's pickled into the process before its first event.
+"""
+import collections
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+
+from instrumentation import timings
+
+BLOCK = 'block'
+DROP_OLDEST = 'drop-oldest'
+DROP_NEWEST = 'drop-newest'
+POLICIES = (BLOCK, DROP_OLDEST, DROP_NEWEST)
+
+DEFAULT_MAXSIZE = 64
+
+
+GameEvent = collections.namedtuple('GameEvent', ['seq', 'time', 'log', 'state', 'player', 'turn', 'last_roll'])
+GameEvent.__doc__ = """
+An immutable record of the game after a change.
+
+:param seq: event number, from 0, int
+:param time: time.time() when the event was published, float
+:param log: the game's whole log, str (see catanlog.CatanLog.dump)
+:param state: name of the game state class, eg 'GameStateBeginTurn', str
+:param player: current player's color, str, or None outside of a game
+:param turn: turn number, int
+:param last_roll: int, or None
+"""
+
+
+class EventPublisher(object):
+    """
+    class EventPublisher publishes a GameEvent to its subscribers each time the game changes.
+
+    The game notifies its observers several times during some changes, and some notifies change
+    nothing; an event is only published when one of its fields other than seq and time changed.
+
+    :param game: catan.game.Game
+    """
+    def __init__(self, game):
+        self.game = game
+        self._subscriptions = list()
+        self._seq = 0
+        self._last = None
+        self.game.observers.add(self)
+
+    def subscribe(self, consumer, name=None, maxsize=DEFAULT_MAXSIZE, policy=DROP_OLDEST, process=False):
+        """
+        Start a worker for the consumer, and offer it every event published from now on.
+
+        :param consumer: object with on_event(event), and optionally close()
+        :param name: name for the worker and its timings, str, default the consumer's class name
+        :param maxsize: events the consumer's queue holds, int
+        :param policy: one of POLICIES, what to do with an event when the queue is full
+        :param process: run the consumer in its own process rather than on a thread, bool
+        """
+        if policy not in POLICIES:
+            raise ValueError('policy must be one of {}, got {}'.format(POLICIES, policy))
+        name = name or type(consumer).__name__
+        if process:
+            subscription = _ProcessSubscription(consumer, name, maxsize, policy)
+        else:
+            subscription = _ThreadSubscription(consumer, name, maxsize, policy)
+        self._subscriptions.append(subscription)
+        if self._last is not None:
+            subscription.offer(self._last)
+
+    def notify(self, observable):
+        if not self._subscriptions:
+            return
+        with timings.measure('events.publish'):
+            game = self.game
+            player = game.get_cur_player() if game.state.is_in_game() else None
+            fields = (game.catanlog.dump(), type(game.state).__name__, getattr(player, 'color', None),
+                      game._cur_turn, game.last_roll)
+            if self._last is not None and fields == self._last[2:]:
+                return
+            self._last = GameEvent(self._seq, time.time(), *fields)
+            self._seq += 1
+            for subscription in self._subscriptions:
+                subscription.offer(self._last)
+
+    def stats(self):
+        """
+        :return: list of (name, events queued, events dropped), one per subscriber. With DROP_OLDEST, an
+        event can be queued and then dropped
+        """
+        return [(s.name, s.queued, s.dropped) for s in self._subscriptions]
+
+    def close(self, timeout=None):
+        """
+        Stop publishing, and wait for each consumer to handle the events already queued for it.
+
+        :param timeout: seconds to wait for each consumer, float, or None to wait as long as it takes
+        """
+        self.game.observers.discard(self)
+        for subscription in self._subscriptions:
+            subscription.close(timeout)
+            logging.info('eventqueue: {} queued {} events, dropped {}'.format(
+                subscription.name, subscription.queued, subscription.dropped))
+        self._subscriptions = list()
+
+
+class _Subscription(object):
+    """
+    A consumer's queue, and the policy for offering events to it. The queue's get side belongs
+    to the worker; offer is only called from the thread which publishes.
+    """
+    def __init__(self, name, events, policy):
+        self.name = name
+        self.policy = policy
+        self.queued = 0
+        self.dropped = 0
+        self._events = events
+
+    def offer(self, event):
+        if self.policy == BLOCK:
+            self._events.put(event)
+            self.queued += 1
+            return
+        try:
+            self._events.put_nowait(event)
+            self.queued += 1
+            return
+        except queue.Full:
+            pass
+        self.dropped += 1
+        if self.policy == DROP_OLDEST:
+            try:
+                self._events.get_nowait()
+            except queue.Empty:
+                self.dropped -= 1  # the worker took it in the meantime
+            try:
+                self._events.put_nowait(event)
+                self.queued += 1
+            except queue.Full:
+                self.dropped += 1
+
+
+class _ThreadSubscription(_Subscription):
+    def __init__(self, consumer, name, maxsize, policy):
+        super(_ThreadSubscription, self).__init__(name, queue.Queue(maxsize), policy)
+        self._thread = threading.Thread(target=_run, args=(consumer, self._events, 'events.' + name),
+                                        name='eventqueue-' + name, daemon=True)
+        self._thread.start()
+
+    def close(self, timeout):
+        self._events.put(None)
+        self._thread.join(timeout)
+
+
+class _ProcessSubscription(_Subscription):
+    def __init__(self, consumer, name, maxsize, policy):
+        context = multiprocessing.get_context('spawn')
+        super(_ProcessSubscription, self).__init__(name, context.Queue(maxsize), policy)
+        self._process = context.Process(target=_run, args=(consumer, self._events, None),
+                                        name='eventqueue-' + name, daemon=True)
+        self._process.start()
+
+    def close(self, timeout):
+        self._events.put(None)
+        self._process.join(timeout)
+
+
+def _run(consumer, events, timing_name):
+    """
+    Worker loop: hand each event to the consumer until the None which close() queues.
+    Timings are only recorded on threads, since a process's timings aren't the spectator's.
+    """
+    while True:
+        event = events.get()
+        if event is None:
+            break
+        try:
+            if timing_name is None:
+                consumer.on_event(event)
+            else:
+                with timings.measure(timing_name):
+                    consumer.on_event(event)
+        except Exception:
+            logging.exception('eventqueue: {} failed on event {}'.format(type(consumer).__name__, event.seq))
+    if hasattr(consumer, 'close'):
+        consumer.close()
@@ -0,0 +1,173 @@
+"""
+module fairness provides vectorized fairness scores for candidate board layouts
+
+Boards are encoded as fixed-size numpy arrays, one row per board:
+- pips (board, tile): pips (ways out of 36 to roll) of each tile's number, 0 for the desert
+- terrain (board, tile, resource): one-hot resource of each tile, all zeros for the desert
+- numbers (board, tile): each tile's number, 0 for the desert
+- ports (board, node, port type): one-hot type of the port at each node, if any
+
+and scored together against incidence matrices precomputed once from module gridtables:
+- NODE_TILE (node, tile): 1 where a node is a corner of a tile
+- TILE_TILE (tile, tile): 1 where two tiles are adjacent
+
+Metrics, lower is fairer:
+- resource_imbalance: max - min over resources of mean pips per tile of that resource
+- best_spot_spread: pips at the best node minus pips at the 8th best (the 8 opening settlements)
+- port_synergy: most pips of a resource around a 2:1 port for that resource
+- number_clustering: sum over adjacent tile pairs of the product of their pips, relative to the mean
+- same_numbers: adjacent tile pairs with the same number
+
+and score, a weighted sum of the metrics, each divided by its typical spread over random boards.
+"""
+import collections
+
+import hexgrid
+import numpy
+from catan.board import Terrain, PortType
+
+import gridtables
+
+RESOURCES = [Terrain.wood, Terrain.brick, Terrain.wheat, Terrain.sheep, Terrain.ore]
+PORT_TYPES = [PortType.any3] + [PortType(t.value) for t in RESOURCES]
+
+NUM_TILES = len(gridtables.TILE_IDS)
+NUM_NODES = len(gridtables.NODES)
+NODE_INDEX = dict((node, i) for i, node in enumerate(gridtables.NODES))
+
+NODE_TILE = numpy.zeros((NUM_NODES, NUM_TILES))
+for _node, _i in NODE_INDEX.items():
+    for _tile_id in gridtables.NODE_TILES[_node]:
+        NODE_TILE[_i, _tile_id - 1] = 1
+
+TILE_TILE = numpy.zeros((NUM_TILES, NUM_TILES))
+for _tile_id in gridtables.TILE_IDS:
+    for _neighbour in gridtables.TILE_NEIGHBOURS[_tile_id]:
+        TILE_TILE[_tile_id - 1, _neighbour - 1] = 1
+
+_PIPS = numpy.zeros(13)
+for _number, _pips in gridtables.PIPS.items():
+    _PIPS[_number] = _pips
+
+_short_forms = {'w': Terrain.wood, 'b': Terrain.brick, 'h': Terrain.wheat,
+                's': Terrain.sheep, 'o': Terrain.ore, 'd': Terrain.desert}
+
+# the typical spread of each metric over random boards, and its weight in the score
+METRICS = collections.OrderedDict([
+    ('resource_imbalance', (0.6, 1.0)),
+    ('best_spot_spread', (0.7, 1.0)),
+    ('port_synergy', (2.0, 0.5)),
+    ('number_clustering', (0.06, 1.0)),
+    ('same_numbers', (1.0, 0.5)),
+])
+
+EncodedBoards = collections.namedtuple('EncodedBoards', ['pips', 'terrain', 'numbers', 'ports'])
+
+Scores = collections.namedtuple('Scores', ['score'] + list(METRICS))
+Scores.__doc__ = """
+Each field is an array with one entry per board. Use #rank to sort boards by score.
+"""
+
+
+def encode(boards, ports=None):
+    """
+    :param boards: list of catan.board.Board, or of board strings in the --board format
+    :param ports: list of catan.board.Port for board strings, which don't include ports. Default
+    the ports of a board built with --ports preset.
+    :return: EncodedBoards
+    """
+    if ports is None:
+        from catan.board import Board
+        ports = Board(terrain='preset', numbers='preset', ports='preset', pieces='empty').ports
+    default_ports = _encode_ports(ports)
+
+    numbers = numpy.zeros((len(boards), NUM_TILES), dtype=int)
+    terrain = numpy.zeros((len(boards), NUM_TILES, len(RESOURCES)))
+    encoded_ports = numpy.zeros((len(boards), NUM_NODES, len(PORT_TYPES)))
+    for b, board in enumerate(boards):
+        if isinstance(board, str):
+            codes = board.split()
+            tile_terrain = [_short_forms[code] for code in codes[:NUM_TILES]]
+            tile_numbers = [0 if code == 'None' else int(code) for code in codes[NUM_TILES:2 * NUM_TILES]]
+            encoded_ports[b] = default_ports
+        else:
+            tile_terrain = [tile.terrain for tile in board.tiles]
+            tile_numbers = [tile.number.value or 0 for tile in board.tiles]
+            encoded_ports[b] = _encode_ports(board.ports)
+        numbers[b] = tile_numbers
+        for t, tile_type in enumerate(tile_terrain):
+            if tile_type in RESOURCES:
+                terrain[b, t, RESOURCES.index(tile_type)] = 1
+    return EncodedBoards(pips=_PIPS[numbers], terrain=terrain, numbers=numbers, ports=encoded_ports)
+
+
+def _encode_ports(ports):
+    encoded = numpy.zeros((NUM_NODES, len(PORT_TYPES)))
+    for port in ports:
+        if port.type not in PORT_TYPES:
+            continue
+        edge = hexgrid.edge_coord_in_direction(port.tile_id, port.direction)
+        for node in hexgrid.nodes_touching_edge(edge):
+            encoded[NODE_INDEX[node], PORT_TYPES.index(port.type)] = 1
+    return encoded
+
+
+def score(encoded):
+    """
+    Score every encoded board in one pass.
+
+    :param encoded: EncodedBoards
+    :return: Scores
+    """
+    pips, terrain, numbers, ports = encoded
+
+    # (board, resource): pips per resource, and per tile of that resource
+    resource_pips = numpy.einsum('bt,btr->br', pips, terrain)
+    resource_tiles = numpy.maximum(terrain.sum(axis=1), 1)
+    pips_per_tile = resource_pips / resource_tiles
+    resource_imbalance = pips_per_tile.max(axis=1) - pips_per_tile.min(axis=1)
+
+    node_pips = pips @ NODE_TILE.T
+    best = -numpy.sort(-node_pips, axis=1)
+    best_spot_spread = best[:, 0] - best[:, 7]
+
+    # (board, node, resource): pips of each resource at each node, against 2:1 ports for it
+    node_resource_pips = numpy.matmul(NODE_TILE, pips[:, :, numpy.newaxis] * terrain)
+    port_synergy = (node_resource_pips * ports[:, :, 1:]).max(axis=(1, 2))
+
+    adjacent_pips = ((pips @ TILE_TILE) * pips).sum(axis=1) / 2
+    mean_pips = pips.sum(axis=1) / NUM_TILES
+    pairs = TILE_TILE.sum() / 2
+    number_clustering = adjacent_pips / (pairs * mean_pips ** 2) - 1
+
+    same = (numbers[:, :, numpy.newaxis] == numbers[:, numpy.newaxis, :]) & (numbers[:, :, numpy.newaxis] > 0)
+    same_numbers = (same * TILE_TILE).sum(axis=(1, 2)) / 2
+
+    metrics = collections.OrderedDict([
+        ('resource_imbalance', resource_imbalance),
+        ('best_spot_spread', best_spot_spread),
+        ('port_synergy', port_synergy),
+        ('number_clustering', number_clustering),
+        ('same_numbers', same_numbers),
+    ])
+    total = sum(weight * metrics[name] / spread for name, (spread, weight) in METRICS.items())
+    return Scores(score=total, **metrics)
+
+
+def rank(scores):
+    """
+    :param scores: Scores
+    :return: array of board indexes, fairest first
+    """
+    return numpy.argsort(scores.score, kind='stable')
+
+
+def describe(scores, i):
+    """
+    :param scores: Scores
+    :param i: board index, int
+    :return: one line summary of the board's scores, str
+    """
+    return 'score={:.2f} '.format(scores.score[i]) + ' '.join(
+        '{}={:.2f}'.format(name, getattr(scores, name)[i]) for name in METRICS
+    )
@@ -0,0 +1,36 @@
+"""
+module gridtables provides adjacency tables for the catan hexgrid, precomputed once at import
+
+Module hexgrid computes adjacency on every call (and logs while doing it). These tables answer
+the same questions with a dictionary lookup.
+
+Currently, it provides
+- TILE_IDS, NODES, EDGES: every legal tile identifier, node coordinate and edge coordinate, sorted
+- TILE_NODES, TILE_EDGES, TILE_NEIGHBOURS: tile identifier -> adjacent nodes, edges, tiles
+- NODE_TILES, NODE_EDGES, NODE_NEIGHBOURS: node coordinate -> adjacent tiles, edges, nodes
+- EDGE_NODES: edge coordinate -> the two nodes at its ends
+- COAST: every coastal port slot, (tile identifier, direction), in hexgrid.coastal_coords() order
+- COAST_NODES: coastal port slot -> the two nodes a port there serves
+- PIPS: dice number -> number of ways to roll it (out of 36)
+"""
+import hexgrid
+
+TILE_IDS = sorted(hexgrid.legal_tile_ids())
+NODES = sorted(hexgrid.legal_node_coords())
+EDGES = sorted(hexgrid.legal_edge_coords())
+
+TILE_NODES = dict((tile_id, tuple(hexgrid.nodes_touching_tile(tile_id))) for tile_id in TILE_IDS)
+TILE_EDGES = dict((tile_id, tuple(hexgrid.edges_touching_tile(tile_id))) for tile_id in TILE_IDS)
+TILE_NEIGHBOURS = dict((tile_id, tuple(t for t in TILE_IDS if t != tile_id and set(TILE_EDGES[t]) & set(TILE_EDGES[tile_id])))
+                       for tile_id in TILE_IDS)
+
+NODE_TILES = dict((node, tuple(t for t in TILE_IDS if node in TILE_NODES[t])) for node in NODES)
+EDGE_NODES = dict((edge, tuple(hexgrid.nodes_touching_edge(edge))) for edge in EDGES)
+NODE_EDGES = dict((node, tuple(e for e in EDGES if node in EDGE_NODES[e])) for node in NODES)
+NODE_NEIGHBOURS = dict((node, tuple(n for e in NODE_EDGES[node] for n in EDGE_NODES[e] if n != node))
+                       for node in NODES)
+
+COAST = tuple(hexgrid.coastal_coords())
+COAST_NODES = dict((slot, EDGE_NODES[hexgrid.edge_coord_in_direction(*slot)]) for slot in COAST)
+
+PIPS = {2: 1, 3: 2, 4: 3, 5: 4, 6: 5, 8: 5, 9: 4, 10: 3, 11: 2, 12: 1}
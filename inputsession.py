@@ -0,0 +1,288 @@
+"""
+module inputsession provides recording and replay of the operator's raw input, for reproducing bugs and slowdowns
+
+Recorder captures every mouse button, key, motion, enter and leave event the spectator's
+widgets get, with its time, the widget's path and the event's coordinates in the widget (for
+the board, canvas coordinates, since the canvas doesn't scroll). It puts its own bindtag first
+on every widget, so it sees events before any binding can stop them, and so that it doesn't
+shadow the bind_all shortcuts, which a generic binding on 'all' would.
+
+Player injects a recorded session back into a spectator with event_generate, at the original
+pace or as fast as it goes, and times each event's handlers, including the redraws they cause.
+Widget paths are the same in every run with the same options, so a session replays onto a fresh
+spectator started with the same options. The header records the random seed the recording
+spectator was started with, which the replaying one is seeded with, so random boards, Reset Board
+and the like come out the same.
+
+Native dialogs (message boxes) and the menus of option menus on some platforms don't go through
+Tk's bindings, so what's done in them isn't recorded.
+
+Files are gzipped text:
+    catan-input v1 {"seed": 1234, "argv": [...], "recorded": "2016-01-01T12:00:00"}
+    w <id> <path>                                   a widget path, before its first event
+    <ms since the previous event> <kind> <widget id> <x> <y> <detail>
+kind is one of EVENT_KINDS; detail is the button number for presses and releases, the keysym
+for keys, and - otherwise. Fields are separated by tabs.
+
+Usage:
+    $ python3 main.py --record-input session.input.gz
+    $ python3 main.py --replay-input session.input.gz --replay-speed max
+"""
+import collections
+import datetime
+import gzip
+import json
+import logging
+import time
+
+import tkinterutils
+from instrumentation import timings
+
+MAGIC = 'catan-input v1'
+BINDTAG = 'InputRecorder'
+RETAG_MS = 1000  # how often to tag widgets created since recording started
+
+# kind -> (event sequence to bind, event type to generate)
+EVENT_KINDS = collections.OrderedDict([
+    ('P', ('<ButtonPress>', 'ButtonPress')),
+    ('R', ('<ButtonRelease>', 'ButtonRelease')),
+    ('K', ('<KeyPress>', 'KeyPress')),
+    ('M', ('<Motion>', 'Motion')),
+    ('E', ('<Enter>', 'Enter')),
+    ('L', ('<Leave>', 'Leave')),
+])
+
+InputEvent = collections.namedtuple('InputEvent', ['time', 'kind', 'widget', 'x', 'y', 'detail'])
+InputEvent.__doc__ = """
+time: seconds since recording started, float
+kind: one of EVENT_KINDS, str
+widget: Tk path of the widget, str
+x, y: coordinates in the widget, int
+detail: button number (int) for P and R, keysym (str) for K, None otherwise
+"""
+
+Timing = collections.namedtuple('Timing', ['index', 'event', 'seconds', 'late'])
+Timing.__doc__ = """
+index: position of the event in the session, int
+event: InputEvent
+seconds: time spent in the event's handlers and the redraws they caused, float
+late: seconds the event was injected after its time in the session, float, 0 at max speed
+"""
+
+
+class SessionError(ValueError):
+    pass
+
+
+def _read_header(fp, path):
+    first = fp.readline().rstrip('\n')
+    if not first.startswith(MAGIC):
+        raise SessionError('{} is not a recorded input session'.format(path))
+    return json.loads(first[len(MAGIC):] or '{}')
+
+
+def read_header(path):
+    """
+    :param path: path of a recorded session
+    :return: the session's header, dict
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as fp:
+        return _read_header(fp, path)
+
+
+def read_session(path):
+    """
+    :param path: path of a recorded session
+    :return: (header dict, list of InputEvent)
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as fp:
+        header = _read_header(fp, path)
+        widgets = dict()
+        events = list()
+        elapsed = 0
+        for line in fp:
+            fields = line.rstrip('\n').split('\t')
+            if fields[0] == 'w':
+                widgets[fields[1]] = fields[2]
+                continue
+            ms, kind, widget, x, y, detail = fields
+            elapsed += int(ms)
+            if kind in 'PR':
+                detail = int(detail)
+            elif detail == '-':
+                detail = None
+            events.append(InputEvent(elapsed / 1000.0, kind, widgets[widget], int(x), int(y), detail))
+    return header, events
+
+
+class Recorder(object):
+    """
+    class Recorder records the input events of a Tk application to a file.
+
+    :param root: the application's root widget, or any widget whose descendants to record
+    :param path: file to write, gzipped
+    :param header: dict of things to remember about the session, eg the random seed
+    """
+    def __init__(self, root, path, header=None):
+        self.root = root
+        self.path = path
+        self.header = dict(header or {}, recorded=datetime.datetime.now().isoformat(timespec='seconds'))
+        self.count = 0
+        self._fp = None
+        self._widgets = dict()  # path -> id
+        self._last_ms = 0
+        self._start = None
+        self._retag = None
+
+    def start(self):
+        self._fp = gzip.open(self.path, 'wt', encoding='utf-8')
+        self._fp.write('{} {}\n'.format(MAGIC, json.dumps(self.header)))
+        for kind, (sequence, _) in EVENT_KINDS.items():
+            self.root.bind_class(BINDTAG, sequence, self._recorder(kind))
+        self._start = time.perf_counter()
+        self._tag()
+        logging.info('inputsession: recording to {}'.format(self.path))
+
+    def close(self):
+        if self._fp is None:
+            return
+        if self._retag is not None:
+            self.root.after_cancel(self._retag)
+        for sequence, _ in EVENT_KINDS.values():
+            self.root.unbind_class(BINDTAG, sequence)
+        self._fp.close()
+        self._fp = None
+        logging.info('inputsession: recorded {} events to {}'.format(self.count, self.path))
+
+    def _tag(self):
+        # widgets built later, eg the in-game toolbar, get tagged on the next pass, in case they
+        # weren't built by a click or key
+        tkinterutils.prepend_bindtag(self.root.winfo_toplevel(), BINDTAG)
+        self._retag = self.root.after(RETAG_MS, self._tag)
+
+    def _tag_now(self):
+        if self._fp is not None:
+            tkinterutils.prepend_bindtag(self.root.winfo_toplevel(), BINDTAG)
+
+    def _recorder(self, kind):
+        def record(event):
+            self._record(kind, event)
+        return record
+
+    def _record(self, kind, event):
+        if self._fp is None:
+            return
+        path = str(event.widget)
+        widget = self._widgets.get(path)
+        if widget is None:
+            widget = self._widgets[path] = len(self._widgets)
+            self._fp.write('w\t{}\t{}\n'.format(widget, path))
+        if kind in 'PR':
+            detail = event.num
+        elif kind == 'K':
+            detail = event.keysym
+        else:
+            detail = '-'
+        ms = int((time.perf_counter() - self._start) * 1000)
+        self._fp.write('{}\t{}\t{}\t{}\t{}\t{}\n'.format(ms - self._last_ms, kind, widget, event.x, event.y, detail))
+        self._last_ms = ms
+        self.count += 1
+        if kind in 'RK':
+            # clicks and keys are what build new widgets, so tag them before the next event can reach them
+            self.root.after_idle(self._tag_now)
+
+
+class Player(object):
+    """
+    class Player replays a recorded session into a Tk application, timing each event.
+
+    :param root: the application's root widget
+    :param events: list of InputEvent, see #read_session
+    :param max_speed: inject each event as soon as the previous one is handled, rather than at
+    its recorded time
+    :param on_done: called with the list of Timing when the session has been replayed
+    """
+    def __init__(self, root, events, max_speed=False, on_done=None):
+        self.root = root
+        self.events = events
+        self.max_speed = max_speed
+        self.on_done = on_done
+        self.timings = list()
+        self.missing = 0
+        self._next = 0
+        self._start = None
+
+    def start(self):
+        self._start = time.perf_counter()
+        self.root.after(0, self._play)
+
+    def _play(self):
+        if self._next >= len(self.events):
+            if self.on_done is not None:
+                self.on_done(self.timings)
+            return
+        index, event = self._next, self.events[self._next]
+        self._next += 1
+        late = 0.0 if self.max_speed else max(0.0, time.perf_counter() - self._start - event.time)
+        seconds = self._inject(event)
+        if seconds is not None:
+            self.timings.append(Timing(index, event, seconds, late))
+            timings.record('input.' + EVENT_KINDS[event.kind][1], seconds)
+
+        if self._next >= len(self.events) or self.max_speed:
+            self.root.after_idle(lambda: self.root.after(0, self._play))
+        else:
+            due = self._start + self.events[self._next].time
+            self.root.after(max(0, int((due - time.perf_counter()) * 1000)), self._play)
+
+    def _inject(self, event):
+        """
+        :return: seconds the event took to handle, or None if its widget doesn't exist
+        """
+        try:
+            widget = self.root.nametowidget(event.widget)
+        except KeyError:
+            self.missing += 1
+            logging.warning('inputsession: no widget {}, skipping {}'.format(event.widget, event))
+            return None
+        event_type = EVENT_KINDS[event.kind][1]
+        start = time.perf_counter()
+        if event.kind in 'PR':
+            widget.event_generate('<{}-{}>'.format(event_type, event.detail), x=event.x, y=event.y)
+        elif event.kind == 'K':
+            # key events go to the focus, as they did when recorded
+            widget.focus_force()
+            widget.event_generate('<KeyPress>', keysym=event.detail, x=event.x, y=event.y)
+        else:
+            widget.event_generate('<{}>'.format(event_type), x=event.x, y=event.y)
+        widget.update_idletasks()
+        return time.perf_counter() - start
+
+
+def format_report(timings_list, missing=0, slowest=5):
+    """
+    :param timings_list: list of Timing, from Player
+    :param missing: number of events skipped because their widget didn't exist
+    :return: str, a few lines: per kind of event, the handler times, and the slowest events
+    """
+    lines = ['{} events replayed, {} skipped'.format(len(timings_list), missing)]
+    by_kind = collections.OrderedDict((kind, list()) for kind in EVENT_KINDS)
+    for timing in timings_list:
+        by_kind[timing.event.kind].append(timing.seconds)
+    for kind, samples in by_kind.items():
+        if not samples:
+            continue
+        samples.sort()
+        lines.append('{:<14} n={:<6} median={:.2f}ms p99={:.2f}ms max={:.2f}ms total={:.0f}ms'.format(
+            EVENT_KINDS[kind][1], len(samples), samples[len(samples) // 2] * 1000,
+            samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, samples[-1] * 1000, sum(samples) * 1000))
+    late = max((timing.late for timing in timings_list), default=0.0)
+    if late:
+        lines.append('injected at most {:.0f}ms after the recorded time'.format(late * 1000))
+    lines.append('slowest:')
+    for timing in sorted(timings_list, key=lambda timing: timing.seconds, reverse=True)[:slowest]:
+        event = timing.event
+        lines.append('  #{} at {:.2f}s: {} {} ({}, {}) {} -> {:.2f}ms'.format(
+            timing.index, event.time, EVENT_KINDS[event.kind][1], event.widget, event.x, event.y,
+            '' if event.detail is None else event.detail, timing.seconds * 1000))
+    return '\n'.join(lines)
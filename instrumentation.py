@@ -0,0 +1,157 @@
+"""
+module instrumentation provides lightweight timing and memory measurements for the spectator
+
+Currently, it provides
+- Timings: named, aggregated wall-clock measurements (count, total, last, max)
+- a module-level Timings instance, timings, shared by the views, main and the event queues'
+  worker threads
+- Sizes: named, sampled memory measurements in bytes (count, last, max)
+- a module-level Sizes instance, sizes
+
+Usage:
+    with instrumentation.timings.measure('startup.board_frame'):
+        ...build the board frame...
+    logging.info(instrumentation.timings.report())
+"""
+import collections
+import contextlib
+import threading
+import time
+
+
+class Timing(object):
+    """
+    class Timing aggregates every measurement recorded under a single name.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.total = 0.0
+        self.last = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.last = seconds
+        self.max = max(self.max, seconds)
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    def __repr__(self):
+        return '{}: last={:.1f}ms mean={:.1f}ms max={:.1f}ms n={}'.format(
+            self.name, self.last * 1000, self.mean() * 1000, self.max * 1000, self.count
+        )
+
+
+class Timings(object):
+    """
+    class Timings keeps named Timing records in the order they were first recorded.
+
+    Timings may be recorded from any thread; recording and reporting are serialized by a lock.
+    """
+    def __init__(self):
+        self._timings = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def measure(self, name):
+        """
+        Context manager which records the wall-clock duration of its body under the given name.
+        :param name: timing name, str, eg 'startup.board_frame'
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def record(self, name, seconds):
+        """
+        Record a duration which was measured elsewhere.
+        :param name: timing name, str
+        :param seconds: duration, float
+        """
+        with self._lock:
+            if name not in self._timings:
+                self._timings[name] = Timing(name)
+            self._timings[name].add(seconds)
+
+    def get(self, name):
+        """
+        :param name: timing name, str
+        :return: Timing, or None if nothing has been recorded under the name
+        """
+        return self._timings.get(name)
+
+    def report(self, prefix=''):
+        """
+        Format every timing whose name starts with the given prefix, one per line.
+        :param prefix: name prefix filter, str, eg 'startup.'
+        :return: str
+        """
+        with self._lock:
+            lines = [repr(t) for name, t in self._timings.items() if name.startswith(prefix)]
+        return '\n'.join(lines)
+
+
+class Size(object):
+    """
+    class Size keeps the samples recorded under a single name.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.count = 0
+        self.last = 0
+        self.max = 0
+
+    def add(self, nbytes):
+        self.count += 1
+        self.last = nbytes
+        self.max = max(self.max, nbytes)
+
+    def __repr__(self):
+        return '{}: last={:.1f}KB max={:.1f}KB n={}'.format(
+            self.name, self.last / 1024, self.max / 1024, self.count
+        )
+
+
+class Sizes(object):
+    """
+    class Sizes keeps named Size records in the order they were first recorded.
+    """
+    def __init__(self):
+        self._sizes = collections.OrderedDict()
+
+    def record(self, name, nbytes):
+        """
+        Record a memory measurement.
+        :param name: size name, str, eg 'undo.in_memory'
+        :param nbytes: size in bytes, int
+        """
+        if name not in self._sizes:
+            self._sizes[name] = Size(name)
+        self._sizes[name].add(nbytes)
+
+    def get(self, name):
+        """
+        :param name: size name, str
+        :return: Size, or None if nothing has been recorded under the name
+        """
+        return self._sizes.get(name)
+
+    def report(self, prefix=''):
+        """
+        Format every size whose name starts with the given prefix, one per line.
+        :param prefix: name prefix filter, str, eg 'undo.'
+        :return: str
+        """
+        lines = [repr(s) for name, s in self._sizes.items() if name.startswith(prefix)]
+        return '\n'.join(lines)
+
+
+timings = Timings()
+sizes = Sizes()
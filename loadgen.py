@@ -0,0 +1,431 @@
+"""
+module loadgen provides a load generator which plays random legal games, for stress-testing the spectator
+
+LoadGenerator plays one action per step through the same game methods the views call when the
+operator clicks: roll, begin_placing then place_road/place_settlement/place_city, move_robber
+and steal, buy_dev_card, play_knight, trade, end_turn, undo and redo. Between games it ends the
+game, resets the board and starts a new one, as the End Game, Reset Board and Start Game buttons do.
+
+It can drive
+- the headless stack: a game with the spectator's undo history and its non-visual observers
+  (see #headless_game), as fast as it goes or at a given rate, with #run_headless
+- a live CatanSpectator, with LiveDriver, which schedules each step with after(), so the views
+  redraw exactly as they would for an operator. A heartbeat timer measures how late the Tk event
+  loop gets round to it, which is the lag an operator would feel.
+
+Either way it reports throughput, time per action (including every observer, and in a live
+spectator every redraw), event loop lag, and memory growth after warming up.
+
+Usage:
+    $ python3 loadgen.py --actions 10000
+    $ python3 loadgen.py --actions 10000 --rate 200
+    $ python3 main.py --load-test 10000 --load-rate 50
+"""
+import argparse
+import collections
+import logging
+import os
+import random
+import sys
+import time
+
+import hexgrid
+from catan.board import Port, PortType, Terrain
+from catan.pieces import PieceType
+from catan.trading import CatanTrade
+
+import gridtables
+from instrumentation import timings
+
+TURNS_PER_GAME = 80  # turns before the generator ends the game and starts another
+UNDO_RATE = 0.03  # chance of an undo, at each step
+REDO_RATE = 0.5  # chance of redoing, at each step after an undo
+WARMUP = 0.1  # fraction of the actions after which memory growth is measured from
+HEARTBEAT_MS = 20
+
+LIMITS = {PieceType.road: 15, PieceType.settlement: 5, PieceType.city: 4}  # per player
+RESOURCES = [Terrain.wood, Terrain.brick, Terrain.wheat, Terrain.sheep, Terrain.ore]
+
+# relative weights of what to do after rolling, when it can be done
+WEIGHTS = collections.OrderedDict([
+    ('road', 3),
+    ('settlement', 2),
+    ('city', 1),
+    ('dev_card', 1),
+    ('knight', 1),
+    ('trade', 2),
+    ('end_turn', 4),
+])
+
+
+Report = collections.namedtuple('Report', ['actions', 'seconds', 'kinds', 'latency', 'lag',
+                                           'rss_start', 'rss_warm', 'rss_end'])
+Report.__doc__ = """
+actions: number of actions played, int
+seconds: wall-clock duration, float
+kinds: collections.Counter of action kind -> count
+latency: (median, 99th percentile, max) seconds per action
+lag: (median, 99th percentile, max) seconds the event loop ran late, or None when headless
+rss_start, rss_warm, rss_end: resident memory in bytes at the start, after warming up, at the end
+"""
+
+
+class LoadGenerator(object):
+    """
+    class LoadGenerator plays random legal actions on a game, one per #step.
+
+    Placements follow the distance rule and extend the player's own roads, and players stop
+    building at the usual limits of 15 roads, 5 settlements and 4 cities, so the board fills
+    up the way a real game's does.
+
+    :param game: catan.game.Game, with an undo manager which can undo
+    :param seed: random seed, int, or None
+    :param new_game: called with no arguments to reset the board and start a game when none is in
+    progress, default #start_game
+    :param turns_per_game: turns before ending the game, int
+    :param undo_rate: chance of an undo at each step, float
+    """
+    def __init__(self, game, seed=None, new_game=None, turns_per_game=TURNS_PER_GAME, undo_rate=UNDO_RATE):
+        self.game = game
+        self.rng = random.Random(seed)
+        self.new_game = new_game or (lambda: start_game(game))
+        self.turns_per_game = turns_per_game
+        self.undo_rate = undo_rate
+        self._undone = False
+
+    def step(self):
+        """
+        Play one action.
+
+        :return: kind of the action, str, eg 'roll' or 'place_road'
+        """
+        game, state, rng = self.game, self.game.state, self.rng
+        if not state.is_in_game():
+            self.new_game()
+            return 'new_game'
+        if self._undone and game.undo_manager.can_redo() and rng.random() < REDO_RATE:
+            game.redo()
+            return 'redo'
+        self._undone = False
+        if game.undo_manager.can_undo() and rng.random() < self.undo_rate:
+            game.undo()
+            self._undone = True
+            return 'undo'
+
+        for piece_type, can_place, place in ((PieceType.road, state.can_place_road, game.place_road),
+                                             (PieceType.settlement, state.can_place_settlement, game.place_settlement),
+                                             (PieceType.city, state.can_place_city, game.place_city)):
+            if can_place():
+                spots = self._spots(piece_type)
+                if spots:
+                    place(rng.choice(spots))
+                    return 'place_' + piece_type.value
+        if state.can_move_robber():
+            game.move_robber(rng.choice([tile_id for tile_id in gridtables.TILE_IDS if tile_id != game.robber_tile]))
+            return 'move_robber'
+        if state.can_steal():
+            stealable = sorted(game.stealable_players(), key=lambda player: player.seat)
+            game.steal(rng.choice(stealable) if stealable else None)
+            return 'steal'
+        if state.can_roll():
+            game.roll(rng.randint(1, 6) + rng.randint(1, 6))
+            return 'roll'
+        if state.is_in_pregame():
+            for piece_type, can_buy in ((PieceType.settlement, state.can_buy_settlement),
+                                        (PieceType.road, state.can_buy_road)):
+                if can_buy():
+                    game.begin_placing(piece_type)
+                    return 'begin_placing'
+            game.end_turn()
+            return 'end_turn'
+        if game._cur_turn >= self.turns_per_game:
+            game.end()
+            return 'end_game'
+        return self._play_turn()
+
+    def _play_turn(self):
+        game, state, rng = self.game, self.game.state, self.rng
+        choices = list()
+        for piece_type, can_buy in ((PieceType.road, state.can_buy_road),
+                                    (PieceType.settlement, state.can_buy_settlement),
+                                    (PieceType.city, state.can_buy_city)):
+            if can_buy() and self._spots(piece_type):
+                choices.append(piece_type.value)
+        if state.can_buy_dev_card():
+            choices.append('dev_card')
+        if state.can_play_knight():
+            choices.append('knight')
+        if state.can_trade():
+            choices.append('trade')
+        if state.can_end_turn() or not choices:
+            choices.append('end_turn')
+        choice = rng.choices(choices, weights=[WEIGHTS[choice] for choice in choices])[0]
+
+        if choice in ('road', 'settlement', 'city'):
+            game.begin_placing(PieceType(choice))
+            return 'begin_placing'
+        elif choice == 'dev_card':
+            game.buy_dev_card()
+        elif choice == 'knight':
+            game.play_knight()
+        elif choice == 'trade':
+            game.trade(self._trade())
+        elif choice == 'end_turn':
+            game.end_turn()
+        return choice
+
+    def _trade(self):
+        """
+        :return: a one for one trade with another player, or four for one with the bank, as the
+        trade wizard builds them
+        """
+        game, rng = self.game, self.rng
+        player = game.get_cur_player()
+        trade = CatanTrade(giver=player)
+        giving, getting = rng.sample(RESOURCES, 2)
+        others = [other for other in game.players if other != player]
+        if others and rng.random() < 0.7:
+            trade.set_getter(rng.choice(others))
+            trade.give(giving, num=1)
+        else:
+            trade.set_getter(Port(1, 'OO', PortType.any4))
+            trade.give(giving, num=4)
+        trade.get(getting, num=1)
+        return trade
+
+    def _spots(self, piece_type):
+        """
+        :return: list of the coords where the current player can put a piece of the type
+        """
+        game = self.game
+        player = game.get_cur_player()
+        pieces = game.board.pieces
+        mine = [(hex_type, coord, piece.type) for (hex_type, coord), piece in pieces.items()
+                if piece.owner == player]
+        if sum(1 for _, _, t in mine if t == piece_type) >= LIMITS[piece_type]:
+            return list()
+        if piece_type == PieceType.city:
+            return [coord for _, coord, t in mine if t == PieceType.settlement]
+        buildings = set(coord for hex_type, coord, t in mine if hex_type == hexgrid.NODE)
+        roads = set(coord for hex_type, coord, t in mine if hex_type == hexgrid.EDGE)
+        if piece_type == PieceType.settlement:
+            spots = [node for node in gridtables.NODES
+                     if (hexgrid.NODE, node) not in pieces
+                     and not any((hexgrid.NODE, n) in pieces for n in gridtables.NODE_NEIGHBOURS[node])]
+            if game.state.is_in_pregame():
+                return spots
+            return [node for node in spots if any(edge in roads for edge in gridtables.NODE_EDGES[node])]
+        # roads extend from the player's own buildings and roads; in the pregame, from the
+        # settlement without a road yet
+        if game.state.is_in_pregame():
+            nodes = [node for node in buildings if not any(edge in roads for edge in gridtables.NODE_EDGES[node])]
+        else:
+            nodes = buildings | set(node for edge in roads for node in gridtables.EDGE_NODES[edge])
+        return sorted(set(edge for node in nodes for edge in gridtables.NODE_EDGES[node]
+                          if (hexgrid.EDGE, edge) not in pieces))
+
+
+def start_game(game, rules=None):
+    """
+    Reset the board and start a game with the debug players, as Reset Board and Start Game do.
+    """
+    import boardgen
+    boardgen.reset(game.board, rules)
+    game.notify_observers()
+    game.start(game.get_debug_players())
+
+
+def headless_game():
+    """
+    :return: a catan.game.Game set up like the spectator's, with its undo history and non-visual
+    observers, logging to memory
+    """
+    import catanlog
+    from catan.board import Board
+    from catan.game import Game
+    import changeevents
+    import longestroad
+    import portindex
+    import production
+    import undohistory
+    import zobrist
+
+    board = Board(terrain='random', numbers='random', ports='preset', pieces='preset', players='preset')
+    game = Game(board=board, logging='off')
+    game.catanlog = catanlog.CatanLog(auto_flush=False)
+    game.undo_manager = undohistory.UndoHistory()
+    # the publisher observes the game, which keeps it, and it keeps the indexes
+    changes = changeevents.ChangePublisher(game)
+    production.ProductionIndex(game, changes)
+    longestroad.LongestRoadIndex(game, changes)
+    portindex.PortIndex(game, changes)
+    zobrist.ZobristIndex(game, changes)
+    return game
+
+
+def rss():
+    """
+    :return: resident memory of this process in bytes, int. Where /proc isn't available, the peak
+    """
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def _spread(samples):
+    """
+    :return: (median, 99th percentile, max) of the samples, or None if there are none
+    """
+    if not samples:
+        return None
+    samples = sorted(samples)
+    return (samples[len(samples) // 2], samples[min(len(samples) - 1, int(len(samples) * 0.99))], samples[-1])
+
+
+class _Recorder(object):
+    """
+    Times each step of a generator, and samples memory as the run goes.
+    """
+    def __init__(self, generator, actions):
+        self.generator = generator
+        self.actions = actions
+        self.done = 0
+        self.kinds = collections.Counter()
+        self.latencies = list()
+        self.rss_start = self.rss_warm = rss()
+        self.start = time.perf_counter()
+
+    def step(self):
+        start = time.perf_counter()
+        kind = self.generator.step()
+        elapsed = time.perf_counter() - start
+        timings.record('load.' + kind, elapsed)
+        self.latencies.append(elapsed)
+        self.kinds[kind] += 1
+        self.done += 1
+        if self.done == max(1, int(self.actions * WARMUP)):
+            self.rss_warm = rss()
+        return self.done < self.actions
+
+    def report(self, lags=None):
+        return Report(self.done, time.perf_counter() - self.start, self.kinds, _spread(self.latencies),
+                      _spread(lags) if lags is not None else None, self.rss_start, self.rss_warm, rss())
+
+
+def run_headless(actions, rate=None, seed=None, game=None):
+    """
+    :param actions: number of actions to play, int
+    :param rate: actions per second, float, or None for as fast as possible
+    :param seed: random seed, int, or None
+    :param game: catan.game.Game, default a new #headless_game
+    :return: Report
+    """
+    game = game or headless_game()
+    recorder = _Recorder(LoadGenerator(game, seed=seed), actions)
+    due = time.perf_counter()
+    while recorder.step():
+        if rate:
+            due += 1.0 / rate
+            time.sleep(max(0.0, due - time.perf_counter()))
+    return recorder.report()
+
+
+class LiveDriver(object):
+    """
+    class LiveDriver plays a LoadGenerator's actions on a live spectator's Tk event loop.
+
+    :param widget: any widget of the spectator, whose after() schedules the steps
+    :param generator: LoadGenerator
+    :param actions: number of actions to play, int
+    :param rate: actions per second, float, or None for as fast as the event loop allows
+    :param on_done: called with the Report when done
+    """
+    def __init__(self, widget, generator, actions, rate, on_done):
+        self.widget = widget
+        self.generator = generator
+        self.actions = actions
+        self.rate = rate
+        self.on_done = on_done
+        self._recorder = None
+        self._lags = list()
+        self._running = False
+        self._due = None
+        self._beat_due = None
+
+    def start(self):
+        self._running = True
+        self._recorder = _Recorder(self.generator, self.actions)
+        self._lags = list()
+        self._due = time.perf_counter()
+        self._beat_due = self._due
+        self.widget.after(0, self._step)
+        self.widget.after(HEARTBEAT_MS, self._heartbeat)
+
+    def _step(self):
+        if not self._running:
+            return
+        try:
+            more = self._recorder.step()
+        except Exception:
+            logging.exception('loadgen: action {} failed'.format(self._recorder.done + 1))
+            more = False
+        if not more:
+            self._running = False
+            report = self._recorder.report(self._lags)
+            logging.info('loadgen: done\n{}'.format(format_report(report)))
+            self.on_done(report)
+            return
+        if self.rate:
+            self._due += 1.0 / self.rate
+            self.widget.after(max(0, int((self._due - time.perf_counter()) * 1000)), self._step)
+        else:
+            # let the event loop redraw and handle input between actions, as it would for clicks
+            self.widget.after_idle(lambda: self.widget.after(0, self._step))
+
+    def _heartbeat(self):
+        if not self._running:
+            return
+        now = time.perf_counter()
+        self._beat_due += HEARTBEAT_MS / 1000.0
+        self._lags.append(max(0.0, now - self._beat_due))
+        self._beat_due = max(self._beat_due, now)
+        self.widget.after(HEARTBEAT_MS, self._heartbeat)
+
+
+def format_report(report):
+    """
+    :param report: Report
+    :return: str, a few lines
+    """
+    lines = ['{} actions in {:.1f}s, {:.0f} actions/s'.format(
+        report.actions, report.seconds, report.actions / report.seconds if report.seconds else 0)]
+    lines.append('per action: median={:.2f}ms p99={:.2f}ms max={:.2f}ms'.format(*(s * 1000 for s in report.latency)))
+    if report.lag is not None:
+        lines.append('event loop lag: median={:.1f}ms p99={:.1f}ms max={:.1f}ms'.format(*(s * 1000 for s in report.lag)))
+    lines.append('memory: {:.1f}MB at start, {:.1f}MB after warming up, {:.1f}MB at the end ({:+.1f}MB)'.format(
+        report.rss_start / 2 ** 20, report.rss_warm / 2 ** 20, report.rss_end / 2 ** 20,
+        (report.rss_end - report.rss_warm) / 2 ** 20))
+    lines.append('actions: ' + ', '.join('{} {}'.format(kind, n) for kind, n in report.kinds.most_common()))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='play random legal games on the headless spectator stack')
+    parser.add_argument('--actions', type=int, default=10000, help='actions to play, default 10000')
+    parser.add_argument('--rate', type=float, help='actions per second, default as fast as possible')
+    parser.add_argument('--seed', type=int, help='random seed')
+    args = parser.parse_args(argv)
+
+    # module catan warns about every state it has no check for, and sets up logging on import
+    logging.basicConfig(format='%(levelname)s:%(module)s:%(message)s', level=logging.ERROR, force=True)
+    report = run_headless(args.actions, args.rate, args.seed)
+    print(format_report(report))
+    print(timings.report('load.'))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,409 @@
+"""
+module logdiff provides a diff and merge of two transcriptions of the same game, for QA
+
+For important games two operators transcribe independently, and their logs are reconciled
+afterwards. The logs are aligned line by line with Myers' O(ND) difference algorithm, in its
+linear space form: the middle snake of the edit path splits the problem in two, so memory is
+linear in the length of the logs and time is proportional to the logs times the number of
+differences, which between two transcriptions of one game is small.
+
+Lines which only differ in what no two operators agree on are the same: the timestamp, and the
+seconds in 'ends turn after Ns'.
+
+Then both logs are replayed (see module replay) along the alignment to find the first point
+where the games diverge. Replaying the same line onto the same position gives the same position,
+so positions are only compared (with zobrist.ZobristIndex.position_hash, the turn and the last
+roll) after each run of lines that differ, and logs that align without differences aren't
+replayed at all. The spectator doesn't know hands, so a trade that only one operator logged
+doesn't diverge the games; it's still a difference, and a conflict in the merge.
+
+The merged log is the first log, with git-style conflict markers around each run of lines that
+differ:
+    <<<<<<< a.catan
+    red rolls 6
+    =======
+    red rolls 8
+    >>>>>>> b.catan
+
+Usage:
+    $ python3 logdiff.py diff alice/2016-01-01T12-00-00-a-b-c-d.catan bob/2016-01-01T12-00-07-a-b-c-d.catan
+    $ python3 logdiff.py diff a.catan b.catan --merge merged.catan
+    $ python3 logdiff.py dir alice/ bob/ --merge-dir merged/
+"""
+import argparse
+import collections
+import logging
+import os
+import re
+import sys
+import time
+
+import replay
+import zobrist
+
+Opcode = collections.namedtuple('Opcode', ['tag', 'a_lo', 'a_hi', 'b_lo', 'b_hi'])
+Opcode.__doc__ = """
+One run of an alignment, as in difflib.SequenceMatcher.get_opcodes.
+
+tag: 'equal', 'replace', 'delete' (lines only in a) or 'insert' (lines only in b)
+a_lo, a_hi: the run's lines of a, a[a_lo:a_hi], from 0
+b_lo, b_hi: the run's lines of b
+"""
+
+Divergence = collections.namedtuple('Divergence', ['a_line', 'b_line', 'reason'])
+Divergence.__doc__ = """
+a_line, b_line: line numbers (from 1) in each log after which the games differ
+reason: str
+"""
+
+Comparison = collections.namedtuple('Comparison', ['opcodes', 'conflicts', 'divergence'])
+Comparison.__doc__ = """
+opcodes: list of Opcode aligning the two logs
+conflicts: number of runs of lines which differ
+divergence: Divergence, or None if the games never diverge
+"""
+
+_timestamp = re.compile(r'^timestamp: ')
+_end_turn = re.compile(r'^(\w+ ends turn) after \d+s$')
+
+
+def _normalize(line):
+    line = line.rstrip('\n')
+    if _timestamp.match(line):
+        return 'timestamp:'
+    return _end_turn.sub(r'\1', line)
+
+
+def _keys(a, b):
+    """
+    :return: (keys of a, keys of b), lists of int, equal where the lines count as the same
+    """
+    ids = dict()
+    return ([ids.setdefault(_normalize(line), len(ids)) for line in a],
+            [ids.setdefault(_normalize(line), len(ids)) for line in b])
+
+
+def align(a, b):
+    """
+    :param a: list of lines
+    :param b: list of lines
+    :return: list of Opcode, covering both lists in order
+    """
+    a_keys, b_keys = _keys(a, b)
+    matches = list()
+    _match(a_keys, 0, len(a_keys), b_keys, 0, len(b_keys), matches)
+    return _opcodes(matches, len(a), len(b))
+
+
+def _match(a, a_lo, a_hi, b, b_lo, b_hi, matches):
+    """
+    Append (i, j) to matches for each line a[i] matched to b[j] in a shortest edit script of
+    a[a_lo:a_hi] into b[b_lo:b_hi], in order.
+    """
+    prefix = list()
+    while a_lo < a_hi and b_lo < b_hi and a[a_lo] == b[b_lo]:
+        prefix.append((a_lo, b_lo))
+        a_lo += 1
+        b_lo += 1
+    suffix = list()
+    while a_lo < a_hi and b_lo < b_hi and a[a_hi - 1] == b[b_hi - 1]:
+        a_hi -= 1
+        b_hi -= 1
+        suffix.append((a_hi, b_hi))
+    matches.extend(prefix)
+    if a_lo < a_hi and b_lo < b_hi:
+        # with the common ends stripped, a single difference leaves one side empty, so d > 1 here
+        x, y, u, v = _middle_snake(a, a_lo, a_hi, b, b_lo, b_hi)
+        _match(a, a_lo, a_lo + x, b, b_lo, b_lo + y, matches)
+        matches.extend((a_lo + i, b_lo + y + i - x) for i in range(x, u))
+        _match(a, a_lo + u, a_hi, b, b_lo + v, b_hi, matches)
+    matches.extend(reversed(suffix))
+
+
+def _middle_snake(a, a_lo, a_hi, b, b_lo, b_hi):
+    """
+    Search for the shortest edit path from both ends at once, until the paths overlap.
+
+    :return: (x, y, u, v): the middle snake of the path goes diagonally from (x, y) to (u, v),
+    relative to (a_lo, b_lo)
+    """
+    n, m = a_hi - a_lo, b_hi - b_lo
+    delta = n - m
+    odd = delta % 2 == 1
+    limit = (n + m + 1) // 2 + 1
+    offset = limit + 1
+    forward = [0] * (2 * offset + 1)  # diagonal k = x - y -> furthest x reached from the start
+    backward = [0] * (2 * offset + 1)  # diagonal k = x - y -> furthest x reached from the end
+    for d in range(limit):
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[offset + k - 1] < forward[offset + k + 1]):
+                x = forward[offset + k + 1]
+            else:
+                x = forward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a_lo + x] == b[b_lo + y]:
+                x += 1
+                y += 1
+            forward[offset + k] = x
+            if odd and -(d - 1) <= delta - k <= d - 1 and x + backward[offset + delta - k] >= n:
+                return x0, y0, x, y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[offset + k - 1] < backward[offset + k + 1]):
+                x = backward[offset + k + 1]
+            else:
+                x = backward[offset + k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[a_hi - 1 - x] == b[b_hi - 1 - y]:
+                x += 1
+                y += 1
+            backward[offset + k] = x
+            if not odd and -d <= delta - k <= d and x + forward[offset + delta - k] >= n:
+                return n - x, m - y, n - x0, m - y0
+    raise AssertionError('no middle snake between a[{}:{}] and b[{}:{}]'.format(a_lo, a_hi, b_lo, b_hi))
+
+
+def _opcodes(matches, n, m):
+    opcodes = list()
+    i = j = 0
+    for a_i, b_j in matches + [(n, m)]:
+        if a_i > i and b_j > j:
+            opcodes.append(Opcode('replace', i, a_i, j, b_j))
+        elif a_i > i:
+            opcodes.append(Opcode('delete', i, a_i, j, j))
+        elif b_j > j:
+            opcodes.append(Opcode('insert', i, i, j, b_j))
+        if a_i < n:
+            if opcodes and opcodes[-1].tag == 'equal':
+                opcodes[-1] = opcodes[-1]._replace(a_hi=a_i + 1, b_hi=b_j + 1)
+            else:
+                opcodes.append(Opcode('equal', a_i, a_i + 1, b_j, b_j + 1))
+        i, j = a_i + 1, b_j + 1
+    return opcodes
+
+
+def compare(a, b):
+    """
+    :param a: list of the lines of a .catan log
+    :param b: list of the lines of another transcription of the same game
+    :return: Comparison
+    """
+    opcodes = align(a, b)
+    conflicts = sum(1 for opcode in opcodes if opcode.tag != 'equal')
+    divergence = _divergence(a, b, opcodes) if conflicts else None
+    return Comparison(opcodes, conflicts, divergence)
+
+
+class _Replay(object):
+    """
+    One log's side of replaying the two along their alignment.
+    """
+    def __init__(self, lines):
+        header, self.start = replay.read_header(lines)
+        self.header = header
+        self.replayer = replay.Replayer(replay.new_game(header))
+        # hashed only when compared, so it needn't be told of every change
+        self.zobrist = zobrist.ZobristIndex(self.replayer.game)
+        self.replayer.game.observers.discard(self.zobrist)
+        self.lines = lines
+
+    def apply(self, lo, hi):
+        for line in self.lines[max(lo, self.start):hi]:
+            if line.strip():
+                self.replayer.apply(line)
+
+    def position(self):
+        game = self.replayer.game
+        return self.zobrist.position_hash(), game._cur_turn, game.last_roll
+
+
+def _divergence(a, b, opcodes):
+    try:
+        sides = _Replay(a), _Replay(b)
+    except replay.ReplayError as e:
+        return Divergence(0, 0, 'unreadable header: {}'.format(e))
+    if _setup_key(sides[0].header) != _setup_key(sides[1].header):
+        return Divergence(sides[0].start, sides[1].start, 'the headers differ')
+    for opcode in opcodes:
+        try:
+            sides[0].apply(opcode.a_lo, opcode.a_hi)
+        except replay.ReplayError as e:
+            return Divergence(opcode.a_lo + 1, opcode.b_lo + 1, 'the first log fails to replay: {}'.format(e))
+        try:
+            sides[1].apply(opcode.b_lo, opcode.b_hi)
+        except replay.ReplayError as e:
+            return Divergence(opcode.a_lo + 1, opcode.b_lo + 1, 'the second log fails to replay: {}'.format(e))
+        if opcode.tag != 'equal' and sides[0].position() != sides[1].position():
+            return Divergence(opcode.a_hi, opcode.b_hi, 'the games differ after {} line(s) of the first log '
+                              'and {} of the second'.format(opcode.a_hi - opcode.a_lo, opcode.b_hi - opcode.b_lo))
+    return None
+
+
+def merge(a, b, opcodes, a_name='a', b_name='b'):
+    """
+    :param a: list of lines, as given to #align
+    :param b: list of lines
+    :param opcodes: list of Opcode, from #align
+    :return: the merged text: a's lines where the logs agree, and both sides between conflict
+    markers where they don't
+    """
+    out = list()
+    for opcode in opcodes:
+        if opcode.tag == 'equal':
+            out.extend(a[opcode.a_lo:opcode.a_hi])
+        else:
+            out.append('<<<<<<< {}\n'.format(a_name))
+            out.extend(a[opcode.a_lo:opcode.a_hi])
+            out.append('=======\n')
+            out.extend(b[opcode.b_lo:opcode.b_hi])
+            out.append('>>>>>>> {}\n'.format(b_name))
+    return ''.join(line if line.endswith('\n') else line + '\n' for line in out)
+
+
+def pair_logs(a_paths, b_paths):
+    """
+    Pair up the transcriptions of the same games: logs with the same players and board setup.
+
+    :param a_paths: list of paths to .catan logs
+    :param b_paths: list of paths to .catan logs
+    :return: (list of (a path, b path), list of the paths left unpaired)
+    """
+    by_setup = collections.defaultdict(list)
+    unpaired = list()
+    for path in b_paths:
+        setup = _setup(path)
+        if setup is None:
+            unpaired.append(path)
+        else:
+            by_setup[setup].append(path)
+    pairs = list()
+    for path in a_paths:
+        candidates = by_setup.get(_setup(path))
+        if candidates:
+            pairs.append((path, candidates.pop(0)))
+        else:
+            unpaired.append(path)
+    unpaired.extend(path for paths in by_setup.values() for path in paths)
+    return pairs, unpaired
+
+
+def _setup(path):
+    """
+    :return: (player colors, setup hash) of the log's game, or None if it has no readable header
+    """
+    with open(path) as fp:
+        header_lines = list()
+        for line in fp:
+            header_lines.append(line)
+            if line.rstrip('\n') == '...CATAN!':
+                break
+    try:
+        header, _ = replay.read_header(header_lines)
+    except replay.ReplayError as e:
+        logging.warning('logdiff: skipping {}: {}'.format(path, e))
+        return None
+    return _setup_key(header)
+
+
+def _setup_key(header):
+    """
+    :return: (player colors, setup hash) of a replay.Header. Ports don't compare by value
+    """
+    return tuple(player.color for player in header.players), zobrist.setup_hash(header.terrain, header.numbers, header.ports)
+
+
+def describe(comparison):
+    """
+    :param comparison: Comparison
+    :return: one line summarising it
+    """
+    if not comparison.conflicts:
+        return 'identical'
+    text = '{} conflict(s)'.format(comparison.conflicts)
+    if comparison.divergence is None:
+        return text + ', the games never diverge'
+    return text + ', the games diverge after line {} of the first log, {} of the second: {}'.format(
+        *comparison.divergence)
+
+
+def diff_files(a_path, b_path, merge_path=None):
+    """
+    :return: Comparison of the two logs, having written their merge to merge_path if given
+    """
+    with open(a_path) as fp:
+        a = fp.readlines()
+    with open(b_path) as fp:
+        b = fp.readlines()
+    comparison = compare(a, b)
+    if merge_path is not None:
+        with open(merge_path, 'w') as fp:
+            fp.write(merge(a, b, comparison.opcodes, a_path, b_path))
+    return comparison
+
+
+def _print_conflicts(a_path, b_path, comparison):
+    with open(a_path) as fp:
+        a = fp.readlines()
+    with open(b_path) as fp:
+        b = fp.readlines()
+    for opcode in comparison.opcodes:
+        if opcode.tag == 'equal':
+            continue
+        print('@@ {} {},{} {} {},{} @@'.format(a_path, opcode.a_lo + 1, opcode.a_hi - opcode.a_lo,
+                                               b_path, opcode.b_lo + 1, opcode.b_hi - opcode.b_lo))
+        for line in a[opcode.a_lo:opcode.a_hi]:
+            print('-' + line.rstrip('\n'))
+        for line in b[opcode.b_lo:opcode.b_hi]:
+            print('+' + line.rstrip('\n'))
+
+
+def _catan_logs(directory):
+    return sorted(os.path.join(directory, name) for name in os.listdir(directory) if name.endswith('.catan'))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='diff and merge two transcriptions of the same game')
+    subparsers = parser.add_subparsers(dest='command')
+    diff = subparsers.add_parser('diff', help='diff two logs of one game')
+    diff.add_argument('a', help='.catan log')
+    diff.add_argument('b', help='.catan log')
+    diff.add_argument('--merge', metavar='FILE', help='write the merged log, with conflicts marked, to FILE')
+    directories = subparsers.add_parser('dir', help="pair up and diff two operators' directories of logs")
+    directories.add_argument('a', help='directory of .catan logs')
+    directories.add_argument('b', help='directory of .catan logs')
+    directories.add_argument('--merge-dir', metavar='DIR',
+                             help="write each pair's merged log to DIR, named after the first log")
+    args = parser.parse_args(argv)
+
+    # module catan warns about every state it has no check for, and sets up logging on import
+    logging.basicConfig(format='%(levelname)s:%(module)s:%(message)s', level=logging.ERROR, force=True)
+    if args.command == 'diff':
+        comparison = diff_files(args.a, args.b, args.merge)
+        _print_conflicts(args.a, args.b, comparison)
+        print(describe(comparison))
+        return 1 if comparison.conflicts else 0
+    elif args.command == 'dir':
+        start = time.perf_counter()
+        pairs, unpaired = pair_logs(_catan_logs(args.a), _catan_logs(args.b))
+        if args.merge_dir is not None:
+            os.makedirs(args.merge_dir, exist_ok=True)
+        differing = 0
+        for a_path, b_path in pairs:
+            merge_path = None
+            if args.merge_dir is not None:
+                merge_path = os.path.join(args.merge_dir, os.path.basename(a_path))
+            comparison = diff_files(a_path, b_path, merge_path)
+            differing += 1 if comparison.conflicts else 0
+            print('{}\t{}\t{}'.format(a_path, b_path, describe(comparison)))
+        for path in unpaired:
+            print('{}\tunpaired'.format(path))
+        print('{} pairs, {} differing, {} unpaired, in {:.2f}s'.format(
+            len(pairs), differing, len(unpaired), time.perf_counter() - start))
+        return 1 if differing or unpaired else 0
+    parser.print_help()
+    return 2
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+module logindex provides a line index over a game's log, kept up to date as the log grows
+
+LogIndex keeps
+- the offset of each line in the log text, so any line is a slice of the text
+- the color of the player on each action line, so a player's lines are a list of line numbers
+- the line each turn starts on, so jumping to a turn is one lookup
+
+New lines are indexed as they're appended, so indexing costs the same however long the game
+runs. Undo restores an earlier copy of the log (see Game.restore), which is a prefix of the
+current one, and the index is truncated to the lines they have in common.
+"""
+import array
+import bisect
+
+import logstream
+
+
+class LogIndex(object):
+    """
+    class LogIndex indexes the lines of game.catanlog.
+
+    :param game: catan.game.Game
+    """
+    def __init__(self, game):
+        self.game = game
+        self.version = 0
+        self._text = ''
+        self._starts = array.array('L')  # offset of each complete line
+        self._colors = list()  # color per line, None for the header and other lines
+        self._by_color = dict()  # color -> array of line numbers
+        self._turn_starts = array.array('L', [0])  # line number each turn starts on
+        self._header_end = None  # line number of '...CATAN!'
+
+    def sync(self):
+        """
+        Index whatever was appended to the log since the last sync.
+
+        :return: True if the index changed
+        """
+        text = self.game.catanlog.dump()
+        if text is self._text or text == self._text:
+            return False
+        indexed = self._indexed_chars()
+        if not self._extends(text, indexed):
+            self._truncate(text)
+            indexed = self._indexed_chars()
+        self._text = text
+
+        start = indexed
+        while True:
+            end = text.find('\n', start)
+            if end < 0:
+                break
+            self._add_line(start, text[start:end])
+            start = end + 1
+        self.version += 1
+        return True
+
+    def __len__(self):
+        return len(self._starts)
+
+    def line(self, n):
+        """
+        :param n: line number, from 0
+        :return: the line's text, without its newline
+        """
+        start = self._starts[n]
+        return self._text[start:self._text.index('\n', start)]
+
+    def lines(self, numbers):
+        """
+        :param numbers: iterable of line numbers
+        :return: list of the lines' text
+        """
+        return [self.line(n) for n in numbers]
+
+    def color(self, n):
+        return self._colors[n]
+
+    def colors(self):
+        """
+        :return: the colors with action lines, in the order they first appear
+        """
+        return list(self._by_color)
+
+    def player_lines(self, color):
+        """
+        :param color: player color, str
+        :return: the line numbers of the player's action lines, ascending (an array, don't modify it)
+        """
+        return self._by_color.get(color, array.array('L'))
+
+    @property
+    def num_turns(self):
+        return len(self._turn_starts)
+
+    def turn_line(self, turn):
+        """
+        :param turn: turn number, from 0 (the pregame counts each placement as a turn)
+        :return: the line number the turn starts on
+        """
+        return self._turn_starts[max(0, min(turn, len(self._turn_starts) - 1))]
+
+    def turn_of_line(self, n):
+        """
+        :param n: line number
+        :return: the number of the turn the line is in
+        """
+        return bisect.bisect_right(self._turn_starts, n) - 1
+
+    def _extends(self, text, indexed):
+        """
+        Whether text is the indexed text with lines appended. The log only appends, except when
+        a new game resets it (which changes the timestamp line) or undo restores an earlier copy
+        (which is shorter, or ends differently), so comparing the first two lines and the last
+        indexed line is enough, and doesn't cost more as the log grows.
+        """
+        if len(text) < indexed:
+            return False
+        if not self._starts:
+            return True
+        head_end = self._text.index('\n', self._starts[min(1, len(self._starts) - 1)]) + 1
+        last_start = self._starts[-1]
+        return text[:head_end] == self._text[:head_end] and text[last_start:indexed] == self._text[last_start:indexed]
+
+    def _indexed_chars(self):
+        if not self._starts:
+            return 0
+        return self._text.index('\n', self._starts[-1]) + 1
+
+    def _add_line(self, start, line):
+        n = len(self._starts)
+        self._starts.append(start)
+        color = None
+        if line.startswith('catanlog v'):
+            self._header_end = None
+        elif self._header_end is None:
+            if line == logstream.START:
+                self._header_end = n
+                self._turn_starts.append(n + 1)
+        else:
+            record = logstream.parse_line(line)
+            color = record.color
+            if color is not None:
+                self._by_color.setdefault(color, array.array('L')).append(n)
+            if record.kind == 'end_turn':
+                self._turn_starts.append(n + 1)
+        self._colors.append(color)
+
+    def _truncate(self, text):
+        """
+        Drop the lines which aren't in text as they were.
+        """
+        keep = 0
+        while keep < len(self._starts):
+            start = self._starts[keep]
+            end = self._text.index('\n', start) + 1
+            if text[start:end] != self._text[start:end]:
+                break
+            keep += 1
+        # lines are compared from the start; the first difference ends what can be kept
+        del self._starts[keep:]
+        del self._colors[keep:]
+        for color in list(self._by_color):
+            lines = self._by_color[color]
+            del lines[bisect.bisect_left(lines, keep):]
+            if not lines:
+                del self._by_color[color]
+        del self._turn_starts[max(1, bisect.bisect_right(self._turn_starts, keep)):]
+        if self._header_end is not None and self._header_end >= keep:
+            self._header_end = None
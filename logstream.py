@@ -0,0 +1,533 @@
+"""
+module logstream provides a streaming parser for .catan logs, and a compact binary log format
+
+Parsing is line by line, so a log (or a file of many logs one after another) is never read
+into memory whole. Each line becomes a Record(kind, color, args):
+
+    kind            args
+    header          (line,)                      a line of the header, up to and including '...CATAN!'
+    roll            (roll,)
+    build           (piece, location)            piece is 'road', 'settlement' or 'city'
+    dev_card        ()
+    knight          ()
+    robber          (tile_id, victim)            victim is a color, or 'nobody'
+    road_builder    (location, location)
+    year_of_plenty  (resource, resource)
+    monopoly        (resource,)
+    victory_point   ()
+    trade           (giving, partner_kind, partner, getting)
+                                                 partner_kind is 'port' or 'player', giving and
+                                                 getting are tuples of (num, resource)
+    end_turn        (seconds,)
+    wins            ()
+    text            (line,)                      any other line, kept as it is
+
+Locations are (tile_id, direction), eg (1, 'NW') for '(1 NW)'. Resources and ports are the
+strings the log uses, eg 'wood' and '3:1'. #format_record turns a record back into its line,
+so parsing and formatting a log gives back the same text.
+
+The binary format (.catanb) holds many games. Each action is a kind byte, a seat byte and a few
+bytes of arguments, and each game has a table of the offsets of its actions, so BinaryLog finds
+action N of game K with two lookups:
+
+    magic 'CATANB01'
+    game*       u32 header length, header (utf-8)
+                u32 number of actions, u32 offset of each action from the first, actions
+    index       u64 offset of each game
+    footer      u64 offset of the index, u32 number of games, magic
+
+Usage:
+    $ python3 logstream.py pack games.catanb log/*.catan
+    $ python3 logstream.py unpack games.catanb 12
+"""
+import argparse
+import collections
+import mmap
+import re
+import struct
+import sys
+
+Record = collections.namedtuple('Record', ['kind', 'color', 'args'])
+
+START = '...CATAN!'
+MAGIC = b'CATANB01'
+
+_location = r'\((\d+|None) ([NSEW]+)\)'
+_lines = [
+    (re.compile(r'^(\w+) rolls (\d+)(?: \.\.\.DEUCES!)?$'), 'roll'),
+    (re.compile(r'^(\w+) buys (road|settlement|city), builds at {}$'.format(_location)), 'build'),
+    (re.compile(r'^(\w+) buys dev card$'), 'dev_card'),
+    (re.compile(r'^(\w+) plays knight$'), 'knight'),
+    (re.compile(r'^(\w+) moves robber to (\d+), steals from (\w+)$'), 'robber'),
+    (re.compile(r'^(\w+) plays road builder, builds at {0} and {0}$'.format(_location)), 'road_builder'),
+    (re.compile(r'^(\w+) plays year of plenty, takes (\w+) and (\w+)$'), 'year_of_plenty'),
+    (re.compile(r'^(\w+) plays monopoly on (\w+)$'), 'monopoly'),
+    (re.compile(r'^(\w+) plays victory point$'), 'victory_point'),
+    (re.compile(r'^(\w+) trades \[(.*)\] to (port|player) (\S+) for \[(.*)\]$'), 'trade'),
+    (re.compile(r'^(\w+) ends turn after (\d+)s$'), 'end_turn'),
+    (re.compile(r'^(\w+) wins$'), 'wins'),
+]
+_resources = re.compile(r'^(\d+) (\w+)$')
+
+
+def parse(lines):
+    """
+    Parse a log, or several logs one after another, a line at a time.
+
+    :param lines: iterable of lines, eg an open file
+    :return: generator of (game, Record), where game counts the logs seen so far from 0
+    """
+    game = -1
+    in_header = False
+    for line in lines:
+        line = line.rstrip('\n')
+        if line.startswith('catanlog v') or (game < 0 and not in_header):
+            game += 1
+            in_header = True
+        if in_header:
+            in_header = line != START
+            yield game, Record('header', None, (line,))
+        else:
+            yield game, parse_line(line)
+
+
+def parse_line(line):
+    """
+    :param line: an action line of a log
+    :return: Record. Lines which aren't actions are kind 'text'.
+    """
+    line = line.rstrip('\n')
+    for pattern, kind in _lines:
+        match = pattern.match(line)
+        if match:
+            args = _args(kind, match.groups()[1:])
+            if args is not None:
+                record = Record(kind, match.group(1), args)
+                # eg 'rolls 06', which would format back as 'rolls 6'
+                if format_record(record) == line:
+                    return record
+            break
+    return Record('text', None, (line,))
+
+
+def _args(kind, groups):
+    if kind in ('roll', 'end_turn'):
+        return (int(groups[0]),)
+    elif kind == 'build':
+        return groups[0], _parse_location(groups[1], groups[2])
+    elif kind == 'robber':
+        return int(groups[0]), groups[1]
+    elif kind == 'road_builder':
+        return _parse_location(groups[0], groups[1]), _parse_location(groups[2], groups[3])
+    elif kind == 'trade':
+        giving, getting = _parse_resources(groups[0]), _parse_resources(groups[3])
+        if giving is None or getting is None:
+            return None
+        return giving, groups[1], groups[2], getting
+    return tuple(groups)
+
+
+def _parse_location(tile_id, direction):
+    return None if tile_id == 'None' else int(tile_id), direction
+
+
+def _parse_resources(text):
+    resources = list()
+    for item in text.split(', ') if text else list():
+        match = _resources.match(item)
+        if not match:
+            return None
+        resources.append((int(match.group(1)), match.group(2)))
+    return tuple(resources)
+
+
+def format_record(record):
+    """
+    :param record: Record
+    :return: the record's line, without a newline
+    """
+    kind, color, args = record
+    if kind in ('header', 'text'):
+        return args[0]
+    elif kind == 'roll':
+        return '{} rolls {}{}'.format(color, args[0], ' ...DEUCES!' if args[0] == 2 else '')
+    elif kind == 'build':
+        return '{} buys {}, builds at {}'.format(color, args[0], _format_location(args[1]))
+    elif kind == 'dev_card':
+        return '{} buys dev card'.format(color)
+    elif kind == 'knight':
+        return '{} plays knight'.format(color)
+    elif kind == 'robber':
+        return '{} moves robber to {}, steals from {}'.format(color, args[0], args[1])
+    elif kind == 'road_builder':
+        return '{} plays road builder, builds at {} and {}'.format(
+            color, _format_location(args[0]), _format_location(args[1]))
+    elif kind == 'year_of_plenty':
+        return '{} plays year of plenty, takes {} and {}'.format(color, args[0], args[1])
+    elif kind == 'monopoly':
+        return '{} plays monopoly on {}'.format(color, args[0])
+    elif kind == 'victory_point':
+        return '{} plays victory point'.format(color)
+    elif kind == 'trade':
+        giving, partner_kind, partner, getting = args
+        return '{} trades [{}] to {} {} for [{}]'.format(
+            color, _format_resources(giving), partner_kind, partner, _format_resources(getting))
+    elif kind == 'end_turn':
+        return '{} ends turn after {}s'.format(color, args[0])
+    elif kind == 'wins':
+        return '{} wins'.format(color)
+    raise ValueError('unknown record kind {}'.format(kind))
+
+
+def _format_location(location):
+    return '({} {})'.format(location[0], location[1])
+
+
+def _format_resources(resources):
+    return ', '.join('{} {}'.format(num, resource) for num, resource in resources)
+
+
+def read_games(lines):
+    """
+    :param lines: iterable of lines, eg an open file
+    :return: generator of lists of Record, one list per game
+    """
+    records = list()
+    current = 0
+    for game, record in parse(lines):
+        if game != current and records:
+            yield records
+            records = list()
+        current = game
+        records.append(record)
+    if records:
+        yield records
+
+
+def format_game(records):
+    """
+    :param records: list of Record of one game
+    :return: the game's log text
+    """
+    return ''.join(format_record(record) + '\n' for record in records)
+
+
+# binary codes, by position in each list
+_KINDS = ['text', 'roll', 'build', 'dev_card', 'knight', 'robber', 'road_builder', 'year_of_plenty',
+          'monopoly', 'victory_point', 'trade', 'end_turn', 'wins']
+_PIECES = ['road', 'settlement', 'city']
+_DIRECTIONS = ['N', 'NE', 'E', 'SE', 'S', 'SW', 'W', 'NW']
+_RESOURCES = ['wood', 'brick', 'wheat', 'sheep', 'ore']
+_PORTS = ['4:1', '3:1'] + _RESOURCES
+_NONE = 0xff
+
+_player_color = re.compile(r'^name: .*, color: (\S+), seat: \d+$')
+
+
+class BinaryWriter(object):
+    """
+    class BinaryWriter writes games to a .catanb file.
+
+    Actions which don't fit the compact encoding (eg colors not in the game's header) are kept
+    as text and parsed again on reading, so every game reads back exactly as written.
+
+    :param path: path to write, overwritten
+    """
+    def __init__(self, path):
+        self._fp = open(path, 'wb')
+        self._fp.write(MAGIC)
+        self._offsets = list()
+
+    def add_game(self, records):
+        """
+        :param records: list of Record of one game, as from #read_games
+        """
+        header = [record for record in records if record.kind == 'header']
+        actions = [record for record in records if record.kind != 'header']
+        colors = list()
+        for record in header:
+            match = _player_color.match(record.args[0])
+            if match:
+                colors.append(match.group(1))
+
+        header_bytes = ''.join(format_record(record) + '\n' for record in header).encode('utf-8')
+        encoded = [_encode(record, colors) for record in actions]
+        offsets = list()
+        position = 0
+        for action in encoded:
+            offsets.append(position)
+            position += len(action)
+
+        self._offsets.append(self._fp.tell())
+        self._fp.write(struct.pack('<I', len(header_bytes)))
+        self._fp.write(header_bytes)
+        self._fp.write(struct.pack('<I', len(encoded)))
+        self._fp.write(struct.pack('<{}I'.format(len(offsets)), *offsets))
+        self._fp.write(b''.join(encoded))
+
+    def close(self):
+        index_offset = self._fp.tell()
+        self._fp.write(struct.pack('<{}Q'.format(len(self._offsets)), *self._offsets))
+        self._fp.write(struct.pack('<QI', index_offset, len(self._offsets)))
+        self._fp.write(MAGIC)
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _encode(record, colors):
+    try:
+        encoded = _encode_args(record, colors)
+        if _decode(encoded, 0, colors)[0] == record:
+            return encoded
+    except (ValueError, struct.error):
+        pass
+    return _encode_text(format_record(record))
+
+
+def _encode_text(line):
+    text = line.encode('utf-8')
+    return struct.pack('<BBH', _KINDS.index('text'), _NONE, len(text)) + text
+
+
+def _encode_args(record, colors):
+    kind, color, args = record
+    if kind == 'text':
+        return _encode_text(args[0])
+    head = struct.pack('<BB', _KINDS.index(kind), colors.index(color))
+    if kind in ('roll',):
+        return head + struct.pack('<B', args[0])
+    elif kind == 'build':
+        return head + struct.pack('<B', _PIECES.index(args[0])) + _encode_location(args[1])
+    elif kind == 'robber':
+        victim = _NONE if args[1] == 'nobody' else colors.index(args[1])
+        return head + struct.pack('<BB', args[0], victim)
+    elif kind == 'road_builder':
+        return head + _encode_location(args[0]) + _encode_location(args[1])
+    elif kind == 'year_of_plenty':
+        return head + struct.pack('<BB', _RESOURCES.index(args[0]), _RESOURCES.index(args[1]))
+    elif kind == 'monopoly':
+        return head + struct.pack('<B', _RESOURCES.index(args[0]))
+    elif kind == 'trade':
+        giving, partner_kind, partner, getting = args
+        if partner_kind == 'port':
+            partner_code = 0x80 | _PORTS.index(partner)
+        else:
+            partner_code = colors.index(partner)
+        return head + struct.pack('<B', partner_code) + _encode_resources(giving) + _encode_resources(getting)
+    elif kind == 'end_turn':
+        return head + struct.pack('<I', args[0])
+    return head
+
+
+def _encode_location(location):
+    tile_id, direction = location
+    return struct.pack('<BB', _NONE if tile_id is None else tile_id, _DIRECTIONS.index(direction))
+
+
+def _encode_resources(resources):
+    return struct.pack('<B', len(resources)) + b''.join(
+        struct.pack('<BB', num, _RESOURCES.index(resource)) for num, resource in resources)
+
+
+def _decode(buffer, offset, colors):
+    """
+    :return: (Record, offset just past it)
+    """
+    kind_code, seat = struct.unpack_from('<BB', buffer, offset)
+    kind = _KINDS[kind_code]
+    offset += 2
+    if kind == 'text':
+        length, = struct.unpack_from('<H', buffer, offset)
+        offset += 2
+        return parse_line(bytes(buffer[offset:offset + length]).decode('utf-8')), offset + length
+
+    color = colors[seat]
+    if kind == 'roll':
+        args = (buffer[offset],)
+        offset += 1
+    elif kind == 'build':
+        location, end = _decode_location(buffer, offset + 1)
+        args = (_PIECES[buffer[offset]], location)
+        offset = end
+    elif kind == 'robber':
+        args = (buffer[offset], 'nobody' if buffer[offset + 1] == _NONE else colors[buffer[offset + 1]])
+        offset += 2
+    elif kind == 'road_builder':
+        location1, offset = _decode_location(buffer, offset)
+        location2, offset = _decode_location(buffer, offset)
+        args = (location1, location2)
+    elif kind == 'year_of_plenty':
+        args = (_RESOURCES[buffer[offset]], _RESOURCES[buffer[offset + 1]])
+        offset += 2
+    elif kind == 'monopoly':
+        args = (_RESOURCES[buffer[offset]],)
+        offset += 1
+    elif kind == 'trade':
+        partner_code = buffer[offset]
+        if partner_code & 0x80:
+            partner_kind, partner = 'port', _PORTS[partner_code & 0x7f]
+        else:
+            partner_kind, partner = 'player', colors[partner_code]
+        giving, offset = _decode_resources(buffer, offset + 1)
+        getting, offset = _decode_resources(buffer, offset)
+        args = (giving, partner_kind, partner, getting)
+    elif kind == 'end_turn':
+        args = struct.unpack_from('<I', buffer, offset)
+        offset += 4
+    else:
+        args = ()
+    return Record(kind, color, args), offset
+
+
+def _decode_location(buffer, offset):
+    tile_id = buffer[offset]
+    return (None if tile_id == _NONE else tile_id, _DIRECTIONS[buffer[offset + 1]]), offset + 2
+
+
+def _decode_resources(buffer, offset):
+    count = buffer[offset]
+    offset += 1
+    resources = list()
+    for _ in range(count):
+        resources.append((buffer[offset], _RESOURCES[buffer[offset + 1]]))
+        offset += 2
+    return tuple(resources), offset
+
+
+class BinaryLog(object):
+    """
+    class BinaryLog reads a .catanb file, memory mapped, with random access to games and actions.
+
+    :param path: path to a .catanb file
+    """
+    def __init__(self, path):
+        self._fp = open(path, 'rb')
+        self._map = mmap.mmap(self._fp.fileno(), 0, access=mmap.ACCESS_READ)
+        footer = len(self._map) - len(MAGIC) - 12
+        if self._map[:len(MAGIC)] != MAGIC or self._map[footer + 12:] != MAGIC:
+            raise ValueError('{} is not a .catanb file'.format(path))
+        index_offset, self._num_games = struct.unpack_from('<QI', self._map, footer)
+        self._offsets = struct.unpack_from('<{}Q'.format(self._num_games), self._map, index_offset)
+        self._games = dict()  # game -> (header lines, colors, number of actions, table offset, actions offset)
+
+    def __len__(self):
+        return self._num_games
+
+    def header(self, game):
+        """
+        :param game: game number, int
+        :return: list of Record of the game's header
+        """
+        return [Record('header', None, (line,)) for line in self._game(game)[0]]
+
+    def num_actions(self, game):
+        return self._game(game)[2]
+
+    def action(self, game, n):
+        """
+        :param game: game number, int
+        :param n: action number within the game, int
+        :return: Record
+        """
+        _, colors, count, table, actions = self._game(game)
+        if not 0 <= n < count:
+            raise IndexError('game {} has {} actions, no action {}'.format(game, count, n))
+        offset, = struct.unpack_from('<I', self._map, table + 4 * n)
+        return _decode(self._map, actions + offset, colors)[0]
+
+    def actions(self, game, start=0):
+        """
+        :return: generator of the game's action Records, from action number start
+        """
+        _, colors, count, table, actions = self._game(game)
+        if start >= count:
+            return
+        offset, = struct.unpack_from('<I', self._map, table + 4 * start)
+        offset += actions
+        for _ in range(start, count):
+            record, offset = _decode(self._map, offset, colors)
+            yield record
+
+    def records(self, game):
+        """
+        :return: list of all the game's Records, header first
+        """
+        return self.header(game) + list(self.actions(game))
+
+    def text(self, game):
+        """
+        :return: the game's log text, as catanlog wrote it
+        """
+        return format_game(self.records(game))
+
+    def close(self):
+        self._map.close()
+        self._fp.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _game(self, game):
+        if game not in self._games:
+            offset = self._offsets[game]
+            header_length, = struct.unpack_from('<I', self._map, offset)
+            header = bytes(self._map[offset + 4:offset + 4 + header_length]).decode('utf-8').split('\n')[:-1]
+            colors = list()
+            for line in header:
+                match = _player_color.match(line)
+                if match:
+                    colors.append(match.group(1))
+            table = offset + 4 + header_length + 4
+            count, = struct.unpack_from('<I', self._map, table - 4)
+            self._games[game] = (header, colors, count, table, table + 4 * count)
+        return self._games[game]
+
+
+def pack(paths, out_path):
+    """
+    :param paths: list of paths to .catan logs, each holding one or more games
+    :param out_path: path of the .catanb file to write
+    :return: number of games written
+    """
+    games = 0
+    with BinaryWriter(out_path) as writer:
+        for path in paths:
+            with open(path) as fp:
+                for records in read_games(fp):
+                    writer.add_game(records)
+                    games += 1
+    return games
+
+
+def main():
+    parser = argparse.ArgumentParser(description='convert .catan logs to and from the binary .catanb format')
+    subparsers = parser.add_subparsers(dest='command')
+    pack_parser = subparsers.add_parser('pack', help='pack .catan logs into a .catanb file')
+    pack_parser.add_argument('out', help='.catanb file to write')
+    pack_parser.add_argument('logs', nargs='+', help='.catan logs')
+    unpack_parser = subparsers.add_parser('unpack', help='print a game of a .catanb file as a .catan log')
+    unpack_parser.add_argument('path', help='.catanb file')
+    unpack_parser.add_argument('game', type=int, help='game number, from 0')
+    args = parser.parse_args()
+
+    if args.command == 'pack':
+        print('packed {} games into {}'.format(pack(args.logs, args.out), args.out))
+    elif args.command == 'unpack':
+        with BinaryLog(args.path) as log:
+            sys.stdout.write(log.text(args.game))
+    else:
+        parser.print_help()
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
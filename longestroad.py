@@ -0,0 +1,267 @@
+"""
+module longestroad provides an incrementally maintained longest road for each player
+
+A player's longest road is the longest trail (no road used twice) through their roads, which
+may end at, but not pass through, a node with an opponent's settlement or city.
+
+LongestRoadIndex observes the game and keeps, for each player, their roads split into connected
+components. Finding the longest trail is a search over every trail in a component, so results
+are memoized per component, keyed on its roads and the opponent buildings on its nodes. A change
+only dirties the players whose components it touches, and of those, only components whose roads
+or blockers actually changed miss the memo. The changes are the board events of the views'
+changeevents.ChangePublisher; undo shows up as the pieces which differ, and usually finds the
+previous components still memoized.
+
+Who holds longest road depends on the order roads were built in, not just on the board: the
+holder keeps it on a tie. So the index remembers the holder at each arrangement of roads and
+buildings it has seen (keyed on their hash, as in module zobrist), and undo or redo back to one
+gets its holder back rather than working it out from the holder being undone.
+"""
+import collections
+import logging
+
+import hexgrid
+from catan.pieces import PieceType
+
+import changeevents
+import gridtables
+import zobrist
+
+# the number of roads needed before a player can hold longest road
+MIN_LENGTH = 5
+
+_MEMO_SIZE = 4096
+_HOLDERS_SIZE = 4096
+
+
+class LongestRoadIndex(object):
+    """
+    class LongestRoadIndex answers longest road questions for the game it observes.
+
+    Use #length and #road for a player's longest road, and #holder for the player holding
+    longest road. version is incremented whenever any player's longest road changes.
+
+    :param game: catan.game.Game
+    :param changes: changeevents.ChangePublisher to be kept up to date by, or None to observe the
+    game and diff its board instead, and on every query
+    """
+    def __init__(self, game, changes=None):
+        self.game = game
+        self.version = 0
+
+        self._diff = None
+        self._roads = collections.defaultdict(set)  # owner -> edge coords
+        self._buildings = dict()  # node coord -> owner
+        self._best = dict()  # owner -> (length, tuple of edge coords)
+        self._memo = dict()  # (frozenset of edges, frozenset of blocked nodes) -> (length, path)
+        self._holder = None
+        self._position = 0  # hash of the roads and buildings
+        self._holders = collections.OrderedDict()  # position -> holder there, most recent last
+
+        self.memo_hits = 0
+        self.memo_misses = 0
+
+        if changes is None:
+            self._diff = changeevents.BoardDiff()
+            self.game.observers.add(self)
+            self.sync()
+        else:
+            self.on_changes(changeevents.BoardDiff().events(game.board))
+            changes.subscribe_index(self.on_changes, changeevents.PiecePlaced, changeevents.PieceRemoved)
+
+    def notify(self, observable):
+        self.sync()
+
+    def sync(self):
+        """
+        Without a publisher, apply whatever changed on the board since the last sync. Queries sync
+        first, since game observers are notified in no particular order and one may ask before
+        we're notified. With a publisher, we're always up to date.
+        """
+        if self._diff is not None:
+            events = self._diff.events(self.game.board)
+            if events:
+                self.on_changes(events)
+
+    def on_changes(self, events):
+        """
+        :param events: list of changeevents, those which aren't about roads, settlements or cities are ignored
+        """
+        dirty = set()
+        for event in events:
+            if isinstance(event, (changeevents.PiecePlaced, changeevents.PieceRemoved)):
+                self._position ^= zobrist.key('piece', event.coord, event.type.value,
+                                              getattr(event.owner, 'color', None))
+            if isinstance(event, changeevents.PieceRemoved):
+                if event.type == PieceType.road:
+                    self._roads[event.owner].discard(event.coord)
+                    dirty.add(event.owner)
+                elif event.type in (PieceType.settlement, PieceType.city):
+                    if self._buildings.get(event.coord) == event.owner:
+                        del self._buildings[event.coord]
+                    dirty.update(self._owners_touching(event.coord))
+            elif isinstance(event, changeevents.PiecePlaced):
+                if event.type == PieceType.road:
+                    self._roads[event.owner].add(event.coord)
+                    dirty.add(event.owner)
+                elif event.type in (PieceType.settlement, PieceType.city):
+                    self._buildings[event.coord] = event.owner
+                    dirty.update(self._owners_touching(event.coord))
+        changed = False
+        for owner in dirty:
+            best = self._longest(owner)
+            if best != self._best.get(owner, (0, ())):
+                self._best[owner] = best
+                changed = True
+        if self._position in self._holders:
+            # back where we've been, eg by undo
+            changed = self._set_holder(self._holders.pop(self._position)) or changed
+        elif changed:
+            self._update_holder()
+        self._holders[self._position] = self._holder
+        while len(self._holders) > _HOLDERS_SIZE:
+            self._holders.popitem(last=False)
+        if changed:
+            self.version += 1
+
+    def length(self, player):
+        """
+        :param player: catan.game.Player
+        :return: the number of roads in the player's longest road, int
+        """
+        self.sync()
+        return self._best.get(player, (0, ()))[0]
+
+    def road(self, player):
+        """
+        :param player: catan.game.Player
+        :return: the edge coordinates of the player's longest road, in order, tuple
+        """
+        self.sync()
+        return self._best.get(player, (0, ()))[1]
+
+    def holder(self):
+        """
+        Longest road goes to the first player to build MIN_LENGTH roads in a row, and only moves
+        to a player who builds a strictly longer one. If the holder's road is broken and the
+        new longest is tied, nobody holds it.
+
+        :return: the Player holding longest road, or None
+        """
+        self.sync()
+        return self._holder
+
+    def _owners_touching(self, node):
+        owners = set()
+        for edge in gridtables.NODE_EDGES.get(node, ()):
+            piece = self.game.board.pieces.get((hexgrid.EDGE, edge))
+            if piece is not None and piece.type == PieceType.road:
+                owners.add(piece.owner)
+        return owners
+
+    def _longest(self, owner):
+        best = (0, ())
+        for edges in _components(self._roads[owner]):
+            nodes = set(node for edge in edges for node in gridtables.EDGE_NODES[edge])
+            blocked = frozenset(node for node in nodes
+                                if node in self._buildings and self._buildings[node] != owner)
+            key = (edges, blocked)
+            if key in self._memo:
+                self.memo_hits += 1
+            else:
+                self.memo_misses += 1
+                if len(self._memo) >= _MEMO_SIZE:
+                    self._memo.clear()
+                self._memo[key] = longest_trail(edges, blocked)
+            if self._memo[key][0] > best[0]:
+                best = self._memo[key]
+        return best
+
+    def _update_holder(self):
+        lengths = dict((owner, best[0]) for owner, best in self._best.items() if best[0] >= MIN_LENGTH)
+        if not lengths:
+            holder = None
+        else:
+            longest = max(lengths.values())
+            leaders = [owner for owner, length in lengths.items() if length == longest]
+            if self._holder in leaders:
+                holder = self._holder
+            elif len(leaders) == 1:
+                holder = leaders[0]
+            else:
+                holder = None
+        self._set_holder(holder)
+
+    def _set_holder(self, holder):
+        """
+        :return: True if the holder changed
+        """
+        if holder == self._holder:
+            return False
+        logging.info('longest road: {} -> {}'.format(self._holder, holder))
+        self._holder = holder
+        return True
+
+
+def _components(edges):
+    """
+    :param edges: iterable of edge coords
+    :return: list of frozensets of edge coords, one per connected component
+    """
+    remaining = set(edges)
+    components = list()
+    while remaining:
+        frontier = [remaining.pop()]
+        component = set(frontier)
+        while frontier:
+            edge = frontier.pop()
+            for node in gridtables.EDGE_NODES[edge]:
+                for neighbour in gridtables.NODE_EDGES[node]:
+                    if neighbour in remaining:
+                        remaining.discard(neighbour)
+                        component.add(neighbour)
+                        frontier.append(neighbour)
+        components.append(frozenset(component))
+    return components
+
+
+def longest_trail(edges, blocked=frozenset()):
+    """
+    Search every trail through the edges for the longest. A trail may start or end at a
+    blocked node, but not pass through one.
+
+    :param edges: connected edge coords
+    :param blocked: node coords which a trail cannot pass through
+    :return: (length, tuple of edge coords along the longest trail)
+    """
+    adjacency = collections.defaultdict(list)
+    for edge in edges:
+        a, b = gridtables.EDGE_NODES[edge]
+        adjacency[a].append((edge, b))
+        adjacency[b].append((edge, a))
+
+    best = [()]
+    used = set()
+    path = list()
+
+    def walk(node):
+        if len(path) > len(best[0]):
+            best[0] = tuple(path)
+        if path and node in blocked:
+            return
+        for edge, other in adjacency[node]:
+            if edge not in used:
+                used.add(edge)
+                path.append(edge)
+                walk(other)
+                path.pop()
+                used.discard(edge)
+
+    # a longest trail can be walked from either end, and if it ends anywhere but an odd-degree
+    # node, a blocked node or a dead end, it's a closed loop which can start at any of its nodes
+    starts = [node for node, adjacent in adjacency.items() if len(adjacent) % 2 == 1 or node in blocked]
+    for node in starts or list(adjacency):
+        walk(node)
+        if len(best[0]) == len(edges):
+            break
+    return len(best[0]), best[0]
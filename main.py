@@ -1,11 +1,14 @@
+import time
+_process_start = time.perf_counter()
+
+import sys
+import random
 import tkinter
 import pprint
 import logging
 import argparse
-from catan.board import Board
-from catan.game import Game
 
-import views
+from instrumentation import timings
 
 
 class CatanSpectator(tkinter.Frame):
@@ -13,46 +16,277 @@ class CatanSpectator(tkinter.Frame):
     def __init__(self, options=None, *args, **kwargs):
         super(CatanSpectator, self).__init__()
         self.options = options or dict()
+        # deferred until a window is actually wanted, so --help and friends stay fast
+        with timings.measure('startup.import'):
+            from catan.board import Board
+            from catan.game import Game
+            import boardgen
+            import changeevents
+            import eventqueue
+            import longestroad
+            import portindex
+            import production
+            import undohistory
+            import views
+            import zobrist
+
         board = Board(board=self.options.get('board'),
                       terrain=self.options.get('terrain'),
                       numbers=self.options.get('numbers'),
                       ports=self.options.get('ports'),
                       pieces=self.options.get('pieces'),
                       players=self.options.get('players'))
+        self.board_rules = self.options.get('board_rules') or boardgen.Rules()
+        if self.options.get('board') is None:
+            boardgen.reset(board, self.board_rules)
         self.game = Game(board=board, pregame=self.options.get('pregame'), use_stdout=self.options.get('use_stdout'))
-        self.game.observers.add(self)
+        self.game.undo_manager = undohistory.UndoHistory(depth=self.options.get('undo_depth') or undohistory.DEFAULT_DEPTH,
+                                                         path=self.options.get('undo_spill'))
+        # views subscribe to the changes they draw, rather than observing the game
+        self.changes = changeevents.ChangePublisher(self.game)
+        self.changes.subscribe(self.on_changes, changeevents.StateChanged)
         self._in_game = self.game.state.is_in_game()
+        self.production = production.ProductionIndex(self.game, self.changes)
+        self.longest_road = longestroad.LongestRoadIndex(self.game, self.changes)
+        self.ports = portindex.PortIndex(self.game, self.changes)
+        self.zobrist = zobrist.ZobristIndex(self.game, self.changes)
+        self.archive = None
+        if self.options.get('archive'):
+            import archive
+            self.archive = archive.Archive(self.options['archive'])
+        # consumers which don't draw anything get the game's events on their own worker
+        self.events = eventqueue.EventPublisher(self.game)
+        if self.options.get('export_dataset'):
+            import mlexport
+            self.events.subscribe(mlexport.LiveExporter(self.options['export_dataset']),
+                                  maxsize=1024, policy=eventqueue.BLOCK, process=True)
+        self.replica = None
+        self._standby_frame = None
+        self.recorder = None
+        self._autoplay_frame = None
+        if self.options.get('primary') is not None:
+            import replication
+            self.events.subscribe(replication.Primary(self.options['primary']), name='replication',
+                                  policy=eventqueue.DROP_OLDEST)
 
-        self._board_frame = views.BoardFrame(self, self.game)
-        self._log_frame = views.LogFrame(self, self.game)
+        with timings.measure('startup.board_frame'):
+            self._board_frame = views.BoardFrame(self, self.game, self.longest_road, self.ports, self.changes,
+                                                 ghost_radius=self.options.get('ghost_radius'))
+        with timings.measure('startup.log_frame'):
+            self._log_frame = views.LogFrame(self, self.game, self.changes)
+        self._command_frame = views.CommandFrame(self, self.game)
+        self._production_frame = views.ProductionFrame(self, self.game, self.production, self.changes)
         self._board_frame.grid(row=0, column=0, sticky=tkinter.NSEW)
         self._log_frame.grid(row=1, column=0, sticky=tkinter.W)
+        self._command_frame.grid(row=2, column=0, sticky=tkinter.EW)
+        self._production_frame.grid(row=0, column=2, sticky=tkinter.N)
+        if self.options.get('standby') is not None:
+            import replication
+            self.replica = replication.Replica(replication.parse_address(self.options['standby']))
+            self.replica.start()
+            self._standby_frame = views.StandbyFrame(self, self.replica, self.promote)
+            self._standby_frame.grid(row=3, column=0, sticky=tkinter.EW)
 
-        self._board_frame.redraw()
+        with timings.measure('startup.board_redraw'):
+            self._board_frame.redraw()
 
-        self._setup_game_toolbar_frame = views.SetupGameToolbarFrame(self, self.game)
+        with timings.measure('startup.setup_toolbar'):
+            self._setup_game_toolbar_frame = views.SetupGameToolbarFrame(self, self.game)
         self._toolbar_frame = self._setup_game_toolbar_frame
-        self._toolbar_frame.grid(row=0, column=1, rowspan=2, sticky=tkinter.N)
+        self._toolbar_frame.grid(row=0, column=1, rowspan=3, sticky=tkinter.N)
+
+        # the in-game toolbar is expensive to build, so build it once while idle after the first
+        # paint rather than on 'Start Game', and reuse it for every game played in this session
+        self._game_toolbar_frame = None
+        self._win_probability_frame = None
+        self._board_frame.bind('<Expose>', self._on_first_paint)
 
         self.lift()
 
-    def notify(self, observable):
+    def on_changes(self, events):
         was_in_game = self._in_game
         self._in_game = self.game.state.is_in_game()
         if was_in_game and not self.game.state.is_in_game():
             logging.debug('we were in game, NOW WE\'RE NOT')
-            self._toolbar_frame.grid_forget()
-            self._toolbar_frame = self._setup_game_toolbar_frame
-            self._toolbar_frame.grid(row=0, column=1, rowspan=2, sticky=tkinter.N)
+            with timings.measure('transition.to_setup'):
+                self._show_toolbar(self._setup_game_toolbar_frame)
+            logging.info('Transition timings:\n{}'.format(timings.report('transition.')))
         elif not was_in_game and self.game.state.is_in_game():
             logging.debug('we were not in game, NOW WE ARE')
-            self._toolbar_frame.grid_forget()
-            self._toolbar_frame = views.GameToolbarFrame(self, self.game)
-            self._toolbar_frame.grid(row=0, column=1, rowspan=2, sticky=tkinter.N)
+            with timings.measure('transition.to_game'):
+                self._prewarm_game_toolbar()
+                self._game_toolbar_frame.rebind()
+                self._show_toolbar(self._game_toolbar_frame)
+            logging.info('Transition timings:\n{}'.format(timings.report('transition.')))
+
+    def promote(self):
+        """
+        Take over the game the standby replicated from the primary, and carry on spectating it here.
+        The primary's undo history isn't replicated, so undo starts afresh from here.
+        """
+        game = self.replica.promote()
+        self._standby_frame.destroy()
+        self._standby_frame = None
+        if game is None:
+            logging.warning('standby: the primary had not started a game, nothing to take over')
+            return
+        self.load_game(game)
+        logging.info('standby: promoted, now logging to {}'.format(self.game.catanlog.logpath()))
+
+    def load_game(self, game, undo=True):
+        """
+        Spectate another game from where it is, in place of this one: the views and indexes keep
+        observing self.game, which takes on the other game's board, players, log and state. Undo
+        starts afresh.
+
+        :param game: catan.game.Game
+        :param undo: keep undo history, False for a game which is only watched, so its actions
+        don't each take a copy of the game
+        """
+        import undohistory
+        game.observers = self.game.observers
+        game.board.observers = self.game.board.observers
+        self.game.undo_manager.close()
+        if undo:
+            self.game.undo_manager = undohistory.UndoHistory(
+                depth=self.options.get('undo_depth') or undohistory.DEFAULT_DEPTH, path=self.options.get('undo_spill'))
+        else:
+            self.game.undo_manager = undohistory.NoHistory()
+        self.game.restore(game)
+        self.game.dev_card_state.game = self.game
+
+    def close(self):
+        """
+        Finish up once the window has closed: finish the input recording, stop replicating, let the
+        event consumers finish (the dataset exporter adds the game in progress), close the game
+        archive, and drop the undo history spilled to disk.
+
+        The archive and the undo history are closed even if finishing up the rest fails.
+        """
+        try:
+            if self.recorder is not None:
+                self.recorder.close()
+            if self.replica is not None:
+                self.replica.stop(timeout=1.0)
+            self.events.close()
+        finally:
+            if self.archive is not None:
+                self.archive.close()
+                self.archive = None
+            self.game.undo_manager.close()
 
     def setup_options(self):
         return self._setup_game_toolbar_frame.options.copy()
 
+    def _show_toolbar(self, toolbar_frame):
+        self._toolbar_frame.grid_forget()
+        self._toolbar_frame = toolbar_frame
+        self._toolbar_frame.grid(row=0, column=1, rowspan=3, sticky=tkinter.N)
+
+    def _on_first_paint(self, event):
+        self._board_frame.unbind('<Expose>')
+        self.update_idletasks()
+        timings.record('startup.first_paint', time.perf_counter() - _process_start)
+        self.after_idle(self._on_startup_idle)
+
+    def _on_startup_idle(self):
+        self._prewarm_game_toolbar()
+        self._start_win_probability()
+        report = timings.report('startup.')
+        logging.info('Startup timings:\n{}'.format(report))
+        if self.options.get('startup_profile'):
+            print(report, flush=True)
+            self.quit()
+        elif self.options.get('load_test'):
+            self._start_load_test()
+        elif self.options.get('replay_input'):
+            self._start_input_replay()
+        elif self.options.get('watch'):
+            self._start_watching()
+        elif self.options.get('record_input'):
+            import inputsession
+            self.recorder = inputsession.Recorder(self, self.options['record_input'],
+                                                  header={'seed': self.options.get('seed'), 'argv': sys.argv[1:]})
+            self.recorder.start()
+
+    def _start_load_test(self):
+        """
+        Play random games through the views' entry points, print how the spectator kept up, and
+        exit. See module loadgen.
+        """
+        import loadgen
+
+        def new_game():
+            self._setup_game_toolbar_frame.on_reset_board()
+            self._setup_game_toolbar_frame.on_start_game()
+
+        def on_done(report):
+            print(loadgen.format_report(report), flush=True)
+            print(timings.report('load.'), flush=True)
+            self.quit()
+
+        generator = loadgen.LoadGenerator(self.game, seed=self.options.get('seed'), new_game=new_game)
+        loadgen.LiveDriver(self, generator, self.options['load_test'], self.options.get('load_rate'), on_done).start()
+
+    def _start_input_replay(self):
+        """
+        Replay a recorded input session into the views, print how long each kind of event took to
+        handle, and exit. See module inputsession.
+        """
+        import inputsession
+
+        def on_done(replayed):
+            print(inputsession.format_report(replayed, player.missing), flush=True)
+            print(timings.report('input.'), flush=True)
+            self.quit()
+
+        _, events = inputsession.read_session(self.options['replay_input'])
+        player = inputsession.Player(self, events,
+                                     max_speed=self.options.get('replay_speed') == 'max', on_done=on_done)
+        player.start()
+
+    def _start_watching(self):
+        """
+        Load the log to watch, and play it back with the autoplay controls under the command bar.
+        See module autoplay.
+        """
+        import autoplay
+        import views
+        with open(self.options['watch']) as fp:
+            lines = fp.readlines()
+        player = autoplay.Autoplay(self, self.changes, lines, lambda game: self.load_game(game, undo=False),
+                                   speed=self.options.get('watch_speed') or 10)
+        self._autoplay_frame = views.AutoplayFrame(self, player)
+        self._autoplay_frame.grid(row=3, column=0, sticky=tkinter.EW)
+        player.start()
+
+    def _prewarm_game_toolbar(self):
+        """
+        Build the in-game toolbar (ungridded) if it hasn't been built yet. Scheduled on idle after
+        the first paint, and called again on the transition into game in case 'Start Game' beat it.
+        """
+        if self._game_toolbar_frame is not None:
+            return
+        import views
+        with timings.measure('startup.prewarm_game_toolbar'):
+            self._game_toolbar_frame = views.GameToolbarFrame(self, self.game, self.production, self.ports,
+                                                              self.changes, archive=self.archive)
+
+    def _start_win_probability(self):
+        """
+        Start the win probability panel. Deferred to idle after the first paint, since it pulls in
+        numpy; its worker processes only start once a game does.
+        """
+        if self._win_probability_frame is not None:
+            return
+        import simulation
+        import views
+        with timings.measure('startup.win_probability'):
+            estimator = simulation.WinProbabilityEstimator(self.game, self.longest_road, zobrist=self.zobrist,
+                                                           changes=self.changes)
+            self._win_probability_frame = views.WinProbabilityFrame(self, estimator)
+            self._win_probability_frame.grid(row=1, column=2, rowspan=2, sticky=tkinter.N)
+
 
 def main():
     logging.basicConfig(format='%(asctime)s %(levelname)s:%(module)s:%(funcName)s:%(message)s',
@@ -69,8 +303,84 @@ def main():
     parser.add_argument('--players', help='random|preset|empty|debug, default preset')
     parser.add_argument('--pregame', help='on|off, default on')
     parser.add_argument('--use_stdout', help='write to stdout', action='store_true')
+    parser.add_argument('--startup-profile', help='print startup timings (imports, first paint) and exit',
+                        action='store_true')
+    parser.add_argument('--generate', type=int, metavar='N',
+                        help='print N random boards in the --board format and exit')
+    parser.add_argument('--seed', type=int, help='random seed for --generate, --load-test and --record-input')
+    parser.add_argument('--spread-2-12', help='random boards: 2s and 12s are not adjacent', action='store_true')
+    parser.add_argument('--spread-same-numbers', help='random boards: the same numbers are not adjacent',
+                        action='store_true')
+    parser.add_argument('--max-cluster', type=int, metavar='K',
+                        help='random boards: at most K adjacent tiles of the same terrain')
+    parser.add_argument('--score-boards', metavar='FILE',
+                        help="rank the boards in FILE (one --board string per line, '-' for stdin) "
+                             "by fairness, fairest first, and exit")
+    parser.add_argument('--archive', metavar='DB',
+                        help='add games ended with End Game to the SQLite game archive DB, see module archive')
+    parser.add_argument('--export-dataset', metavar='DIR',
+                        help='add each game played to the numpy dataset in DIR, see module mlexport')
+    parser.add_argument('--undo-depth', type=int, metavar='N',
+                        help='keep the latest N undo steps in memory and spill older ones to disk, default 100')
+    parser.add_argument('--undo-spill', metavar='FILE',
+                        help='spill undo history to FILE, default a temporary file, see module undohistory')
+    parser.add_argument('--ghost-radius', type=int, metavar='PX',
+                        help='only draw the shadows of pieces which can be placed within PX of the pointer, '
+                             'with a dot at every other spot')
+    parser.add_argument('--load-test', type=int, metavar='N',
+                        help='play N random actions through the views, print throughput, lag and memory growth, '
+                             'and exit, see module loadgen')
+    parser.add_argument('--load-rate', type=float, metavar='R',
+                        help='--load-test actions per second, default as fast as the views keep up')
+    parser.add_argument('--primary', type=int, metavar='PORT',
+                        help='serve the game to standby spectators on PORT, see module replication')
+    parser.add_argument('--standby', metavar='HOST:PORT',
+                        help='replicate the game of the primary spectator at HOST:PORT, ready to take over')
+    parser.add_argument('--watch', metavar='LOG',
+                        help='play the game in the .catan LOG back, with controls for speed and turn, '
+                             'see module autoplay')
+    parser.add_argument('--watch-speed', type=int, metavar='N',
+                        help='--watch at N actions per second, 1 to 100, default 10')
+    parser.add_argument('--record-input', metavar='FILE',
+                        help='record mouse and keyboard input to FILE, for --replay-input, see module inputsession')
+    parser.add_argument('--replay-input', metavar='FILE',
+                        help='replay the input recorded in FILE, print how long the views took to handle it, '
+                             'and exit; start with the same options it was recorded with')
+    parser.add_argument('--replay-speed', choices=['original', 'max'], default='original',
+                        help='--replay-input at the pace it was recorded, or as fast as the views keep up')
 
     args = parser.parse_args()
+    if args.generate is not None or args.spread_2_12 or args.spread_same_numbers or args.max_cluster is not None:
+        import boardgen
+        board_rules = boardgen.Rules(spread_2_12=args.spread_2_12,
+                                     spread_same_numbers=args.spread_same_numbers,
+                                     max_cluster=args.max_cluster)
+    else:
+        board_rules = None
+    if args.generate is not None:
+        for board in boardgen.generate_boards(args.generate, board_rules, seed=args.seed):
+            print(board)
+        return
+    if args.score_boards is not None:
+        import fairness
+        if args.score_boards == '-':
+            boards = [line.strip() for line in sys.stdin if line.strip()]
+        else:
+            with open(args.score_boards) as fp:
+                boards = [line.strip() for line in fp if line.strip()]
+        scores = fairness.score(fairness.encode(boards))
+        for i in fairness.rank(scores):
+            print('{}\t{}'.format(boards[i], fairness.describe(scores, i)))
+        return
+    if args.replay_input is not None:
+        import inputsession
+        args.seed = inputsession.read_header(args.replay_input).get('seed')
+    elif args.record_input is not None and args.seed is None:
+        args.seed = random.randrange(2 ** 32)
+    if args.replay_input is not None or args.record_input is not None:
+        # random boards, Reset Board and random players come out the same when replayed
+        random.seed(args.seed)
+
     options = {
         'board': args.board,
         'terrain': args.terrain,
@@ -79,11 +389,29 @@ def main():
         'pieces': args.pieces,
         'players': args.players,
         'pregame': args.pregame,
-        'use_stdout': args.use_stdout
+        'use_stdout': args.use_stdout,
+        'startup_profile': args.startup_profile,
+        'board_rules': board_rules,
+        'archive': args.archive,
+        'export_dataset': args.export_dataset,
+        'undo_depth': args.undo_depth,
+        'undo_spill': args.undo_spill,
+        'ghost_radius': args.ghost_radius,
+        'load_test': args.load_test,
+        'load_rate': args.load_rate,
+        'seed': args.seed,
+        'primary': args.primary,
+        'standby': args.standby,
+        'watch': args.watch,
+        'watch_speed': args.watch_speed,
+        'record_input': args.record_input,
+        'replay_input': args.replay_input,
+        'replay_speed': args.replay_speed,
     }
     logging.info('args=\n{}'.format(pprint.pformat(options)))
     app = CatanSpectator(options=options)
     app.mainloop()
+    app.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,504 @@
+"""
+module mlexport provides a columnar dataset of game positions, for machine learning
+
+Every action line of a game's log becomes one row: the action, and the position just after it.
+Columns are numpy arrays, one row per action:
+- game (int32), line (int32): game number in the dataset, and line number within the game's actions
+- seat (int8): seat of the player acting, 0-3
+- action (int8): index into ACTIONS
+- args (int16, 3): the action's arguments, see ACTIONS
+- give, get (int8, 5): resources given and gotten by a trade, in RESOURCES order
+- node_owner (int8, 54), edge_owner (int8, 72): seat + 1 of the owner of each node and edge, 0 if empty,
+  in gridtables.NODES and gridtables.EDGES order
+- node_city (int8, 54): 1 where a node has a city
+- robber (int8): tile identifier the robber is on
+- production (int16, 4, 5): each seat's pips per resource, not counting the robber's tile
+- resources (int16, 4, 5): each seat's resources as far as the log shows. Steals, discards and
+  dev cards aren't in the log, so this is an estimate, and can go negative
+- knights (int8, 4), vp_cards (int8, 4): knights and victory point cards played by each seat
+- longest_road, largest_army (int8): seat holding each, -1 for nobody
+- vp (int8, 4): each seat's public victory points
+
+A dataset is a directory of chunks, one directory of .npy files per chunk, and an index.json.
+#consolidate joins the chunks into one .npy per column, which training jobs can memory map:
+
+    node_owner = numpy.load('dataset/node_owner.npy', mmap_mode='r')
+
+Rows come from replaying logs (#export_logs, or run this module), or live from the spectator
+(LiveExporter, run off the UI thread, see --export-dataset in main.py). Both replay the log, so their rows are the same.
+
+Usage:
+    $ python3 mlexport.py dataset/ log/*.catan
+    $ python3 mlexport.py dataset/  # consolidate a dataset written by the spectator
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import sys
+
+import hexgrid
+import numpy
+from catan.board import Terrain
+from catan.pieces import PieceType
+
+import gridtables
+import longestroad
+import replay
+
+RESOURCES = [Terrain.wood, Terrain.brick, Terrain.wheat, Terrain.sheep, Terrain.ore]
+
+# action kinds (see replay.parse_line), and what their args are
+ACTIONS = collections.OrderedDict([
+    ('roll', 'roll'),
+    ('build', 'piece type (0 road, 1 settlement, 2 city), coord'),
+    ('dev_card', ''),
+    ('knight', ''),
+    ('robber', 'tile, victim seat or -1'),
+    ('road_builder', 'edge, edge'),
+    ('year_of_plenty', 'resource, resource'),
+    ('monopoly', 'resource'),
+    ('victory_point', ''),
+    ('trade', 'partner seat, or -1 for a port; port ratio'),
+    ('end_turn', ''),
+    ('wins', ''),
+])
+ACTION_CODES = dict((kind, i) for i, kind in enumerate(ACTIONS))
+
+NUM_SEATS = 4
+_node_index = dict((node, i) for i, node in enumerate(gridtables.NODES))
+_edge_index = dict((edge, i) for i, edge in enumerate(gridtables.EDGES))
+_piece_codes = {PieceType.road: 0, PieceType.settlement: 1, PieceType.city: 2}
+
+COLUMNS = collections.OrderedDict([
+    ('game', ('int32', ())),
+    ('line', ('int32', ())),
+    ('seat', ('int8', ())),
+    ('action', ('int8', ())),
+    ('args', ('int16', (3,))),
+    ('give', ('int8', (len(RESOURCES),))),
+    ('get', ('int8', (len(RESOURCES),))),
+    ('node_owner', ('int8', (len(gridtables.NODES),))),
+    ('node_city', ('int8', (len(gridtables.NODES),))),
+    ('edge_owner', ('int8', (len(gridtables.EDGES),))),
+    ('robber', ('int8', ())),
+    ('production', ('int16', (NUM_SEATS, len(RESOURCES)))),
+    ('resources', ('int16', (NUM_SEATS, len(RESOURCES)))),
+    ('knights', ('int8', (NUM_SEATS,))),
+    ('vp_cards', ('int8', (NUM_SEATS,))),
+    ('longest_road', ('int8', ())),
+    ('largest_army', ('int8', ())),
+    ('vp', ('int8', (NUM_SEATS,))),
+])
+
+_costs = {
+    PieceType.road: {Terrain.wood: 1, Terrain.brick: 1},
+    PieceType.settlement: {Terrain.wood: 1, Terrain.brick: 1, Terrain.wheat: 1, Terrain.sheep: 1},
+    PieceType.city: {Terrain.wheat: 2, Terrain.ore: 3},
+    'dev_card': {Terrain.wheat: 1, Terrain.sheep: 1, Terrain.ore: 1},
+}
+
+
+class RowBuffer(object):
+    """
+    class RowBuffer holds rows in one preallocated array per column, so that a row costs its bytes
+    rather than a Python object per column. The arrays double when full.
+
+    :param capacity: rows to allocate to begin with, int
+    """
+    def __init__(self, capacity=256):
+        self.columns = dict((name, numpy.zeros((capacity,) + shape, dtype=dtype))
+                            for name, (dtype, shape) in COLUMNS.items())
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self):
+        """
+        :return: dict mapping column name -> writable view of a new row, zeroed. The views are
+        only good until the next append
+        """
+        if self._len == len(self.columns['game']):
+            for name, column in self.columns.items():
+                grown = numpy.zeros((2 * len(column),) + column.shape[1:], dtype=column.dtype)
+                grown[:self._len] = column
+                self.columns[name] = grown
+        i = self._len
+        self._len += 1
+        return dict((name, column[i:i + 1].reshape(column.shape[1:])) for name, column in self.columns.items())
+
+    def column(self, name):
+        """
+        :return: the rows' values of a column, numpy array
+        """
+        return self.columns[name][:self._len]
+
+
+class GameRecorder(object):
+    """
+    class GameRecorder replays one game's log and makes a row for each of its action lines.
+
+    :param header: replay.Header
+    :param game_number: the game's number in the dataset, int
+    """
+    def __init__(self, header, game_number):
+        self.header = header
+        self.game_number = game_number
+        self.rows = RowBuffer()
+
+        self._replayer = replay.Replayer(replay.new_game(header))
+        self._seats = dict((player.color, i) for i, player in enumerate(header.players))
+        self._longest_road = longestroad.LongestRoadIndex(self._replayer.game)
+        self._resources = numpy.zeros((NUM_SEATS, len(RESOURCES)), dtype='int16')
+        self._knights = numpy.zeros(NUM_SEATS, dtype='int8')
+        self._vp_cards = numpy.zeros(NUM_SEATS, dtype='int8')
+        self._largest_army = -1
+        self._pregame_settlements = collections.Counter()
+
+    def record(self, line):
+        """
+        Apply the line and append its row to #rows, a RowBuffer.
+
+        :param line: an action line of the game's log
+        """
+        game = self._replayer.game
+        kind, color, action = replay.parse_line(line)
+        seat = self._seats[color]
+        pregame = game.state.is_in_pregame()
+        self._replayer.apply(line)
+
+        row = self.rows.append()
+        row['game'][()] = self.game_number
+        row['line'][()] = len(self.rows) - 1
+        row['seat'][()] = seat
+        row['action'][()] = ACTION_CODES[kind]
+        self._account(kind, seat, action, row, pregame)
+        self._encode_position(row)
+
+    def _account(self, kind, seat, action, row, pregame):
+        resources = self._resources
+        if kind == 'roll':
+            row['args'][0] = action.roll
+            if action.roll != 7:
+                for tile_id, owner_seat, multiplier in self._producing(action.roll):
+                    resources[owner_seat, RESOURCES.index(self._terrain(tile_id))] += multiplier
+        elif kind == 'build':
+            row['args'][:2] = _piece_codes[action.piece_type], action.coord
+            if pregame:
+                if action.piece_type == PieceType.settlement:
+                    self._pregame_settlements[seat] += 1
+                    if self._pregame_settlements[seat] == 2:
+                        # the second settlement of the pregame collects from the tiles around it
+                        for tile_id in gridtables.NODE_TILES[action.coord]:
+                            if self._terrain(tile_id) in RESOURCES:
+                                resources[seat, RESOURCES.index(self._terrain(tile_id))] += 1
+            else:
+                self._pay(seat, _costs[action.piece_type])
+        elif kind == 'dev_card':
+            self._pay(seat, _costs['dev_card'])
+        elif kind == 'knight':
+            self._knights[seat] += 1
+            self._update_largest_army()
+        elif kind == 'robber':
+            row['args'][:2] = action.tile_id, self._seats.get(action.victim_color, -1)
+        elif kind == 'road_builder':
+            row['args'][:2] = action.edges
+        elif kind == 'year_of_plenty':
+            row['args'][:2] = [RESOURCES.index(r) for r in action.resources]
+            for resource in action.resources:
+                resources[seat, RESOURCES.index(resource)] += 1
+        elif kind == 'monopoly':
+            r = RESOURCES.index(action.resource)
+            row['args'][0] = r
+            taken = resources[:, r].clip(min=0).sum() - max(resources[seat, r], 0)
+            resources[:, r] = 0
+            resources[seat, r] = taken
+        elif kind == 'victory_point':
+            self._vp_cards[seat] += 1
+        elif kind == 'trade':
+            partner = self._seats.get(action.partner, -1)
+            row['args'][:2] = partner, _trade_ratio(action)
+            for num, terrain in action.giving:
+                row['give'][RESOURCES.index(terrain)] += num
+            for num, terrain in action.getting:
+                row['get'][RESOURCES.index(terrain)] += num
+            resources[seat] += row['get'] - row['give']
+            if partner >= 0:
+                resources[partner] += row['give'] - row['get']
+
+    def _pay(self, seat, cost):
+        for terrain, num in cost.items():
+            self._resources[seat, RESOURCES.index(terrain)] -= num
+
+    def _terrain(self, tile_id):
+        return self._replayer.game.board.tiles[tile_id - 1].terrain
+
+    def _producing(self, roll):
+        game = self._replayer.game
+        for tile in game.board.tiles:
+            if tile.number.value != roll or tile.tile_id == game.robber_tile:
+                continue
+            for node in gridtables.TILE_NODES[tile.tile_id]:
+                piece = game.board.pieces.get((hexgrid.NODE, node))
+                if piece is not None and piece.owner is not None and piece.owner.color in self._seats:
+                    yield tile.tile_id, self._seats[piece.owner.color], 2 if piece.type == PieceType.city else 1
+
+    def _update_largest_army(self):
+        most = self._knights.max()
+        if most < 3 or (self._largest_army >= 0 and self._knights[self._largest_army] == most):
+            return
+        leaders = numpy.flatnonzero(self._knights == most)
+        if len(leaders) == 1:
+            self._largest_army = int(leaders[0])
+
+    def _encode_position(self, row):
+        game = self._replayer.game
+        settlements = numpy.zeros(NUM_SEATS, dtype='int8')
+        cities = numpy.zeros(NUM_SEATS, dtype='int8')
+        for (hex_type, coord), piece in game.board.pieces.items():
+            if piece.type == PieceType.robber:
+                row['robber'][()] = hexgrid.tile_id_from_coord(coord)
+                continue
+            seat = self._seats.get(getattr(piece.owner, 'color', None))
+            if seat is None:
+                continue
+            if piece.type == PieceType.road:
+                row['edge_owner'][_edge_index[coord]] = seat + 1
+            else:
+                row['node_owner'][_node_index[coord]] = seat + 1
+                if piece.type == PieceType.city:
+                    row['node_city'][_node_index[coord]] = 1
+                    cities[seat] += 1
+                else:
+                    settlements[seat] += 1
+                for tile_id in gridtables.NODE_TILES[coord]:
+                    tile = game.board.tiles[tile_id - 1]
+                    if tile.terrain in RESOURCES and tile.number.value is not None and tile_id != game.robber_tile:
+                        row['production'][seat, RESOURCES.index(tile.terrain)] += \
+                            gridtables.PIPS[tile.number.value] * (2 if piece.type == PieceType.city else 1)
+
+        holder = self._longest_road.holder()
+        row['longest_road'][()] = self._seats[holder.color] if holder is not None else -1
+        row['largest_army'][()] = self._largest_army
+        row['resources'][:] = self._resources
+        row['knights'][:] = self._knights
+        row['vp_cards'][:] = self._vp_cards
+        row['vp'][:] = settlements + 2 * cities + self._vp_cards
+        for holder_seat in (row['longest_road'][()], row['largest_army'][()]):
+            if holder_seat >= 0:
+                row['vp'][holder_seat] += 2
+
+
+def _trade_ratio(action):
+    if action.partner is None or isinstance(action.partner, str):
+        return 0
+    return {'4:1': 4, '3:1': 3}.get(action.partner.value, 2)
+
+
+class Writer(object):
+    """
+    class Writer writes rows to a dataset directory, a chunk at a time.
+
+    :param path: dataset directory, created if it doesn't exist. Chunks are added after any already there.
+    :param chunk_rows: rows per chunk, int. A chunk is buffered in one preallocated array per column,
+    allocated when the first game is added, so that a Writer is cheap to pickle into another process
+    """
+    def __init__(self, path, chunk_rows=65536):
+        self.path = path
+        self.chunk_rows = chunk_rows
+        os.makedirs(path, exist_ok=True)
+        self.index = _read_index(path)
+        self._chunk = None  # column -> array of chunk_rows rows
+        self._pending = 0  # rows of _chunk filled
+
+    @property
+    def next_game_number(self):
+        return len(self.index['games'])
+
+    def add_game(self, rows, source=None):
+        """
+        :param rows: RowBuffer, as from GameRecorder.rows
+        :param source: where the game came from, eg a log path, str
+        """
+        if self._chunk is None:
+            self._chunk = dict((name, numpy.zeros((self.chunk_rows,) + shape, dtype=dtype))
+                               for name, (dtype, shape) in COLUMNS.items())
+        start = self.index['rows'] + self._pending
+        self.index['games'].append({'source': source, 'start': start, 'rows': len(rows)})
+        done = 0
+        while done < len(rows):
+            n = min(len(rows) - done, self.chunk_rows - self._pending)
+            for name, column in self._chunk.items():
+                column[self._pending:self._pending + n] = rows.column(name)[done:done + n]
+            self._pending += n
+            done += n
+            if self._pending == self.chunk_rows:
+                self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        name = 'chunk-{:05d}'.format(len(self.index['chunks']))
+        os.makedirs(os.path.join(self.path, name), exist_ok=True)
+        for column in COLUMNS:
+            numpy.save(os.path.join(self.path, name, column + '.npy'), self._chunk[column][:self._pending])
+        self.index['chunks'].append({'name': name, 'start': self.index['rows'], 'rows': self._pending})
+        self.index['rows'] += self._pending
+        self.index['consolidated'] = False
+        self._pending = 0
+        _write_index(self.path, self.index)
+        logging.info('mlexport: wrote {} to {}, {} rows in total'.format(name, self.path, self.index['rows']))
+
+    def close(self):
+        self.flush()
+
+
+class LiveExporter(object):
+    """
+    class LiveExporter exports the games played in the spectator as they are transcribed.
+
+    It's an eventqueue consumer: it replays each new line of the log of each event. Undo shortens
+    the log, and the game's rows are rebuilt from the lines left. A game is added to the dataset
+    when it ends, when a new game starts, or on #close, which also consolidates the dataset. It has
+    to see the event a game ends on, so subscribe it with policy eventqueue.BLOCK.
+
+    :param path: dataset directory
+    """
+    def __init__(self, path):
+        self.writer = Writer(path)
+        self._header_text = None
+        self._recorder = None
+        self._lines = list()
+
+    def on_event(self, event):
+        header_text, found, actions = event.log.partition('...CATAN!\n')
+        if not found:
+            return
+        if header_text != self._header_text:
+            self._add_game()
+            self._header_text = header_text
+            self._lines = list()
+            self._recorder = None
+
+        lines = [line for line in actions.split('\n')[:-1] if line.strip()]  # complete lines only
+        if lines[:len(self._lines)] != self._lines:
+            self._recorder = None
+            self._lines = list()
+        if self._recorder is None:
+            header, _ = replay.read_header((header_text + '...CATAN!').split('\n'))
+            self._recorder = GameRecorder(header, self.writer.next_game_number)
+        for line in lines[len(self._lines):]:
+            try:
+                self._recorder.record(line)
+            except replay.ReplayError as e:
+                logging.warning('mlexport: stopped exporting this game at "{}": {}'.format(line, e))
+                break
+            self._lines.append(line)
+            if line.endswith(' wins'):
+                self._add_game()
+
+    def close(self):
+        self._add_game()
+        self.writer.close()
+        consolidate(self.writer.path)
+
+    def _add_game(self):
+        if self._recorder is not None and self._recorder.rows:
+            self.writer.add_game(self._recorder.rows, source='live')
+            self.writer.flush()
+        self._recorder = None
+
+
+def export_logs(path, log_paths, chunk_rows=65536):
+    """
+    Replay each log and add its rows to the dataset, then consolidate it.
+
+    :param path: dataset directory
+    :param log_paths: list of paths to .catan logs
+    :return: number of rows added
+    """
+    writer = Writer(path, chunk_rows=chunk_rows)
+    added = 0
+    for log_path in log_paths:
+        with open(log_path) as fp:
+            lines = fp.readlines()
+        try:
+            header, start = replay.read_header(lines)
+            recorder = GameRecorder(header, writer.next_game_number)
+            for line in lines[start:]:
+                if line.strip():
+                    recorder.record(line.rstrip('\n'))
+        except replay.ReplayError as e:
+            logging.warning('mlexport: skipping {}: {}'.format(log_path, e))
+            continue
+        writer.add_game(recorder.rows, source=log_path)
+        added += len(recorder.rows)
+    writer.close()
+    consolidate(path)
+    return added
+
+
+def consolidate(path):
+    """
+    Join the dataset's chunks into one memory mappable .npy file per column, <path>/<column>.npy.
+
+    :param path: dataset directory
+    """
+    index = _read_index(path)
+    if index['consolidated']:
+        return
+    for column, (dtype, shape) in COLUMNS.items():
+        out = numpy.lib.format.open_memmap(os.path.join(path, column + '.npy'), mode='w+',
+                                           dtype=dtype, shape=(index['rows'],) + shape)
+        for chunk in index['chunks']:
+            out[chunk['start']:chunk['start'] + chunk['rows']] = \
+                numpy.load(os.path.join(path, chunk['name'], column + '.npy'), mmap_mode='r')
+        out.flush()
+        del out
+    index['consolidated'] = True
+    _write_index(path, index)
+
+
+def load(path, mmap_mode='r'):
+    """
+    :param path: a consolidated dataset directory
+    :return: dict mapping column name -> numpy array, memory mapped by default
+    """
+    index = _read_index(path)
+    if not index['consolidated']:
+        raise ValueError('{} has chunks which are not consolidated, see #consolidate'.format(path))
+    return dict((column, numpy.load(os.path.join(path, column + '.npy'), mmap_mode=mmap_mode))
+                for column in COLUMNS)
+
+
+def _read_index(path):
+    index_path = os.path.join(path, 'index.json')
+    if not os.path.exists(index_path):
+        return {'columns': dict((name, {'dtype': dtype, 'shape': list(shape)}) for name, (dtype, shape) in COLUMNS.items()),
+                'actions': list(ACTIONS.items()),
+                'resources': [r.value for r in RESOURCES],
+                'rows': 0, 'chunks': list(), 'games': list(), 'consolidated': True}
+    with open(index_path) as fp:
+        return json.load(fp)
+
+
+def _write_index(path, index):
+    with open(os.path.join(path, 'index.json'), 'w') as fp:
+        json.dump(index, fp, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='export .catan logs as a columnar numpy dataset')
+    parser.add_argument('dataset', help='dataset directory, rows are added to any already there')
+    parser.add_argument('logs', nargs='*', help='.catan logs to export; with none, just consolidate the dataset')
+    parser.add_argument('--chunk-rows', type=int, default=65536, help='rows per chunk, default 65536')
+    args = parser.parse_args()
+    added = export_logs(args.dataset, args.logs, chunk_rows=args.chunk_rows)
+    print('{} rows from {} logs added to {}'.format(added, len(args.logs), args.dataset))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
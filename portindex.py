@@ -0,0 +1,159 @@
+"""
+module portindex provides an incrementally maintained index of the ports, and of who can trade at them
+
+PortIndex observes the game and keeps
+- coastal slot (tile id, direction) -> port
+- coastal node -> the ports it serves
+- node -> owner of the settlement or city on it
+- player -> Counter mapping port type -> settlements/cities of theirs on a port of that type
+
+A placement, upgrade or removal touches only its node. The changes are the board events of the
+views' changeevents.ChangePublisher, which include undo. Port edits (cycling a port's type during setup, rotating the ports,
+locking the board, which drops the empty slots) rebuild the port tables, which have a few dozen
+entries at most.
+"""
+import collections
+import logging
+
+import hexgrid
+from catan.board import PortType
+from catan.pieces import PieceType
+
+import changeevents
+import gridtables
+
+_buildings = (PieceType.settlement, PieceType.city)
+
+
+class PortIndex(object):
+    """
+    class PortIndex answers port questions with a dictionary lookup.
+
+    Use #port_at for the port in a coastal slot, #ports_at_node for the ports a node serves, and
+    #has_port_type or #port_types for what a player can trade at.
+
+    version is incremented whenever the index changes.
+
+    :param game: catan.game.Game
+    :param changes: changeevents.ChangePublisher to be kept up to date by, or None to observe the
+    game and diff its board instead, and on every query
+    """
+    def __init__(self, game, changes=None):
+        self.game = game
+        self.version = 0
+
+        self._diff = None
+        self._slots = dict()  # (tile_id, direction) -> Port
+        self._node_ports = dict()  # node -> tuple of Ports
+        self._buildings = dict()  # node -> owner
+        self._port_types = collections.defaultdict(collections.Counter)
+
+        if changes is None:
+            self._diff = changeevents.BoardDiff()
+            self.game.observers.add(self)
+            self.sync()
+        else:
+            self.on_changes(changeevents.BoardDiff().events(game.board))
+            changes.subscribe_index(self.on_changes, changeevents.PiecePlaced, changeevents.PieceRemoved,
+                                    changeevents.PortsChanged)
+
+    def notify(self, observable):
+        self.sync()
+
+    def sync(self):
+        """
+        Without a publisher, apply whatever changed on the board since the last sync. Queries sync
+        first, since game observers are notified in no particular order and one may ask before
+        we're notified. With a publisher, we're always up to date.
+        """
+        if self._diff is not None:
+            events = self._diff.events(self.game.board)
+            if events:
+                self.on_changes(events)
+
+    def on_changes(self, events):
+        """
+        :param events: list of changeevents, those which aren't about settlements, cities or ports are ignored
+        """
+        changed = ports_changed = False
+        for event in events:
+            if isinstance(event, changeevents.PieceRemoved) and event.type in _buildings:
+                self._remove_building(event.coord, event.owner)
+            elif isinstance(event, changeevents.PiecePlaced) and event.type in _buildings:
+                self._add_building(event.coord, event.owner)
+            elif isinstance(event, changeevents.PortsChanged):
+                ports_changed = True
+            else:
+                continue
+            changed = True
+        if ports_changed:
+            self._index_ports()
+        if changed:
+            self.version += 1
+
+    def port_at(self, tile_id, direction):
+        """
+        :param tile_id: coastal tile identifier, int
+        :param direction: direction of the coast from the tile, str, eg 'NW'
+        :return: catan.board.Port in the slot, or None
+        """
+        self.sync()
+        return self._slots.get((tile_id, direction))
+
+    def ports_at_node(self, node):
+        """
+        :param node: node coordinate, int
+        :return: tuple of the Ports (other than empty slots) a settlement or city on the node trades at
+        """
+        self.sync()
+        return self._node_ports.get(node, ())
+
+    def has_port_type(self, player, port_type):
+        """
+        Same as Game.player_has_port_type.
+
+        :param player: catan.game.Player
+        :param port_type: catan.board.PortType
+        :return: True if the player has a settlement or city on a port of the type
+        """
+        self.sync()
+        return self._port_types.get(player, collections.Counter())[port_type] > 0
+
+    def port_types(self, player):
+        """
+        :param player: catan.game.Player
+        :return: set of the PortTypes the player has a settlement or city on
+        """
+        self.sync()
+        return set(port_type for port_type, n in self._port_types.get(player, collections.Counter()).items() if n > 0)
+
+    def _credit(self, node, owner, sign):
+        for port in self._node_ports.get(node, ()):
+            self._port_types[owner][port.type] += sign
+
+    def _add_building(self, node, owner):
+        self._buildings[node] = owner
+        self._credit(node, owner, +1)
+
+    def _remove_building(self, node, owner):
+        if self._buildings.pop(node, None) is not None:
+            self._credit(node, owner, -1)
+
+    def _index_ports(self):
+        self._slots = dict()
+        node_ports = collections.defaultdict(list)
+        for port in self.game.board.ports:
+            slot = (port.tile_id, port.direction)
+            self._slots.setdefault(slot, port)
+            if port.type == PortType.none:
+                continue
+            nodes = gridtables.COAST_NODES.get(slot)
+            if nodes is None:
+                logging.warning('portindex: port={} is not on the coast'.format(port))
+                nodes = hexgrid.nodes_touching_edge(hexgrid.edge_coord_in_direction(*slot))
+            for node in nodes:
+                node_ports[node].append(port)
+        self._node_ports = dict((node, tuple(ports)) for node, ports in node_ports.items())
+        self._port_types = collections.defaultdict(collections.Counter)
+        for node, owner in self._buildings.items():
+            self._credit(node, owner, +1)
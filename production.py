@@ -0,0 +1,183 @@
+"""
+module production provides an incrementally maintained index of what each player produces
+
+ProductionIndex observes the game and keeps
+- tile id -> number and terrain
+- tile id -> settlements/cities on its corners, as node -> (owner, multiplier)
+- dice number -> tile ids
+- player -> pip-weighted income per resource, not counting the tile the robber is on
+
+Only the tiles touching a change are recomputed: a placement or upgrade touches the (up to 3)
+tiles around its node, a robber move touches two tiles, a tile edit touches one. The changes
+are the board events of the views' changeevents.ChangePublisher, which include undo, so a query
+is a lookup.
+"""
+import collections
+import logging
+
+from catan.board import Terrain
+from catan.pieces import PieceType
+
+import changeevents
+import gridtables
+
+_multipliers = {
+    PieceType.settlement: 1,
+    PieceType.city: 2,
+}
+
+
+class ProductionIndex(object):
+    """
+    class ProductionIndex answers production questions in O(adjacent nodes).
+
+    Use #income for a player's pip-weighted income (pips are the number of ways out of 36 to
+    roll a tile's number), #payouts for what a roll pays out, and #stealable_players for the
+    players with a building on the robber's tile.
+
+    version is incremented whenever the index changes, so views can skip redrawing when nothing
+    they show has changed.
+
+    :param game: catan.game.Game
+    :param changes: changeevents.ChangePublisher to be kept up to date by, or None to observe the
+    game and diff its board instead, and on every query
+    """
+    def __init__(self, game, changes=None):
+        self.game = game
+        self.version = 0
+
+        self._diff = None
+        self._tiles = dict()  # tile_id -> (terrain, number value)
+        self._tiles_by_number = collections.defaultdict(set)
+        self._buildings = dict((tile_id, dict()) for tile_id in gridtables.TILE_IDS)
+        self._income = collections.defaultdict(collections.Counter)
+        self._robber_tile = None
+
+        if changes is None:
+            self._diff = changeevents.BoardDiff()
+            self.game.observers.add(self)
+            self.sync()
+        else:
+            self.on_changes(changeevents.BoardDiff().events(game.board))
+            changes.subscribe_index(self.on_changes, *changeevents.BOARD_EVENTS)
+
+    def notify(self, observable):
+        self.sync()
+
+    def sync(self):
+        """
+        Without a publisher, apply whatever changed on the board since the last sync. Queries sync
+        first, since game observers are notified in no particular order and one may ask before
+        we're notified. With a publisher, we're always up to date.
+        """
+        if self._diff is not None:
+            events = self._diff.events(self.game.board)
+            if events:
+                self.on_changes(events)
+
+    def on_changes(self, events):
+        """
+        :param events: list of changeevents, those which don't change production are ignored
+        """
+        changed = False
+        for event in events:
+            if isinstance(event, changeevents.PieceRemoved) and event.type in _multipliers:
+                self._remove_building(event.coord, event.owner, _multipliers[event.type])
+            elif isinstance(event, changeevents.PiecePlaced) and event.type in _multipliers:
+                self._add_building(event.coord, event.owner, _multipliers[event.type])
+            elif isinstance(event, changeevents.RobberMoved):
+                self._move_robber(event.new)
+            elif isinstance(event, changeevents.BoardEdited):
+                self._edit_tile(event.tile_id)
+            else:
+                continue
+            changed = True
+        if changed:
+            self.version += 1
+
+    def income(self, player):
+        """
+        :param player: catan.game.Player
+        :return: Counter mapping Terrain -> pips per roll (out of 36)
+        """
+        self.sync()
+        return collections.Counter(self._income.get(player, collections.Counter()))
+
+    def total_income(self, player):
+        self.sync()
+        return sum(self._income.get(player, collections.Counter()).values())
+
+    def payouts(self, roll):
+        """
+        :param roll: dice total, int
+        :return: dict mapping Player -> Counter(Terrain -> num cards) paid out by the roll
+        """
+        self.sync()
+        payouts = collections.defaultdict(collections.Counter)
+        for tile_id in self._tiles_by_number.get(int(roll), ()):
+            if tile_id == self._robber_tile:
+                continue
+            terrain, _ = self._tiles[tile_id]
+            for owner, multiplier in self._buildings[tile_id].values():
+                payouts[owner][terrain] += multiplier
+        return dict(payouts)
+
+    def stealable_players(self):
+        """
+        :return: set of Players with a settlement or city on the robber's tile, except the current player
+        """
+        self.sync()
+        if self._robber_tile is None:
+            return set()
+        stealable = set(owner for owner, _ in self._buildings[self._robber_tile].values())
+        stealable.discard(self.game.get_cur_player())
+        return stealable
+
+    def _contribution(self, tile_id, multiplier):
+        terrain, number = self._tiles.get(tile_id, (None, None))
+        if terrain in (None, Terrain.desert) or number is None:
+            return None, 0
+        return terrain, gridtables.PIPS[number] * multiplier
+
+    def _credit(self, tile_id, owner, multiplier, sign):
+        if tile_id == self._robber_tile:
+            return
+        terrain, pips = self._contribution(tile_id, multiplier)
+        if pips:
+            self._income[owner][terrain] += sign * pips
+
+    def _credit_tile(self, tile_id, sign):
+        for owner, multiplier in self._buildings[tile_id].values():
+            self._credit(tile_id, owner, multiplier, sign)
+
+    def _add_building(self, node, owner, multiplier):
+        for tile_id in gridtables.NODE_TILES.get(node, ()):
+            self._buildings[tile_id][node] = (owner, multiplier)
+            self._credit(tile_id, owner, multiplier, +1)
+
+    def _remove_building(self, node, owner, multiplier):
+        for tile_id in gridtables.NODE_TILES.get(node, ()):
+            if self._buildings[tile_id].pop(node, None) is not None:
+                self._credit(tile_id, owner, multiplier, -1)
+
+    def _edit_tile(self, tile_id):
+        self._credit_tile(tile_id, -1)
+        old = self._tiles.get(tile_id)
+        if old is not None:
+            self._tiles_by_number[old[1]].discard(tile_id)
+        tile = self.game.board.tiles[tile_id - 1]
+        self._tiles[tile_id] = (tile.terrain, tile.number.value)
+        self._tiles_by_number[tile.number.value].add(tile_id)
+        self._credit_tile(tile_id, +1)
+
+    def _move_robber(self, tile_id):
+        old = self._robber_tile
+        if old == tile_id:
+            return
+        self._robber_tile = None
+        if old is not None:
+            self._credit_tile(old, +1)
+        if tile_id is not None:
+            self._credit_tile(tile_id, -1)
+        self._robber_tile = tile_id
+        logging.debug('production: robber moved from tile={} to tile={}'.format(old, tile_id))
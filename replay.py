@@ -0,0 +1,221 @@
+"""
+module replay provides replay of .catan game logs onto a catan.game.Game
+
+Each action line of a log is parsed (see module logstream) into the same actions as a command
+bar turn script (see module transcription), and applied to a game built from the log's header. Replay is for reading
+logs back, so the replayed game keeps no undo history and logs to memory only.
+
+Usage:
+    for game, line, kind in replay.replay_file('log/2016-01-01T12-00-00-a-b-c-d.catan'):
+        ...  # game is the position just after line was applied
+"""
+import collections
+import re
+
+import catanlog
+import hexgrid
+from catan.board import Board, Port, PortType, Terrain
+from catan.game import Game, Player
+from catan.pieces import PieceType
+
+import boardgen
+import logstream
+import transcription
+
+
+class ReplayError(ValueError):
+    """
+    Raised when a log can't be read, or one of its lines can't be applied to the game.
+    """
+    pass
+
+
+Header = collections.namedtuple('Header', ['players', 'terrain', 'numbers', 'ports'])
+Header.__doc__ = """
+players: list of catan.game.Player, in seat order
+terrain: list of 19 Terrain
+numbers: list of 19 int, None for the desert
+ports: list of catan.board.Port
+"""
+
+_player = re.compile(r'^name: (\S+), color: (\S+), seat: (\d)$')
+_port = re.compile(r'([^\s(]+)\((\d+) ([NSEW]+)\)')
+
+
+def read_header(lines):
+    """
+    :param lines: the lines of a .catan log
+    :return: (Header, index of the first action line)
+    """
+    players = list()
+    terrain = numbers = ports = None
+    for i, line in enumerate(lines):
+        line = line.rstrip('\n')
+        match = _player.match(line)
+        if match:
+            players.append(Player(int(match.group(3)), match.group(1), match.group(2)))
+        elif line.startswith('terrain: '):
+            terrain = [Terrain(value) for value in line[len('terrain: '):].split()]
+        elif line.startswith('numbers: '):
+            numbers = [None if value == 'None' else int(value) for value in line[len('numbers: '):].split()]
+        elif line.startswith('ports: '):
+            ports = [Port(int(tile_id), direction, PortType(port_type))
+                     for port_type, tile_id, direction in _port.findall(line)]
+        elif line == '...CATAN!':
+            if not players or terrain is None or numbers is None:
+                raise ReplayError('log header is missing its players, terrain or numbers')
+            return Header(players, terrain, numbers, ports or list()), i + 1
+    raise ReplayError('no "...CATAN!" line, is this a .catan log?')
+
+
+def new_game(header):
+    """
+    :param header: Header
+    :return: a started catan.game.Game with the header's board and players, in its pregame
+    """
+    board = Board(board=boardgen.board_string(header.terrain, header.numbers), pieces='preset')
+    board.ports = list(header.ports)
+    game = Game(board=board, logging='off', pregame='on')
+    game.catanlog = catanlog.CatanLog(auto_flush=False)
+    game.undo_manager = _NoUndoManager()
+    game.start(header.players)
+    return game
+
+
+def parse_line(line, knight=False):
+    """
+    :param line: an action line of a .catan log
+    :param knight: whether the previous line was '<color> plays knight'
+    :return: (kind, color, action). kind names the kind of line, eg 'roll' or 'build', see module
+    logstream. action is a transcription action, or None for lines which don't change the game
+    ('plays knight', which is applied with the robber line after it, and 'wins').
+    """
+    record = logstream.parse_line(line)
+    if record.kind == 'text':
+        raise ReplayError('unrecognized line "{}"'.format(record.args[0]))
+    return record.kind, record.color, _action(record, knight)
+
+
+def _action(record, knight):
+    kind, _, args = record
+    try:
+        if kind == 'roll':
+            return transcription.Roll(args[0])
+        elif kind == 'build':
+            piece_type = PieceType(args[0])
+            hex_type = hexgrid.EDGE if piece_type == PieceType.road else hexgrid.NODE
+            return transcription.Build(piece_type, _coord(hex_type, args[1]))
+        elif kind == 'dev_card':
+            return transcription.BuyDevCard()
+        elif kind == 'robber':
+            victim = None if args[1] == 'nobody' else args[1]
+            return transcription.MoveRobber(args[0], victim, knight=knight)
+        elif kind == 'road_builder':
+            return transcription.PlayRoadBuilder(_coord(hexgrid.EDGE, args[0]),
+                                                 _coord(hexgrid.EDGE, args[1]))
+        elif kind == 'year_of_plenty':
+            return transcription.PlayYearOfPlenty(Terrain(args[0]), Terrain(args[1]))
+        elif kind == 'monopoly':
+            return transcription.PlayMonopoly(Terrain(args[0]))
+        elif kind == 'victory_point':
+            return transcription.PlayVictoryPoint()
+        elif kind == 'trade':
+            giving, partner_kind, partner, getting = args
+            if partner_kind == 'port':
+                partner = PortType(partner)
+            return transcription.Trade(partner, _resources(giving), _resources(getting))
+        elif kind == 'end_turn':
+            return transcription.EndTurn()
+        return None
+    except (ValueError, transcription.TranscriptionError) as e:
+        raise ReplayError(str(e))
+
+
+def _coord(hex_type, location):
+    tile_id, direction = location
+    if tile_id is None:
+        raise ReplayError('bad location ({} {})'.format(tile_id, direction))
+    return hexgrid.from_location(hex_type, tile_id, direction)
+
+
+def _resources(resources):
+    return [(num, Terrain(value)) for num, value in resources]
+
+
+class Replayer(object):
+    """
+    class Replayer applies the action lines of a log to a game, one at a time.
+
+    In the pregame, building a road ends the turn by itself, so the 'ends turn' line logged
+    after a pregame road has already happened and is skipped.
+
+    :param game: catan.game.Game, as from #new_game
+    """
+    def __init__(self, game):
+        self.game = game
+        self._knight = False
+        self._turn_ended = False
+
+    def apply(self, line):
+        """
+        :param line: an action line of a .catan log
+        :return: kind of the line, see #parse_line
+        """
+        game = self.game
+        kind, color, action = parse_line(line, self._knight)
+        turn_ended, self._turn_ended = self._turn_ended, False
+        self._knight = kind == 'knight'
+        if kind == 'end_turn' and turn_ended:
+            return kind
+        if kind == 'wins':
+            game.end()
+            return kind
+        if action is None:
+            return kind
+        if color != game.get_cur_player().color:
+            raise ReplayError('line "{}" is not for the current player, {}'.format(line.rstrip('\n'), game.get_cur_player()))
+        pregame = game.state.is_in_pregame()
+        try:
+            action.apply(game)
+        except transcription.TranscriptionError as e:
+            raise ReplayError('line "{}": {}'.format(line.rstrip('\n'), e))
+        self._turn_ended = pregame and kind == 'build' and action.piece_type == PieceType.road
+        return kind
+
+
+def replay(lines):
+    """
+    :param lines: the lines of a .catan log
+    :return: generator of (game, line, kind), one per action line, with the game just after the line
+    """
+    lines = list(lines)
+    header, start = read_header(lines)
+    replayer = Replayer(new_game(header))
+    for line in lines[start:]:
+        if line.strip():
+            kind = replayer.apply(line)
+            yield replayer.game, line.rstrip('\n'), kind
+
+
+def replay_file(path):
+    """
+    :param path: path to a .catan log
+    :return: see #replay
+    """
+    with open(path) as fp:
+        lines = fp.readlines()
+    return replay(lines)
+
+
+class _NoUndoManager(object):
+    """
+    Runs commands without taking the copy of the game which undo needs.
+    """
+    def do(self, command):
+        return command.do_method(command.obj, *command.args)
+
+    def can_undo(self):
+        return False
+
+    def can_redo(self):
+        return False
@@ -0,0 +1,398 @@
+"""
+module replication provides primary/standby replication of a game between two spectators
+
+A game is its log: replaying the log (see module replay) gives back the game. So the primary
+streams its log to standbys over TCP as it grows, and each standby replays the lines onto a
+game of its own, which nothing draws, ready to take over if the primary's laptop dies.
+
+The primary (Primary, a consumer of eventqueue.EventPublisher) sends
+- {"type": "lines", "start": n, "lines": [...]}: complete lines appended to the log, the first
+  of which is line n (from 0)
+- {"type": "snapshot", "log": "..."}: the whole log, when it changed other than by appending
+  (undo, or a new game), and to catch up a standby which connects
+
+Every SNAPSHOT_EVERY lines, the primary takes the log so far as its snapshot. A standby which
+connects says how many lines it has and a digest of them; if those are the primary's first
+lines it's sent the lines after them, otherwise the latest snapshot and the lines since.
+
+The standby (Replica) applies lines as they come, and reconnects when the connection drops.
+A snapshot which extends what it has is applied as lines; any other is replayed from scratch.
+promote() stops replicating and returns the game, which from then on logs to file like any
+other. Turn durations ('ends turn after Ns') in the standby's log are its own.
+
+Messages are JSON, one per line. Both sides can be run headless from the command line:
+    $ python3 replication.py primary 7000 log/2016-01-01T12-00-00-a-b-c-d.catan --delay 0.5
+    $ python3 replication.py standby localhost:7000 --out standby.catan
+"""
+import argparse
+import collections
+import hashlib
+import json
+import logging
+import socket
+import sys
+import threading
+import time
+
+import logstream
+import replay
+
+SNAPSHOT_EVERY = 50  # lines
+RECONNECT_DELAY = 1.0  # seconds
+HELLO_TIMEOUT = 5.0  # seconds
+
+
+class ReplicationError(Exception):
+    pass
+
+
+ReplicaStatus = collections.namedtuple('ReplicaStatus', ['connected', 'lines', 'turn', 'error'])
+ReplicaStatus.__doc__ = """
+connected: bool
+lines: complete lines of the primary's log applied, int
+turn: turn number of the replicated game, int, or None before a game starts
+error: the last error, str, or None
+"""
+
+
+def parse_address(address):
+    """
+    :param address: 'host:port', or 'port' for localhost
+    :return: (host, port)
+    """
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+def _digest(lines):
+    return hashlib.sha1('\n'.join(lines).encode('utf-8')).hexdigest()
+
+
+def _complete_lines(text):
+    """
+    :return: list of the complete lines of the text, without their newlines
+    """
+    return text[:text.rfind('\n') + 1].split('\n')[:-1]
+
+
+def _send(sock, message):
+    sock.sendall((json.dumps(message) + '\n').encode('utf-8'))
+
+
+class Primary(object):
+    """
+    class Primary serves the game's log to standbys. Subscribe it to an eventqueue.EventPublisher;
+    each event carries the whole log, so it can use DROP_OLDEST and lose nothing.
+
+    :param port: TCP port to listen on, int
+    :param host: interface to listen on, default all
+    """
+    def __init__(self, port, host=''):
+        self._lock = threading.Lock()
+        self._standbys = list()  # sockets
+        self._lines = list()  # complete lines of the log, as last sent
+        self._snapshot = 0  # number of lines in the snapshot
+        self._listener = socket.create_server((host, port), reuse_port=False)
+        self.address = self._listener.getsockname()
+        self._accepting = threading.Thread(target=self._accept, name='replication-accept', daemon=True)
+        self._accepting.start()
+        logging.info('replication: serving on {}'.format(self.address))
+
+    def on_event(self, event):
+        lines = _complete_lines(event.log)
+        with self._lock:
+            old = self._lines
+            if len(lines) >= len(old) and lines[:2] == old[:2] and lines[len(old) - 1:len(old)] == old[-1:]:
+                # appended: the log is only ever appended to or replaced, so like module logindex, compare
+                # the header's first lines (a new game changes the timestamp) and the last line sent
+                if len(lines) == len(old):
+                    return
+                message = {'type': 'lines', 'start': len(old), 'lines': lines[len(old):]}
+            else:
+                self._snapshot = len(lines)
+                message = {'type': 'snapshot', 'log': ''.join(line + '\n' for line in lines)}
+            self._lines = lines
+            if len(lines) - self._snapshot >= SNAPSHOT_EVERY:
+                self._snapshot = len(lines)
+            self._broadcast(message)
+
+    def close(self):
+        self._listener.close()
+        with self._lock:
+            for sock in self._standbys:
+                sock.close()
+            self._standbys = list()
+
+    def standbys(self):
+        with self._lock:
+            return len(self._standbys)
+
+    def _broadcast(self, message):
+        for sock in list(self._standbys):
+            try:
+                _send(sock, message)
+            except OSError as e:
+                logging.warning('replication: dropped standby {}: {}'.format(self._peer(sock), e))
+                self._standbys.remove(sock)
+                sock.close()
+
+    def _accept(self):
+        while True:
+            try:
+                sock, peer = self._listener.accept()
+            except OSError:
+                return  # closed
+            try:
+                sock.settimeout(HELLO_TIMEOUT)
+                hello = json.loads(sock.makefile('r', encoding='utf-8').readline())
+                sock.settimeout(None)
+                with self._lock:
+                    self._catch_up(sock, hello)
+                    self._standbys.append(sock)
+                logging.info('replication: standby {} connected, had {} lines'.format(peer, hello.get('lines')))
+            except (OSError, ValueError) as e:
+                logging.warning('replication: standby {} failed to connect: {}'.format(peer, e))
+                sock.close()
+
+    def _catch_up(self, sock, hello):
+        have = hello.get('lines', 0)
+        if self._snapshot <= have <= len(self._lines) and hello.get('digest') == _digest(self._lines[:have]):
+            start = have
+        else:
+            _send(sock, {'type': 'snapshot', 'log': ''.join(line + '\n' for line in self._lines[:self._snapshot])})
+            start = self._snapshot
+        if start < len(self._lines):
+            _send(sock, {'type': 'lines', 'start': start, 'lines': self._lines[start:]})
+
+    def _peer(self, sock):
+        try:
+            return sock.getpeername()
+        except OSError:
+            return None
+
+
+class Replica(object):
+    """
+    class Replica replicates a primary's game on a thread of its own.
+
+    :param address: (host, port) of the primary
+    """
+    def __init__(self, address):
+        self.address = address
+        self.game = None
+        self._lines = list()
+        self._header = 0  # line the current game's header starts on
+        self._replayer = None
+        self._lock = threading.Lock()  # guards everything status() reads
+        self._connected = False
+        self._error = None
+        self._sock = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self.run, name='replication-standby', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def run(self):
+        """
+        Connect, apply what the primary sends, and reconnect when the connection drops, until stopped.
+        """
+        while not self._stop.is_set():
+            try:
+                sock = socket.create_connection(self.address)
+            except OSError as e:
+                self._set_error('connecting to {}: {}'.format(self.address, e))
+                self._stop.wait(RECONNECT_DELAY)
+                continue
+            self._sock = sock
+            try:
+                _send(sock, {'type': 'hello', 'lines': len(self._lines), 'digest': _digest(self._lines)})
+                with self._lock:
+                    self._connected = True
+                for message in sock.makefile('r', encoding='utf-8'):
+                    self._receive(json.loads(message))
+                if not self._stop.is_set():
+                    self._set_error('primary closed the connection')
+            except (OSError, ValueError, ReplicationError, replay.ReplayError) as e:
+                if not self._stop.is_set():
+                    self._set_error(str(e))
+            finally:
+                sock.close()
+                with self._lock:
+                    self._connected = False
+            self._stop.wait(RECONNECT_DELAY)
+
+    def status(self):
+        """
+        :return: ReplicaStatus
+        """
+        with self._lock:
+            turn = self.game._cur_turn if self.game is not None else None
+            return ReplicaStatus(self._connected, len(self._lines), turn, self._error)
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._sock is not None:
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+
+    def promote(self):
+        """
+        Stop replicating, and hand over the game.
+
+        :return: catan.game.Game as of the last line applied, logging to file from now on, or
+        None if the primary hadn't started a game
+        """
+        self.stop()
+        game = self.game
+        if game is not None:
+            # the log was kept in memory while replicating; write it out, and keep writing
+            game.catanlog._auto_flush = True
+            game.catanlog.flush()
+        logging.info('replication: promoted at {} lines'.format(len(self._lines)))
+        return game
+
+    def log(self):
+        """
+        :return: the primary's log, as far as it was applied
+        """
+        with self._lock:
+            return ''.join(line + '\n' for line in self._lines)
+
+    def _receive(self, message):
+        with self._lock:
+            if message['type'] == 'lines':
+                if message['start'] != len(self._lines):
+                    raise ReplicationError('expected lines from {}, got lines from {}'.format(
+                        len(self._lines), message['start']))
+                for line in message['lines']:
+                    self._append(line)
+            elif message['type'] == 'snapshot':
+                lines = _complete_lines(message['log'])
+                if lines[:len(self._lines)] == self._lines:
+                    for line in lines[len(self._lines):]:
+                        self._append(line)
+                else:
+                    self._rebuild(lines)
+            self._error = None
+
+    def _rebuild(self, lines):
+        logging.info('replication: replaying {} lines from a snapshot'.format(len(lines)))
+        self.game = None
+        self._replayer = None
+        self._lines = list()
+        self._header = 0
+        for line in lines:
+            self._append(line)
+
+    def _append(self, line):
+        """
+        Apply a line, and only then count it as replicated. A line which can't be applied drops
+        the game and the lines, so the next hello asks for a snapshot rather than resuming after it.
+        """
+        try:
+            if line.startswith('catanlog v'):
+                self.game = None
+                self._replayer = None
+                self._header = len(self._lines)
+            elif self._replayer is None:
+                if line == logstream.START:
+                    header, _ = replay.read_header(self._lines[self._header:] + [line])
+                    self.game = replay.new_game(header)
+                    self._replayer = replay.Replayer(self.game)
+            elif line.strip():
+                self._replayer.apply(line)
+        except replay.ReplayError:
+            self.game = None
+            self._replayer = None
+            self._lines = list()
+            self._header = 0
+            raise
+        self._lines.append(line)
+
+    def _set_error(self, error):
+        logging.warning('replication: {}'.format(error))
+        with self._lock:
+            self._error = error
+
+
+def serve_log(port, path, delay):
+    """
+    Replay a log at the given pace and serve it as a primary, for trying out a standby.
+    """
+    import eventqueue
+    with open(path) as fp:
+        lines = fp.readlines()
+    header, start = replay.read_header(lines)
+    game = replay.new_game(header)
+    events = eventqueue.EventPublisher(game)
+    primary = Primary(port)
+    events.subscribe(primary, name='replication')
+    game.notify_observers()
+    replayer = replay.Replayer(game)
+    print('serving {} on port {}'.format(path, primary.address[1]), flush=True)
+    for line in lines[start:]:
+        if line.strip():
+            time.sleep(delay)
+            replayer.apply(line)
+    print('replayed {} lines, serving until interrupted'.format(len(lines)), flush=True)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        events.close()
+
+
+def run_standby(address, out, seconds):
+    replica = Replica(parse_address(address))
+    replica.start()
+    deadline = None if seconds is None else time.monotonic() + seconds
+    last = None
+    try:
+        while deadline is None or time.monotonic() < deadline:
+            status = replica.status()
+            if status != last:
+                print('connected={} lines={} turn={} error={}'.format(*status), flush=True)
+                last = status
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        pass
+    replica.stop(timeout=RECONNECT_DELAY)
+    if out is not None:
+        with open(out, 'w') as fp:
+            fp.write(replica.log())
+        print('wrote {} lines to {}'.format(replica.status().lines, out))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='replicate a game between spectators')
+    subparsers = parser.add_subparsers(dest='role')
+    primary = subparsers.add_parser('primary', help='replay a .catan log and serve it to standbys')
+    primary.add_argument('port', type=int)
+    primary.add_argument('log', help='.catan log to replay')
+    primary.add_argument('--delay', type=float, default=0.2, help='seconds between lines, default 0.2')
+    standby = subparsers.add_parser('standby', help='replicate a primary headless, printing its status')
+    standby.add_argument('address', help='host:port of the primary')
+    standby.add_argument('--out', metavar='FILE', help="write the replicated log to FILE on exit")
+    standby.add_argument('--seconds', type=float, help='exit after this many seconds')
+    args = parser.parse_args(argv)
+
+    # module catan warns about every state it has no check for, which would bury the status lines,
+    # and sets up logging on import
+    logging.basicConfig(format='%(asctime)s %(levelname)s:%(module)s:%(message)s', level=logging.ERROR, force=True)
+    if args.role == 'primary':
+        serve_log(args.port, args.log, args.delay)
+    elif args.role == 'standby':
+        run_standby(args.address, args.out, args.seconds)
+    else:
+        parser.print_help()
+        return 2
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
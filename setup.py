@@ -21,6 +21,9 @@ setup(name="catan-spectator",
       entry_points={
           'gui_scripts': [
               'catan-spectator = main:main'
+          ],
+          'console_scripts': [
+              'catan-archive = archive:main'
           ]
       },
       py_modules=[
@@ -28,11 +31,38 @@ setup(name="catan-spectator",
           'views',
           'views_trading',
           'tkinterutils',
+          'instrumentation',
+          'transcription',
+          'gridtables',
+          'boardchanges',
+          'production',
+          'longestroad',
+          'simulation',
+          'boardgen',
+          'fairness',
+          'logstream',
+          'logindex',
+          'replay',
+          'mlexport',
+          'archive',
+          'zobrist',
+          'undohistory',
+          'eventqueue',
+          'changeevents',
+          'portindex',
+          'spatialindex',
+          'replication',
+          'logdiff',
+          'loadgen',
+          'inputsession',
+          'spotvalue',
+          'autoplay',
       ],
       install_requires=[
           'catan ~= 0.4',
           'catanlog ~= 0.10',
           'hexgrid ~= 0.2',
           'undoredo ~= 0.1',
+          'numpy',
       ],
       )
\ No newline at end of file
@@ -0,0 +1,362 @@
+"""
+module simulation provides Monte Carlo estimates of each player's chance to win
+
+The spectator only sees the board, not the players' hands, so playouts start every player from
+an empty hand and the buildings on the board, and play them out with a simple greedy policy:
+- roll the dice, and everyone collects from their settlements and cities (the robber's tile pays nothing)
+- on a 7, everyone with more than 7 cards discards half
+- on their turn, a player builds a city if they can, else a settlement (with its road), else
+  buys a development card, which is worth a victory point a quarter of the time; if they can
+  build nothing, they trade 4:1 with the bank towards what they're saving for
+- the first player to 10 victory points wins
+
+Playouts are vectorized with numpy: every playout in a batch takes the same turn at once, as
+arrays of (playout, player, ...). A new settlement produces like a random free node on the board,
+and a city upgrade doubles the production of an average one of the player's settlements.
+
+WinProbabilityEstimator snapshots the game on every notify, and runs batches of playouts in a
+process pool. Estimates are available as soon as the first batch is back, and tighten as batches
+arrive. A snapshot taken by a new notify cancels the batches of the previous one. Given a
+zobrist.ZobristIndex, results are cached by position hash, so returning to a position (undo, or a
+notify which changed nothing on the board) picks its playouts back up instead of starting over.
+"""
+import collections
+import concurrent.futures
+import logging
+import multiprocessing
+
+import numpy
+
+import changeevents
+import gridtables
+from catan.board import Terrain
+from catan.pieces import PieceType
+
+RESOURCES = [Terrain.wood, Terrain.brick, Terrain.wheat, Terrain.sheep, Terrain.ore]
+ROLLS = list(range(2, 13))
+
+WINNING_POINTS = 10
+MAX_TURNS = 400
+
+# costs, in RESOURCES order
+COST_CITY = numpy.array([0, 0, 2, 0, 3], dtype=float)
+COST_SETTLEMENT = numpy.array([2, 2, 1, 1, 0], dtype=float)  # a settlement and the road to it
+COST_DEV_CARD = numpy.array([0, 0, 1, 1, 1], dtype=float)
+DEV_CARD_POINT_CHANCE = 0.25
+
+MAX_SETTLEMENTS = 5
+MAX_CITIES = 4
+
+CACHE_SIZE = 256  # positions whose results WinProbabilityEstimator keeps
+# whatever the snapshot depends on: the board, the log (rolls, trades, dev cards), the phase and the player
+_POSITION_EVENTS = changeevents.BOARD_EVENTS + (changeevents.LogChanged, changeevents.StateChanged,
+                                                changeevents.PlayerChanged)
+
+Snapshot = collections.namedtuple('Snapshot', ['players', 'cur', 'production', 'settlement_production',
+                                               'settlements', 'cities', 'points', 'free_nodes'])
+Snapshot.__doc__ = """
+players: list of player colors, in turn order
+cur: index of the player whose turn it is
+production: array (player, roll, resource), cards paid out to each player on each roll
+settlement_production: array (player, roll, resource), the part of production from settlements
+settlements, cities, points: arrays (player,)
+free_nodes: array (node, roll, resource), what each node a settlement could still go on would produce
+"""
+
+Estimate = collections.namedtuple('Estimate', ['player', 'probability', 'half_width'])
+Estimate.__doc__ = """
+player: catan.game.Player
+probability: estimated chance to win, float
+half_width: half the width of the 95% confidence interval around probability, float
+"""
+
+
+def snapshot(game, longest_road=None):
+    """
+    :param game: catan.game.Game, in game
+    :param longest_road: longestroad.LongestRoadIndex, for the 2 points of longest road, optional
+    :return: Snapshot of the game, picklable
+    """
+    players = list(game.players)
+    seats = dict((player, i) for i, player in enumerate(players))
+
+    tile_production = dict()  # tile_id -> (roll index, resource index)
+    for tile in game.board.tiles:
+        if tile.terrain in RESOURCES and tile.number.value is not None and tile.tile_id != game.robber_tile:
+            tile_production[tile.tile_id] = (ROLLS.index(tile.number.value), RESOURCES.index(tile.terrain))
+
+    def node_production(node):
+        production = numpy.zeros((len(ROLLS), len(RESOURCES)))
+        for tile_id in gridtables.NODE_TILES[node]:
+            if tile_id in tile_production:
+                production[tile_production[tile_id]] += 1
+        return production
+
+    production = numpy.zeros((len(players), len(ROLLS), len(RESOURCES)))
+    settlement_production = numpy.zeros_like(production)
+    settlements = numpy.zeros(len(players))
+    cities = numpy.zeros(len(players))
+    occupied = set()
+    for (_, coord), piece in game.board.pieces.items():
+        if piece.type not in (PieceType.settlement, PieceType.city) or piece.owner not in seats:
+            continue
+        seat = seats[piece.owner]
+        occupied.add(coord)
+        if piece.type == PieceType.settlement:
+            settlements[seat] += 1
+            settlement_production[seat] += node_production(coord)
+            production[seat] += node_production(coord)
+        else:
+            cities[seat] += 1
+            production[seat] += 2 * node_production(coord)
+
+    points = settlements + 2 * cities
+    if longest_road is not None and longest_road.holder() in seats:
+        points[seats[longest_road.holder()]] += 2
+
+    blocked = set(occupied)
+    for node in occupied:
+        blocked.update(gridtables.NODE_NEIGHBOURS[node])
+    free = [node_production(node) for node in gridtables.NODES if node not in blocked]
+    free_nodes = numpy.array(free) if free else numpy.zeros((1, len(ROLLS), len(RESOURCES)))
+
+    return Snapshot(players=[player.color for player in players],
+                    cur=players.index(game.get_cur_player()),
+                    production=production,
+                    settlement_production=settlement_production,
+                    settlements=settlements,
+                    cities=cities,
+                    points=points,
+                    free_nodes=free_nodes)
+
+
+def playout_batch(snap, n, seed):
+    """
+    Play n games out from the snapshot.
+
+    :param snap: Snapshot
+    :param n: number of playouts, int
+    :param seed: random seed, int
+    :return: array (player,) of the number of playouts each player won
+    """
+    rng = numpy.random.default_rng(seed)
+    num_players = len(snap.players)
+    rows = numpy.arange(n)
+
+    production = numpy.repeat(snap.production[numpy.newaxis], n, axis=0)
+    settlement_production = numpy.repeat(snap.settlement_production[numpy.newaxis], n, axis=0)
+    settlements = numpy.repeat(snap.settlements[numpy.newaxis], n, axis=0)
+    cities = numpy.repeat(snap.cities[numpy.newaxis], n, axis=0)
+    points = numpy.repeat(snap.points[numpy.newaxis], n, axis=0)
+    hands = numpy.zeros((n, num_players, len(RESOURCES)))
+    winners = numpy.full(n, -1)
+
+    for turn in range(MAX_TURNS):
+        playing = winners < 0
+        if not playing.any():
+            break
+        seat = (snap.cur + turn) % num_players
+
+        rolls = rng.integers(1, 7, size=(n, 2)).sum(axis=1)
+        hands += production[rows, :, rolls - 2, :]
+        robbed = (rolls == 7)[:, numpy.newaxis] & (hands.sum(axis=2) > 7)
+        hands[robbed] = numpy.floor(hands[robbed] / 2)
+
+        hand = hands[:, seat, :]  # a view, so spending from hand spends from hands
+        for _ in range(2):
+            city = playing & (settlements[:, seat] > 0) & (cities[:, seat] < MAX_CITIES) & (hand >= COST_CITY).all(axis=1)
+            if city.any():
+                upgraded = settlement_production[city, seat] / settlements[city, seat, numpy.newaxis, numpy.newaxis]
+                production[city, seat] += upgraded
+                settlement_production[city, seat] -= upgraded
+                settlements[city, seat] -= 1
+                cities[city, seat] += 1
+                points[city, seat] += 1
+                hand[city] -= COST_CITY
+
+            settle = playing & ~city & (settlements[:, seat] < MAX_SETTLEMENTS) & (hand >= COST_SETTLEMENT).all(axis=1)
+            if settle.any():
+                nodes = snap.free_nodes[rng.integers(0, len(snap.free_nodes), size=settle.sum())]
+                production[settle, seat] += nodes
+                settlement_production[settle, seat] += nodes
+                settlements[settle, seat] += 1
+                points[settle, seat] += 1
+                hand[settle] -= COST_SETTLEMENT
+
+            dev = playing & ~city & ~settle & (hand >= COST_DEV_CARD).all(axis=1)
+            if dev.any():
+                hand[dev] -= COST_DEV_CARD
+                points[dev, seat] += rng.random(dev.sum()) < DEV_CARD_POINT_CHANCE
+
+        saving_for = numpy.where((settlements[:, seat] > 0)[:, numpy.newaxis], COST_CITY, COST_SETTLEMENT)
+        surplus = hand.argmax(axis=1)
+        needed = (saving_for - hand).argmax(axis=1)
+        trade = playing & (hand[rows, surplus] >= 4) & (surplus != needed)
+        hand[trade, surplus[trade]] -= 4
+        hand[trade, needed[trade]] += 1
+
+        won = playing & (points[:, seat] >= WINNING_POINTS)
+        winners[won] = seat
+
+    unfinished = winners < 0
+    if unfinished.any():
+        # the most points wins, ties broken at random
+        tiebreak = rng.random((n, num_players)) * 0.5
+        winners[unfinished] = (points + tiebreak)[unfinished].argmax(axis=1)
+    return numpy.bincount(winners, minlength=num_players)
+
+
+class WinProbabilityEstimator(object):
+    """
+    class WinProbabilityEstimator keeps an anytime estimate of each player's chance to win.
+
+    It observes the game (or, given the views' changeevents.ChangePublisher, subscribes to its
+    events, so the indexes it reads are up to date), and on each change snapshots the game and
+    restarts the playouts. The owner calls #poll periodically (e.g. from a Tk after() loop) to collect finished batches and
+    top up the pool, and reads #estimates. Call #shutdown when done with it.
+
+    :param game: catan.game.Game
+    :param longest_road: longestroad.LongestRoadIndex, optional
+    :param batch_size: playouts per job, int
+    :param max_playouts: playouts per snapshot before stopping, int
+    :param workers: number of worker processes, default the number of cpus
+    :param zobrist: zobrist.ZobristIndex, to cache results by position, optional
+    :param changes: changeevents.ChangePublisher the indexes are kept up to date by, optional
+    """
+    def __init__(self, game, longest_road=None, batch_size=200, max_playouts=20000, workers=None, zobrist=None,
+                 changes=None):
+        self.game = game
+        self.changes = changes
+        self.longest_road = longest_road
+        self.batch_size = batch_size
+        self.max_playouts = max_playouts
+        self.workers = workers or multiprocessing.cpu_count()
+        self.zobrist = zobrist
+
+        self.generation = 0
+        self._executor = None
+        self._snapshot = None
+        self._players = list()
+        self._pending = set()
+        self._submitted = 0
+        self._wins = None
+        self._playouts = 0
+        self._seed = 0
+        self._position = None
+        self._cache = collections.OrderedDict()  # position hash -> (wins, playouts), most recent last
+
+        if changes is None:
+            self.game.observers.add(self)
+        else:
+            changes.subscribe(self.on_changes, *_POSITION_EVENTS)
+        self.restart()
+
+    def notify(self, observable):
+        self.restart()
+
+    def on_changes(self, events):
+        self.restart()
+
+    def restart(self):
+        """
+        Cancel the playouts of the previous snapshot, and start on a new one if the game is on.
+        """
+        position = self.zobrist.position_hash() if self.zobrist is not None else None
+        if position is not None and position == self._position and self._snapshot is not None:
+            return
+        self._cache_results()
+        self._position = position
+        self.generation += 1
+        for future in self._pending:
+            future.cancel()
+        self._pending = set()
+        self._submitted = 0
+        self._playouts = 0
+        if not self.game.state.is_in_game() or not self.game.players:
+            self._snapshot = None
+            self._players = list()
+            self._wins = None
+            return
+        self._snapshot = snapshot(self.game, self.longest_road)
+        self._players = list(self.game.players)
+        self._wins = numpy.zeros(len(self._players))
+        if position in self._cache:
+            wins, playouts = self._cache.pop(position)
+            self._wins += wins
+            self._playouts = self._submitted = playouts
+            logging.debug('simulation: resumed {} cached playouts'.format(playouts))
+        self._submit()
+
+    def _cache_results(self):
+        if self._position is None or not self._playouts:
+            return
+        self._cache[self._position] = (self._wins.copy(), self._playouts)
+        self._cache.move_to_end(self._position)
+        while len(self._cache) > CACHE_SIZE:
+            self._cache.popitem(last=False)
+
+    def poll(self):
+        """
+        Collect finished batches of the current snapshot, and submit more if under max_playouts.
+
+        :return: True if the estimates changed
+        """
+        changed = False
+        for future in [f for f in self._pending if f.done()]:
+            self._pending.discard(future)
+            if future.cancelled():
+                continue
+            generation, wins = future.result()
+            if generation != self.generation:
+                continue
+            self._wins += wins
+            self._playouts += int(wins.sum())
+            changed = True
+        if self._snapshot is not None:
+            self._submit()
+        return changed
+
+    def estimates(self):
+        """
+        :return: list of Estimate, one per player in turn order, empty if no playouts are back yet
+        """
+        if not self._playouts:
+            return list()
+        n = self._playouts
+        estimates = list()
+        for player, wins in zip(self._players, self._wins):
+            p = wins / n
+            half_width = 1.96 * numpy.sqrt(max(p * (1 - p), 1.0 / n) / n)
+            estimates.append(Estimate(player, float(p), float(half_width)))
+        return estimates
+
+    @property
+    def playouts(self):
+        return self._playouts
+
+    def shutdown(self):
+        self.game.observers.discard(self)
+        if self.changes is not None:
+            self.changes.unsubscribe(self.on_changes)
+        for future in self._pending:
+            future.cancel()
+        self._pending = set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def _submit(self):
+        if self._executor is None:
+            # spawn, not fork: a forked Tk process is not safe to use
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            logging.debug('simulation: started {} workers'.format(self.workers))
+        while len(self._pending) < 2 * self.workers and self._submitted < self.max_playouts:
+            self._seed += 1
+            self._pending.add(self._executor.submit(_run_batch, self.generation, self._snapshot,
+                                                    self.batch_size, self._seed))
+            self._submitted += self.batch_size
+
+
+def _run_batch(generation, snap, n, seed):
+    return generation, playout_batch(snap, n, seed)
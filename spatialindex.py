@@ -0,0 +1,73 @@
+"""
+module spatialindex provides lookup of the points near a position, for hit testing on the board canvas
+
+SpatialIndex buckets points into a grid of square cells. A query for the points within a radius
+looks only at the cells the circle overlaps, so with cells about the size of the radius it looks
+at a handful of points however many there are.
+"""
+import collections
+import math
+
+
+class SpatialIndex(object):
+    """
+    class SpatialIndex indexes keyed points by position.
+
+    :param cell: size of a cell, in the points' units, eg pixels
+    """
+    def __init__(self, cell):
+        self.cell = cell
+        self._cells = collections.defaultdict(list)  # (column, row) -> keys
+        self._points = dict()  # key -> (x, y)
+
+    def __len__(self):
+        return len(self._points)
+
+    def __contains__(self, key):
+        return key in self._points
+
+    def add(self, key, x, y):
+        """
+        :param key: hashable, eg (PieceType, coord)
+        :param x: float
+        :param y: float
+        """
+        if key in self._points:
+            self.remove(key)
+        self._points[key] = (x, y)
+        self._cells[self._cell_of(x, y)].append(key)
+
+    def remove(self, key):
+        x, y = self._points.pop(key)
+        self._cells[self._cell_of(x, y)].remove(key)
+
+    def position(self, key):
+        return self._points[key]
+
+    def near(self, x, y, radius):
+        """
+        :return: list of the keys within radius of (x, y), nearest first
+        """
+        (c0, r0), (c1, r1) = self._cell_of(x - radius, y - radius), self._cell_of(x + radius, y + radius)
+        found = list()
+        for column in range(c0, c1 + 1):
+            for row in range(r0, r1 + 1):
+                for key in self._cells.get((column, row), ()):
+                    distance = self._distance(key, x, y)
+                    if distance <= radius:
+                        found.append((distance, key))
+        found.sort(key=lambda pair: pair[0])
+        return [key for _, key in found]
+
+    def nearest(self, x, y):
+        """
+        :return: list of all the keys, nearest to (x, y) first
+        """
+        return sorted(self._points, key=lambda key: self._distance(key, x, y))
+
+    def _distance(self, key, x, y):
+        px, py = self._points[key]
+        return math.hypot(px - x, py - y)
+
+    def _cell_of(self, x, y):
+        return int(math.floor(x / self.cell)), int(math.floor(y / self.cell))
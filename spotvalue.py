@@ -0,0 +1,121 @@
+"""
+module spotvalue provides an incrementally maintained heatmap of how good each node is for a settlement
+
+SpotValueIndex observes the game and keeps, for every node:
+- pips: the pips (ways out of 36 to roll) of the numbers on the tiles around it
+- diversity: how many different resources the tiles around it produce
+- value: pips + DIVERSITY_WEIGHT * diversity, and the color of its step on HEAT_COLORS
+- whether a settlement can go there under the distance rule: nothing on it or next to it
+
+The values are computed in one vectorized pass over all the nodes, from the tiles' numbers and
+terrain and the node -> tile incidence matrix of module fairness, and kept until a tile is edited.
+Placing or removing a settlement or city only changes whether its node and the nodes next to it
+are legal.
+
+The index doesn't diff the board itself: it's handed the PiecePlaced, PieceRemoved and
+BoardEdited events the views get from the changeevents.ChangePublisher, which include undo.
+
+Colors are on a fixed scale, so a node keeps its color as the nodes around it fill up.
+"""
+import numpy
+from catan.pieces import PieceType
+
+import changeevents
+import fairness
+import gridtables
+
+DIVERSITY_WEIGHT = 1.0  # a resource the player doesn't get from the node's other tiles is worth a pip
+MAX_VALUE = 17.0  # about the best a node gets: 6, 8 and 5 of three different resources
+HEAT_COLORS = ['#313695', '#4575b4', '#74add1', '#abd9e9', '#fee090', '#fdae61', '#f46d43', '#d73027']
+
+_buildings = (PieceType.settlement, PieceType.city)
+
+_PIPS = numpy.zeros(13)
+for _number, _pips in gridtables.PIPS.items():
+    _PIPS[_number] = _pips
+
+_COLORS = numpy.array(HEAT_COLORS)
+
+
+class SpotValueIndex(object):
+    """
+    class SpotValueIndex answers where a settlement can go, and how good a spot each one is.
+
+    Use #legal_nodes for the nodes a settlement can go on, with their heat colors, and #value for
+    a node's value.
+
+    The index is kept up to date with #on_changes. version is incremented whenever it changes.
+
+    :param game: catan.game.Game, whose board to start from
+    """
+    def __init__(self, game):
+        self.game = game
+        self.version = 0
+
+        self._pips = numpy.zeros(fairness.NUM_NODES)
+        self._diversity = numpy.zeros(fairness.NUM_NODES, dtype=int)
+        self._colors = [HEAT_COLORS[0]] * fairness.NUM_NODES
+        self._occupied = set(coord for (_, coord), piece in game.board.pieces.items()
+                             if piece.type in _buildings)  # nodes with a settlement or city
+        self._legal = dict()  # node -> heat color, for the nodes a settlement can go on
+        self._recompute()
+
+    def on_changes(self, events):
+        """
+        :param events: list of changeevents, those which aren't about the board are ignored
+        """
+        touched = set()
+        edited = False
+        for event in events:
+            if isinstance(event, (changeevents.PiecePlaced, changeevents.PieceRemoved)) and event.type in _buildings:
+                if isinstance(event, changeevents.PiecePlaced):
+                    self._occupied.add(event.coord)
+                else:
+                    self._occupied.discard(event.coord)
+                touched.add(event.coord)
+            elif isinstance(event, changeevents.BoardEdited):
+                edited = True
+        if edited:
+            self._recompute()
+        elif touched:
+            # the distance rule: a building only changes whether its node and the nodes next to it are legal
+            self._update_legal(touched.union(*(gridtables.NODE_NEIGHBOURS[node] for node in touched)))
+            self.version += 1
+
+    def legal_nodes(self):
+        """
+        :return: dict of node coordinate -> heat color, for the nodes a settlement can go on
+        """
+        return self._legal
+
+    def value(self, node):
+        """
+        :param node: node coordinate, int
+        :return: (pips, diversity) of the node, (float, int)
+        """
+        i = fairness.NODE_INDEX[node]
+        return self._pips[i], int(self._diversity[i])
+
+    def _recompute(self):
+        self._compute_values()
+        self._legal = dict()
+        self._update_legal(gridtables.NODES)
+        self.version += 1
+
+    def _compute_values(self):
+        tiles = sorted(self.game.board.tiles, key=lambda tile: tile.tile_id)
+        numbers = numpy.array([tile.number.value or 0 for tile in tiles])
+        terrain = numpy.array([[tile.terrain == resource for resource in fairness.RESOURCES] for tile in tiles],
+                              dtype=float)
+        self._pips = fairness.NODE_TILE.dot(_PIPS[numbers])
+        self._diversity = (fairness.NODE_TILE.dot(terrain) > 0).sum(axis=1)
+        values = self._pips + DIVERSITY_WEIGHT * self._diversity
+        steps = numpy.clip((values * len(HEAT_COLORS) / MAX_VALUE).astype(int), 0, len(HEAT_COLORS) - 1)
+        self._colors = _COLORS[steps].tolist()
+
+    def _update_legal(self, nodes):
+        for node in nodes:
+            if node in self._occupied or any(n in self._occupied for n in gridtables.NODE_NEIGHBOURS[node]):
+                self._legal.pop(node, None)
+            else:
+                self._legal[node] = self._colors[fairness.NODE_INDEX[node]]
@@ -4,6 +4,7 @@ module tkinterutils provides methods useful in tkinter graphics programming
 Currently, it provides
 - polygon methods: rotation, point generation
 - tkinter.OptionMenu option update
+- widget bindtag helpers
 """
 import math
 import tkinter
@@ -95,11 +96,54 @@ def circle_bbox(radius, center):
             [x+radius, y+radius]]
 
 
-def refresh_option_menu(option_menu, var, new_options):
-    """http://stackoverflow.com/a/17581364/1817465"""
-    option_menu['menu'].delete(0, 'end')
+def refresh_option_menu(option_menu, var, new_options, command=None):
+    """
+    http://stackoverflow.com/a/17581364/1817465
+
+    Entries the menu already has, up to the first which differs, are kept rather than deleted and
+    added again, so refreshing a menu with the options it has does nothing. They keep the var and
+    command they were added with.
+    """
+    menu = option_menu['menu']
+    last = menu.index('end')
+    keep = 0
+    if last is not None:
+        for choice in new_options:
+            if keep > last or menu.entrycget(keep, 'label') != choice:
+                break
+            keep += 1
+        if keep <= last:
+            menu.delete(keep, 'end')
+
+    # Insert list of new options (tk._setit hooks them up to var, and calls command with the choice)
+    for choice in new_options[keep:]:
+        menu.add_command(label=choice, command=tkinter._setit(var, choice, command))
+
+
+
+def exclude_from_bind_all(widget):
+    """
+    Remove the 'all' bindtag from a widget, so that application-wide shortcuts registered with
+    bind_all do not fire while the widget has focus (eg typing 'r' into an Entry).
+    """
+    widget.bindtags(tuple(tag for tag in widget.bindtags() if tag != 'all'))
 
-    # Insert list of new options (tk._setit hooks them up to var)
-    for choice in new_options:
-        option_menu['menu'].add_command(label=choice, command=tkinter._setit(var, choice))
 
+def prepend_bindtag(widget, tag):
+    """
+    Put a bindtag first on a widget and all its descendants, so that the tag's bindings see every
+    event the widgets get before any of their own bindings can stop it. Widgets which already
+    have the tag are left as they are.
+
+    :return: number of widgets tagged
+    """
+    tagged = 0
+    widgets = [widget]
+    while widgets:
+        widget = widgets.pop()
+        tags = widget.bindtags()
+        if tag not in tags:
+            widget.bindtags((tag,) + tuple(tags))
+            tagged += 1
+        widgets.extend(widget.winfo_children())
+    return tagged
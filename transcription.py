@@ -0,0 +1,443 @@
+"""
+module transcription provides a compact text syntax for transcribing a whole turn at once
+
+A turn script is a semicolon-separated list of commands, eg
+
+    8; r 0x47; s 0x56; t blue 1w>1o; e
+
+Commands:
+- 2..12                       roll
+- r <edge>                    build a road (buys it first unless already placing one)
+- s <node>                    build a settlement
+- c <node>                    build a city
+- d                           buy a dev card
+- m <tile> [victim]           move the robber after a 7, steal from victim (color)
+- k <tile> [victim]           play a knight, move the robber, steal from victim (color)
+- rb <edge> <edge>            play road builder
+- mono <resource>             play monopoly
+- yop <resource> <resource>   play year of plenty
+- vp                          play victory point
+- t <color|port> <give>><get> trade, eg 't blue 1w>1o', 't 3:1 3w>1o', 't wood 2w>1h'
+- e                           end turn
+
+Coordinates are hexgrid coordinates (0x47) or locations (1NW). Resources are the board
+short forms: w(ood) b(rick) h (wheat) s(heep) o(re).
+
+The whole script is validated against a detached copy of the game first, then applied to the
+game as a single undoable command, which notifies observers once.
+"""
+import copy
+import re
+
+import catanlog
+import hexgrid
+import undoredo
+from catan import states
+from catan.board import Port, PortType, Terrain
+from catan.game import Player
+from catan.pieces import PieceType
+from catan.trading import CatanTrade
+
+
+class TranscriptionError(ValueError):
+    """
+    Raised when a turn script can't be parsed, or can't be applied in the current game state.
+    """
+    pass
+
+
+def transcribe(game, script):
+    """
+    Parse a turn script, validate it against the game, and apply it as one undoable command.
+
+    :param game: catan.game.Game
+    :param script: turn script, str
+    :return: list of the applied actions
+    """
+    actions = parse(script)
+    validate(game, actions)
+    game.do(undoredo.Command(game, _apply_actions, actions))
+    return actions
+
+
+def parse(script):
+    """
+    :param script: turn script, str
+    :return: list of actions, each having apply(game)
+    """
+    actions = list()
+    for i, command in enumerate(c.strip() for c in script.split(';')):
+        if not command:
+            continue
+        try:
+            actions.append(_parse_command(command))
+        except TranscriptionError as e:
+            raise TranscriptionError('command {} "{}": {}'.format(i + 1, command, e))
+    if not actions:
+        raise TranscriptionError('empty turn script')
+    return actions
+
+
+def validate(game, actions):
+    """
+    Apply the actions to a detached copy of the game. Raises TranscriptionError naming the first
+    action which is illegal at that point in the script. The game itself is not modified.
+
+    :param game: catan.game.Game
+    :param actions: list of actions from #parse
+    """
+    _apply_actions(_detached_copy(game), actions)
+
+
+def _apply_actions(game, actions):
+    """
+    Apply the actions in order with the game's observers and undo history muted, so that the
+    caller's single Command is the only undo step and the caller's notify is the only repaint.
+    """
+    observers, undo_manager = game.observers, game.undo_manager
+    game.observers, game.undo_manager = set(), undoredo.UndoManager()
+    try:
+        for i, action in enumerate(actions):
+            try:
+                action.apply(game)
+            except TranscriptionError as e:
+                raise TranscriptionError('command {} ({}): {}'.format(i + 1, action, e))
+    finally:
+        game.observers, game.undo_manager = observers, undo_manager
+
+
+def _detached_copy(game):
+    """
+    Game.copy() shares the state object and the board's observers with the original game, and
+    deep copies the catanlog (which writes to disk). Detach all of them.
+
+    GameState answers every unknown attribute (including __deepcopy__) from __getattr__, so the
+    state is copied field by field rather than with copy.deepcopy.
+    """
+    scratch = game.copy()
+    scratch.observers = set()
+    scratch.undo_manager = undoredo.UndoManager()
+    scratch.catanlog = catanlog.NoopCatanLog()
+    scratch.state = copy.copy(game.state)
+    for name, value in vars(game.state).items():
+        setattr(scratch.state, name, copy.copy(value))
+    scratch.state.game = scratch
+    scratch.board.observers = {scratch}
+    return scratch
+
+
+class Roll(object):
+    def __init__(self, roll):
+        self.roll = roll
+
+    def apply(self, game):
+        if not game.state.can_roll():
+            raise TranscriptionError('cannot roll now')
+        game.roll(self.roll)
+
+    def __repr__(self):
+        return 'roll {}'.format(self.roll)
+
+
+class Build(object):
+    def __init__(self, piece_type, coord):
+        self.piece_type = piece_type
+        self.coord = coord
+
+    def apply(self, game):
+        placing, buying, place = {
+            PieceType.road: (game.state.can_place_road, game.state.can_buy_road, game.place_road),
+            PieceType.settlement: (game.state.can_place_settlement, game.state.can_buy_settlement, game.place_settlement),
+            PieceType.city: (game.state.can_place_city, game.state.can_buy_city, game.place_city),
+        }[self.piece_type]
+        if not placing() and not buying():
+            raise TranscriptionError('cannot build a {} now'.format(self.piece_type.value))
+        self._check_coord(game)
+        if not placing():
+            game.begin_placing(self.piece_type)
+        place(self.coord)
+
+    def _check_coord(self, game):
+        if self.piece_type == PieceType.road:
+            if self.coord not in hexgrid.legal_edge_coords():
+                raise TranscriptionError('{} is not an edge on the board'.format(hex(self.coord)))
+            if (hexgrid.EDGE, self.coord) in game.board.pieces:
+                raise TranscriptionError('{} already has a road'.format(hex(self.coord)))
+            return
+        if self.coord not in hexgrid.legal_node_coords():
+            raise TranscriptionError('{} is not a node on the board'.format(hex(self.coord)))
+        existing = game.board.pieces.get((hexgrid.NODE, self.coord))
+        if self.piece_type == PieceType.settlement and existing is not None:
+            raise TranscriptionError('{} is already built on'.format(hex(self.coord)))
+        if self.piece_type == PieceType.city and (existing is None
+                                                  or existing.type != PieceType.settlement
+                                                  or existing.owner != game.get_cur_player()):
+            raise TranscriptionError('{} is not a settlement of {}'.format(hex(self.coord), game.get_cur_player()))
+
+    def __repr__(self):
+        return '{} {}'.format(self.piece_type.value, hex(self.coord))
+
+
+class BuyDevCard(object):
+    def apply(self, game):
+        if not game.state.can_buy_dev_card():
+            raise TranscriptionError('cannot buy a dev card now')
+        game.buy_dev_card()
+
+    def __repr__(self):
+        return 'dev card'
+
+
+class MoveRobber(object):
+    def __init__(self, tile_id, victim_color, knight=False):
+        self.tile_id = tile_id
+        self.victim_color = victim_color
+        self.knight = knight
+
+    def apply(self, game):
+        if self.knight and not game.state.can_play_knight():
+            raise TranscriptionError('cannot play a knight now')
+        if not self.knight and not game.state.can_move_robber():
+            raise TranscriptionError('cannot move the robber now')
+        if self.tile_id not in hexgrid.legal_tile_ids():
+            raise TranscriptionError('{} is not a tile on the board'.format(self.tile_id))
+        if self.tile_id == game.robber_tile:
+            raise TranscriptionError('the robber is already on {}'.format(self.tile_id))
+        if self.knight:
+            game.play_knight()
+        game.move_robber(self.tile_id)
+        stealable = game.stealable_players()
+        victim = None
+        if self.victim_color is not None:
+            victim = _player_with_color(game, self.victim_color)
+            if victim not in stealable:
+                raise TranscriptionError('cannot steal from {} at tile {}'.format(self.victim_color, self.tile_id))
+        elif stealable:
+            raise TranscriptionError('must name a victim, one of {}'.format(
+                ', '.join(sorted(p.color for p in stealable))))
+        game.steal(victim)
+
+    def __repr__(self):
+        return '{} {} {}'.format('knight' if self.knight else 'robber', self.tile_id, self.victim_color)
+
+
+class PlayRoadBuilder(object):
+    def __init__(self, edge1, edge2):
+        self.edges = (edge1, edge2)
+
+    def apply(self, game):
+        if not game.state.can_play_road_builder():
+            raise TranscriptionError('cannot play road builder now')
+        for edge in self.edges:
+            if edge not in hexgrid.legal_edge_coords() or (hexgrid.EDGE, edge) in game.board.pieces:
+                raise TranscriptionError('cannot build a road at {}'.format(hex(edge)))
+        if self.edges[0] == self.edges[1]:
+            raise TranscriptionError('road builder roads must be on different edges')
+        game.set_state(states.GameStatePlacingRoadBuilderPieces(game))
+        for edge in self.edges:
+            game.place_road(edge)
+
+    def __repr__(self):
+        return 'road builder {} {}'.format(*(hex(e) for e in self.edges))
+
+
+class PlayMonopoly(object):
+    def __init__(self, resource):
+        self.resource = resource
+
+    def apply(self, game):
+        if not game.state.can_play_monopoly():
+            raise TranscriptionError('cannot play monopoly now')
+        game.play_monopoly(self.resource)
+
+    def __repr__(self):
+        return 'monopoly {}'.format(self.resource.value)
+
+
+class PlayYearOfPlenty(object):
+    def __init__(self, resource1, resource2):
+        self.resources = (resource1, resource2)
+
+    def apply(self, game):
+        if not game.state.can_play_year_of_plenty():
+            raise TranscriptionError('cannot play year of plenty now')
+        game.play_year_of_plenty(*self.resources)
+
+    def __repr__(self):
+        return 'year of plenty {} {}'.format(*(r.value for r in self.resources))
+
+
+class PlayVictoryPoint(object):
+    def apply(self, game):
+        if not game.state.can_play_victory_point():
+            raise TranscriptionError('cannot play victory point now')
+        game.play_victory_point()
+
+    def __repr__(self):
+        return 'victory point'
+
+
+class Trade(object):
+    def __init__(self, partner, giving, getting):
+        """
+        :param partner: player color, str, or PortType
+        :param giving: list of (num, Terrain)
+        :param getting: list of (num, Terrain)
+        """
+        self.partner = partner
+        self.giving = giving
+        self.getting = getting
+
+    def apply(self, game):
+        if not game.state.can_trade():
+            raise TranscriptionError('cannot trade now')
+        trade = CatanTrade(giver=game.get_cur_player())
+        if isinstance(self.partner, PortType):
+            self._check_port(game)
+            trade.set_getter(Port(1, 'OO', self.partner))
+        else:
+            other = _player_with_color(game, self.partner)
+            if other == game.get_cur_player():
+                raise TranscriptionError('cannot trade with yourself')
+            trade.set_getter(other)
+        for num, terrain in self.giving:
+            trade.give(terrain, num=num)
+        for num, terrain in self.getting:
+            trade.get(terrain, num=num)
+        game.trade(trade)
+
+    def _check_port(self, game):
+        if self.partner != PortType.any4 and not game.cur_player_has_port_type(self.partner):
+            raise TranscriptionError('{} does not have a {} port'.format(game.get_cur_player(), self.partner.value))
+        if self.partner == PortType.any4:
+            ratio = 4
+        elif self.partner == PortType.any3:
+            ratio = 3
+        else:
+            ratio = 2
+            if any(terrain.value != self.partner.value for _, terrain in self.giving):
+                raise TranscriptionError('a {} port only takes {}'.format(self.partner.value, self.partner.value))
+        num_giving = sum(num for num, _ in self.giving)
+        num_getting = sum(num for num, _ in self.getting)
+        if num_giving != ratio * num_getting:
+            raise TranscriptionError('a {} port trade gives {} per card, not {} for {}'.format(
+                self.partner.value, ratio, num_giving, num_getting))
+
+    def __repr__(self):
+        return 'trade {} {} for {}'.format(getattr(self.partner, 'value', self.partner), self.giving, self.getting)
+
+
+class EndTurn(object):
+    def apply(self, game):
+        if not game.state.can_end_turn():
+            raise TranscriptionError('cannot end turn now')
+        game.end_turn()
+
+    def __repr__(self):
+        return 'end turn'
+
+
+_ROLLS = [str(n) for n in range(2, 13)]
+_LOCATION = re.compile(r'^\(?(\d{1,2})\s*([NSEW]{1,2})\)?$', re.IGNORECASE)
+_RESOURCES = re.compile(r'(\d+)\s*([wbhso])')
+
+
+def _parse_command(command):
+    verb, *args = command.split()
+    verb = verb.lower()
+    if verb in _ROLLS and not args:
+        return Roll(int(verb))
+    elif verb in ('r', 's', 'c'):
+        piece_type = {'r': PieceType.road, 's': PieceType.settlement, 'c': PieceType.city}[verb]
+        _expect_args(args, 1)
+        hex_type = hexgrid.EDGE if piece_type == PieceType.road else hexgrid.NODE
+        return Build(piece_type, _parse_coord(hex_type, args[0]))
+    elif verb == 'd':
+        _expect_args(args, 0)
+        return BuyDevCard()
+    elif verb in ('m', 'k'):
+        if len(args) not in (1, 2):
+            raise TranscriptionError('expected a tile and an optional victim')
+        victim = args[1].lower() if len(args) == 2 else None
+        return MoveRobber(_parse_int(args[0]), victim, knight=(verb == 'k'))
+    elif verb == 'rb':
+        _expect_args(args, 2)
+        return PlayRoadBuilder(_parse_coord(hexgrid.EDGE, args[0]), _parse_coord(hexgrid.EDGE, args[1]))
+    elif verb == 'mono':
+        _expect_args(args, 1)
+        return PlayMonopoly(_parse_resource(args[0]))
+    elif verb == 'yop':
+        _expect_args(args, 2)
+        return PlayYearOfPlenty(_parse_resource(args[0]), _parse_resource(args[1]))
+    elif verb == 'vp':
+        _expect_args(args, 0)
+        return PlayVictoryPoint()
+    elif verb == 't':
+        _expect_args(args, 2)
+        giving, _, getting = args[1].partition('>')
+        return Trade(_parse_partner(args[0]), _parse_resources(giving), _parse_resources(getting))
+    elif verb == 'e':
+        _expect_args(args, 0)
+        return EndTurn()
+    raise TranscriptionError('unknown command')
+
+
+def _expect_args(args, num):
+    if len(args) != num:
+        raise TranscriptionError('expected {} argument(s), got {}'.format(num, len(args)))
+
+
+def _parse_int(token):
+    try:
+        return int(token, 0)
+    except ValueError:
+        raise TranscriptionError('expected a number, got "{}"'.format(token))
+
+
+def _parse_coord(hex_type, token):
+    match = _LOCATION.match(token)
+    if match:
+        try:
+            return hexgrid.from_location(hex_type, int(match.group(1)), match.group(2).upper())
+        except ValueError as e:
+            raise TranscriptionError(str(e))
+    return _parse_int(token)
+
+
+def _parse_resource(token):
+    try:
+        return Terrain(token.lower())
+    except ValueError:
+        pass
+    try:
+        terrain = Terrain.from_short_form(token.lower())
+    except ValueError:
+        raise TranscriptionError('unknown resource "{}"'.format(token))
+    if terrain == Terrain.desert:
+        raise TranscriptionError('desert is not a resource')
+    return terrain
+
+
+def _parse_resources(token):
+    """'2w1b' -> [(2, Terrain.wood), (1, Terrain.brick)]"""
+    token = token.lower().replace(',', '')
+    resources = [(int(num), Terrain.from_short_form(char)) for num, char in _RESOURCES.findall(token)]
+    if not resources or _RESOURCES.sub('', token).strip():
+        raise TranscriptionError('expected resources like 1w or 2w1b, got "{}"'.format(token))
+    return resources
+
+
+def _parse_partner(token):
+    for port_type in PortType.list_trading():
+        if token.lower() == port_type.value:
+            return port_type
+    if token == '2:1':
+        raise TranscriptionError('name the 2:1 port by its resource, eg "wood"')
+    return token.lower()
+
+
+def _player_with_color(game, color):
+    for player in game.players:
+        if player.color == color:
+            return Player(player.seat, player.name, player.color)
+    raise TranscriptionError('no player with color "{}"'.format(color))
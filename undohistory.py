@@ -0,0 +1,290 @@
+"""
+module undohistory provides an undo manager which keeps a bounded amount of undo history in memory
+
+Every undoable command keeps a restore point, a full copy of the game from before the command was
+done (see undoredo.Command), so unlimited undo keeps a copy of the game per action for the whole
+session.
+
+UndoHistory keeps the restore points of the latest `depth` commands in memory. Older restore
+points are compacted and spilled to a file, and undo past the in-memory horizon reloads them
+from it, so it looks the same to the caller as undoredo.UndoManager.
+
+Restore points are compacted by pickling them and compressing the pickle. Consecutive restore
+points differ by one action, so each is compressed using the previous one as a dictionary, which
+makes it a few hundred bytes. Every `keyframe_every` restore points, one is compressed on its
+own, so reloading one decompresses at most that many.
+
+Spilled commands keep their method and arguments, but not their restore point, so they can be
+redone as usual once undone. A restore point which can't be pickled stays in memory.
+
+NoHistory is an undo manager for a game which is only watched, eg played back by module autoplay,
+which keeps no history at all.
+"""
+import enum
+import gc
+import io
+import logging
+import pickle
+import sys
+import tempfile
+import types
+import zlib
+
+import catan.game
+import catan.states
+import catanlog
+import undoredo
+from instrumentation import sizes
+
+DEFAULT_DEPTH = 100
+DEFAULT_KEYFRAME_EVERY = 20
+MEASURE_EVERY = 100  # actions
+MEASURE_SAMPLE = 4  # restore points
+
+
+class UndoHistory(undoredo.UndoManager):
+    """
+    class UndoHistory is an undoredo.UndoManager which spills old restore points to a file.
+
+    :param depth: number of commands to keep restore points for in memory, int
+    :param keyframe_every: compress every n-th spilled restore point on its own, int
+    :param path: file to spill restore points to, or None for an anonymous temporary file
+    """
+    def __init__(self, depth=DEFAULT_DEPTH, keyframe_every=DEFAULT_KEYFRAME_EVERY, path=None):
+        super(UndoHistory, self).__init__()
+        self.depth = depth
+        self.keyframe_every = keyframe_every
+        self._file = open(path, 'w+b') if path is not None else tempfile.TemporaryFile()
+        self._spilled = list()  # spilled commands, oldest first, without restore points
+        self._records = list()  # (offset, length) in the file of each spilled restore point
+        self._end = 0
+        self._last_pickle = None  # pickle of the newest spilled restore point
+        self._actions = 0
+        self._spill_error = None  # why the last spill failed, until one succeeds
+
+    def do(self, command):
+        result = super(UndoHistory, self).do(command)
+        self._trim()
+        self._actions += 1
+        if self._actions % MEASURE_EVERY == 0:
+            self.measure()
+        return result
+
+    def can_undo(self):
+        return len(self._undo_stack) > 0 or len(self._spilled) > 0
+
+    def undo(self):
+        if self._undo_stack or not self._spilled:
+            result = super(UndoHistory, self).undo()
+            _repoint_dev_cards(self._redo_stack[-1].obj)
+            return result
+        command = self._spilled.pop()
+        command.restore_point = self._load(command.obj, len(self._spilled))
+        self._drop_record()
+        self._redo_stack.append(command)
+        result = command.undo()
+        _repoint_dev_cards(command.obj)
+        command.restore_point = None  # redo takes a new one
+        logging.debug('{}.undo() reloaded from spill file, {} spilled'.format(type(command), len(self._spilled)))
+        return result
+
+    def redo(self):
+        result = super(UndoHistory, self).redo()
+        self._trim()
+        return result
+
+    def close(self):
+        self._file.close()
+
+    def measure(self):
+        """
+        Record the memory used by undo history under 'undo.' in instrumentation.sizes: the
+        restore points in memory, the spill file, and both together per 100 actions of history.
+        """
+        in_memory = self._in_memory_size()
+        actions = len(self._undo_stack) + len(self._spilled)
+        sizes.record('undo.in_memory', in_memory)
+        sizes.record('undo.spilled', self._end)
+        sizes.record('undo.per_100_actions', (in_memory + self._end) * 100 // max(1, actions))
+        logging.info('Undo history memory ({} in memory, {} spilled):\n{}'.format(
+            len(self._undo_stack), len(self._spilled), sizes.report('undo.')))
+
+    def _trim(self):
+        while len(self._undo_stack) > self.depth:
+            try:
+                self._spill(self._undo_stack[0])
+            except (pickle.PicklingError, TypeError, AttributeError) as e:
+                # keep it in memory rather than lose it, and try again after the next action
+                if self._spill_error is None:
+                    logging.warning('undohistory: could not spill a restore point, keeping it in memory: {}'.format(e))
+                self._spill_error = e
+                return
+            self._undo_stack.pop(0)
+            self._spill_error = None
+
+    def _spill(self, command):
+        index = len(self._spilled)
+        data = _dumps(command.obj, self, command.restore_point)
+        if index % self.keyframe_every == 0:
+            record = zlib.compress(data)
+        else:
+            if self._last_pickle is None:
+                self._last_pickle = self._pickle(index - 1)
+            compressor = zlib.compressobj(zdict=self._last_pickle)
+            record = compressor.compress(data) + compressor.flush()
+        self._file.seek(self._end)
+        self._file.write(record)
+        self._records.append((self._end, len(record)))
+        self._end += len(record)
+        self._last_pickle = data
+        command.restore_point = None
+        self._spilled.append(command)
+
+    def _pickle(self, index):
+        """
+        :return: the pickle of the index-th spilled restore point, decompressed from the keyframe before it
+        """
+        keyframe = index - index % self.keyframe_every
+        data = zlib.decompress(self._read(keyframe))
+        for i in range(keyframe + 1, index + 1):
+            data = zlib.decompressobj(zdict=data).decompress(self._read(i))
+        return data
+
+    def _read(self, index):
+        offset, length = self._records[index]
+        self._file.seek(offset)
+        return self._file.read(length)
+
+    def _load(self, game, index):
+        return _Unpickler(io.BytesIO(self._pickle(index)), game, self).load()
+
+    def _drop_record(self):
+        """
+        Drop the newest spilled restore point. Records are only ever dropped from the end, so the
+        file is truncated rather than left with holes.
+        """
+        self._end, _ = self._records.pop()
+        self._file.truncate(self._end)
+        self._last_pickle = None
+
+    def _in_memory_size(self):
+        """
+        Estimated from a few of the restore points, since each is a separate copy of the game, and
+        walking them all would stall the UI for as long as it takes to undo a few of them.
+        """
+        commands = [c for c in self._undo_stack + self._redo_stack if c.restore_point is not None]
+        if not commands:
+            return 0
+        sample = commands[::max(1, len(commands) // MEASURE_SAMPLE)]
+        total = 0
+        for command in sample:
+            restore_point = command.restore_point
+            # the game and its undo manager are live, and observers are views; none of them are history
+            exclude = [command.obj, self, restore_point.observers, restore_point.board.observers]
+            total += _deep_size([restore_point], exclude)
+        return total * len(commands) // len(sample)
+
+
+class NoHistory(undoredo.UndoManager):
+    """
+    class NoHistory is an undoredo.UndoManager which keeps no history, for a game which is only
+    watched: commands are run without the copy of the game which undo needs, as in module replay,
+    and there is never anything to undo.
+    """
+    def do(self, command):
+        return command.do_method(command.obj, *command.args)
+
+    def close(self):
+        pass
+
+
+def _repoint_dev_cards(game):
+    """
+    Game.restore takes the restore point's dev card state, which still points back at the
+    restore point's game, a copy which isn't history. Point it at the live game, as
+    CatanSpectator.load_game does.
+    """
+    game.dev_card_state.game = game
+
+
+def _dumps(game, undo_manager, restore_point):
+    f = io.BytesIO()
+    _Pickler(f, game, undo_manager, restore_point).dump(restore_point)
+    return f.getvalue()
+
+
+def _set_dict(obj, state):
+    obj.__dict__.update(state)
+
+
+class _Pickler(pickle.Pickler):
+    """
+    Pickles a restore point. The live game, its undo manager and the views observing the game are
+    pickled by reference, and loaded as whatever they are when the restore point is reloaded. Any
+    other game the restore point refers to, eg an older copy a dev card state still points back
+    at, is pickled as the live game, so its observers aren't followed into the views.
+    """
+    def __init__(self, f, game, undo_manager, restore_point):
+        super(_Pickler, self).__init__(f, protocol=pickle.HIGHEST_PROTOCOL)
+        self.game = game
+        self.undo_manager = undo_manager
+        self.restore_point = restore_point
+
+    def persistent_id(self, obj):
+        if obj is self.game or (isinstance(obj, catan.game.Game) and obj is not self.restore_point):
+            return 'game'
+        if obj is self.undo_manager:
+            return 'undo_manager'
+        if obj is self.restore_point.observers:
+            return 'observers'
+        if obj is self.restore_point.board.observers:
+            return 'board_observers'
+        return None
+
+    def reducer_override(self, obj):
+        # these answer every attribute from __getattr__, __setstate__ included
+        if isinstance(obj, (catan.states.GameState, catanlog.NoopCatanLog)):
+            return object.__new__, (type(obj),), dict(vars(obj)), None, None, _set_dict
+        return NotImplemented
+
+
+class _Unpickler(pickle.Unpickler):
+    def __init__(self, f, game, undo_manager):
+        super(_Unpickler, self).__init__(f)
+        self.game = game
+        self.undo_manager = undo_manager
+
+    def persistent_load(self, pid):
+        if pid == 'game':
+            return self.game
+        if pid == 'undo_manager':
+            return self.undo_manager
+        if pid == 'observers':
+            return self.game.observers
+        if pid == 'board_observers':
+            return self.game.board.observers
+        raise pickle.UnpicklingError('unknown persistent id {}'.format(pid))
+
+
+def _deep_size(objects, exclude, boundary=catan.game.Game):
+    """
+    :param objects: objects to measure
+    :param exclude: objects to leave out, along with everything only reachable through them
+    :param boundary: type whose instances are left out, except the objects being measured, eg
+    the game a dev card state points back to
+    :return: total size in bytes of the objects and everything they refer to, counting shared objects once
+    """
+    seen = set(id(obj) for obj in exclude)
+    roots = set(id(obj) for obj in objects)
+    total = 0
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType, enum.Enum)):
+            continue
+        if isinstance(obj, boundary) and id(obj) not in roots:
+            continue
+        seen.add(id(obj))
+        total += sys.getsizeof(obj)
+        stack.extend(gc.get_referents(obj))
+    return total
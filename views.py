@@ -1,6 +1,6 @@
+import bisect
 import logging
 import tkinter
-from tkinter import messagebox
 import math
 import collections
 import functools
@@ -10,8 +10,11 @@ from catan import states
 from catan.board import PortType, HexNumber, Terrain
 from catan.game import Player
 from catan.pieces import PieceType, Piece
+from instrumentation import timings
+import changeevents
+import gridtables
+import spatialindex
 import tkinterutils
-import views_trading
 
 can_do = {
     True: tkinter.NORMAL,
@@ -24,40 +27,201 @@ LOG_MAX_HEIGHT = 13
 LOG_MIN_HEIGHT = 1
 CANVAS_WIDTH = 600
 CANVAS_HEIGHT = 550
+GHOST_MOTION_INTERVAL_MS = 50
+GHOST_OVERLAY_CACHE = 8
+SPOT_HEATMAP_RADIUS = 13
 
 
 class LogFrame(tkinter.Frame):
+    """
+    class LogFrame shows the game log, virtualized: the text widget only ever holds the lines in
+    view, paged in from a logindex.LogIndex as the view scrolls. Updating costs the same however
+    long the game runs.
 
-    def __init__(self, master, game, *args, **kwargs):
+    The view follows the end of the log until scrolled up, and follows it again once scrolled
+    back down. Jump to a turn with the turn box, and show one player's lines with the player menu.
+    """
+    ALL_PLAYERS = 'all'
+
+    def __init__(self, master, game, events, *args, **kwargs):
         super(LogFrame, self).__init__()
         self.master = master
         self.game = game
-        self.game.observers.add(self)
-
-        self.log = tkinter.Text(self, width=85, height=LOG_MIN_HEIGHT, state=tkinter.NORMAL)
+        events.subscribe(self.on_changes, changeevents.LogChanged)
+
+        import logindex
+        self.index = logindex.LogIndex(game)
+        self._top = 0  # position in the view of the first line shown
+        self._follow = True
+        self._colors = list()
+
+        controls = tkinter.Frame(self)
+        self.turn = tkinter.StringVar()
+        turn_box = tkinter.Spinbox(controls, from_=0, to=9999, width=5, textvariable=self.turn,
+                                   command=self.on_jump_to_turn)
+        tkinterutils.exclude_from_bind_all(turn_box)
+        turn_box.bind('<Return>', self.on_jump_to_turn)
+        self.player = tkinter.StringVar(value=self.ALL_PLAYERS)
+        self.player_picker = tkinter.OptionMenu(controls, self.player, self.ALL_PLAYERS,
+                                                command=self.on_filter)
+        tkinter.Label(controls, text='Turn').pack(side=tkinter.LEFT)
+        turn_box.pack(side=tkinter.LEFT)
+        tkinter.Label(controls, text='Player').pack(side=tkinter.LEFT)
+        self.player_picker.pack(side=tkinter.LEFT)
+
+        self.log = tkinter.Text(self, width=LOG_WIDTH, height=LOG_MIN_HEIGHT, wrap=tkinter.NONE, state=tkinter.NORMAL)
+        self.scrollbar = tkinter.Scrollbar(self, command=self.on_scroll)
         self.log.insert(tkinter.END, '{} {}'.format(catanlog.__name__, catanlog.__version__))
-        self.log.see(tkinter.END)
+        for sequence in ('<MouseWheel>', '<Button-4>', '<Button-5>'):
+            self.log.bind(sequence, self.on_wheel)
+
+        controls.pack(side=tkinter.TOP, fill=tkinter.X)
+        self.scrollbar.pack(side=tkinter.RIGHT, fill=tkinter.Y)
         self.log.pack(expand=tkinter.YES, fill=tkinter.BOTH)
 
-    def notify(self, observable):
+    def on_changes(self, events):
         self.redraw()
 
     def redraw(self):
+        if self.index.sync():
+            if self.index.colors() != self._colors:
+                self._colors = self.index.colors()
+                tkinterutils.refresh_option_menu(self.player_picker, self.player, [self.ALL_PLAYERS] + self._colors,
+                                                 command=self.on_filter)
+        self.render()
+
+    def render(self):
+        """
+        Show the lines of the view from self._top, or the last lines if following.
+        """
+        total = self._view_len()
+        if not total:
+            return
+        height = max(LOG_MIN_HEIGHT, min(LOG_MAX_HEIGHT, total))
+        if self._follow:
+            self._top = total - height
+        self._top = max(0, min(self._top, total - height))
+        lines = self.index.lines(self._view_lines(self._top, self._top + height))
+
         self.log.delete(1.0, tkinter.END)
-        logs = self.game.catanlog.dump()
-        self.log.configure(height=max(LOG_MIN_HEIGHT,min(LOG_MAX_HEIGHT,len(logs))))
-        self.log.insert(tkinter.END, logs)
+        self.log.configure(height=height)
+        self.log.insert(tkinter.END, '\n'.join(lines))
+        self.scrollbar.set(self._top / total, (self._top + height) / total)
+        logging.debug('Rendered log lines {}-{} of {}'.format(self._top, self._top + len(lines), total))
+
+    def on_scroll(self, action, amount, unit=None):
+        total = self._view_len()
+        height = int(self.log.cget('height'))
+        if action == tkinter.MOVETO:
+            self._top = int(float(amount) * total)
+        elif unit == tkinter.PAGES:
+            self._top += int(amount) * height
+        else:
+            self._top += int(amount)
+        self._follow = self._top + height >= total
+        self.render()
 
-        logging.debug('Redrew latest={} lines of game log'.format(len(logs.split('\n'))))
-        self.log.see(tkinter.END) # scroll to end
+    def on_wheel(self, event):
+        if event.num == 4 or getattr(event, 'delta', 0) > 0:
+            self.on_scroll(tkinter.SCROLL, -3, tkinter.UNITS)
+        else:
+            self.on_scroll(tkinter.SCROLL, 3, tkinter.UNITS)
+        return 'break'
+
+    def on_jump_to_turn(self, event=None):
+        try:
+            turn = int(self.turn.get())
+        except ValueError:
+            return
+        line = self.index.turn_line(turn)
+        if self.player.get() == self.ALL_PLAYERS:
+            self._top = line
+        else:
+            self._top = bisect.bisect_left(self.index.player_lines(self.player.get()), line)
+        self._follow = False
+        self.render()
 
+    def on_filter(self, color=None):
+        self._follow = True
+        self.render()
+
+    def _view_len(self):
+        if self.player.get() == self.ALL_PLAYERS:
+            return len(self.index)
+        return len(self.index.player_lines(self.player.get()))
+
+    def _view_lines(self, start, stop):
+        if self.player.get() == self.ALL_PLAYERS:
+            return range(start, min(stop, len(self.index)))
+        return self.index.player_lines(self.player.get())[start:stop]
+
+
+class CommandFrame(tkinter.Frame):
+    """
+    class CommandFrame is a command bar for transcribing a whole turn as one line of text.
+
+    The script is applied as a single undoable transaction, see module transcription.
+    """
 
-class BoardFrame(tkinter.Frame):
     def __init__(self, master, game, *args, **kwargs):
+        super(CommandFrame, self).__init__()
+        self.master = master
+        self.game = game
+
+        self.label = tkinter.Label(self, text='Command', anchor=tkinter.W)
+        self.script = tkinter.StringVar()
+        self.entry = tkinter.Entry(self, textvariable=self.script, width=LOG_WIDTH - 20)
+        self.status = tkinter.Label(self, text='', anchor=tkinter.W, fg='red')
+
+        # typing a script must not trigger the toolbar's single-key shortcuts
+        tkinterutils.exclude_from_bind_all(self.entry)
+        self.entry.bind('<Return>', self.on_submit)
+        self.entry.bind('<Escape>', lambda e: self.script.set(''))
+
+        self.label.grid(row=0, column=0, sticky=tkinter.W)
+        self.entry.grid(row=0, column=1, sticky=tkinter.EW)
+        self.status.grid(row=1, column=0, columnspan=2, sticky=tkinter.W)
+        self.columnconfigure(1, weight=1)
+
+    def on_submit(self, event=None):
+        import transcription
+        script = self.script.get()
+        if not script.strip():
+            return
+        try:
+            actions = transcription.transcribe(self.game, script)
+        except transcription.TranscriptionError as e:
+            logging.info('Rejected turn script="{}": {}'.format(script, e))
+            self.status.configure(text=str(e))
+            return
+        logging.debug('Applied turn script="{}" as actions={}'.format(script, actions))
+        self.status.configure(text='')
+        self.script.set('')
+
+
+class BoardFrame(tkinter.Frame):
+    """
+    class BoardFrame draws the board. Pieces are drawn and deleted one at a time as they change;
+    the board is only redrawn whole when the tiles, the ports, or the shadows of the pieces which
+    can be placed change.
+
+    With a ghost_radius, shadows are drawn at a level of detail, see GhostLayer.
+
+    While settlements are placed during pregame, each node a settlement can go on is drawn as a
+    spot colored by how good it is, see module spotvalue; the 'Spot heatmap' setup option turns
+    this off.
+    """
+    def __init__(self, master, game, longest_road, ports, events, ghost_radius=None, *args, **kwargs):
         super(BoardFrame, self).__init__()
         self.master = master
         self.game = game
-        self.game.observers.add(self)
+        self.longest_road = longest_road
+        self.ports = ports
+        events.subscribe(self.on_changes, changeevents.StateChanged, changeevents.PlayerChanged,
+                         *changeevents.BOARD_EVENTS)
+        self._terrain_centers = None
+        self._drawn_layers = None
+        self._longest_road_drawn = list()
 
         self._board = game.board
 
@@ -66,6 +230,8 @@ class BoardFrame(tkinter.Frame):
 
         self._board_canvas = board_canvas
         self._center_to_edge = math.cos(math.radians(30)) * self._tile_radius
+        self._ghost_layer = GhostLayer(self, ghost_radius) if ghost_radius else None
+        self._spot_values = None
 
     def tile_click(self, event):
         if not self._board.state.modifiable():
@@ -89,14 +255,30 @@ class BoardFrame(tkinter.Frame):
 
         logging.debug('Piece clicked with tag={}'.format(tag))
         if piece_type == PieceType.road:
-            self.game.place_road(self._coord_from_road_tag(tag))
+            self.place_piece(piece_type, self._coord_from_road_tag(tag))
         elif piece_type == PieceType.settlement:
-            self.game.place_settlement(self._coord_from_settlement_tag(tag))
+            self.place_piece(piece_type, self._coord_from_settlement_tag(tag))
         elif piece_type == PieceType.city:
-            self.game.place_city(self._coord_from_city_tag(tag))
+            self.place_piece(piece_type, self._coord_from_city_tag(tag))
         elif piece_type == PieceType.robber:
-            self.game.move_robber(hexgrid.tile_id_from_coord(self._coord_from_robber_tag(tag)))
-        self.redraw()
+            self.place_piece(piece_type, self._coord_from_robber_tag(tag))
+
+    def place_piece(self, piece_type, coord):
+        """
+        Place a piece where its shadow is, as clicking the shadow does. The board is redrawn by
+        on_changes, as the game notifies.
+
+        :param piece_type: PieceType
+        :param coord: hex coordinate of the edge, node or tile
+        """
+        if piece_type == PieceType.road:
+            self.game.place_road(coord)
+        elif piece_type == PieceType.settlement:
+            self.game.place_settlement(coord)
+        elif piece_type == PieceType.city:
+            self.game.place_city(coord)
+        elif piece_type == PieceType.robber:
+            self.game.move_robber(hexgrid.tile_id_from_coord(coord))
 
     def port_click(self, port, event):
         if not self._board.state.modifiable():
@@ -112,8 +294,35 @@ class BoardFrame(tkinter.Frame):
         self._board.cycle_port_type(tile_id, direction)
         # todo add onclick events for invisible ports yet to be clicked on and made into ports
 
-    def notify(self, observable):
-        self.redraw()
+    def on_changes(self, events):
+        if self._spot_values is not None:
+            # before drawing, so the heatmap is drawn as of these changes
+            self._spot_values.on_changes(events)
+        # shadows are drawn in the current player's color wherever a piece can go, so while any are
+        # shown, every piece placed or removed and every change of player moves them
+        redraw = (self._terrain_centers is None or self._layers() != self._drawn_layers or self._has_shadows()
+                  or any(isinstance(event, (changeevents.BoardEdited, changeevents.PortsChanged)) for event in events))
+        if redraw:
+            self.redraw()
+            return
+
+        pieces = [event for event in events if isinstance(event, changeevents.PIECE_EVENTS)]
+        if not pieces:
+            return
+        with timings.measure('board.update'):
+            for event in pieces:
+                if isinstance(event, changeevents.RobberMoved):
+                    if event.old is not None:
+                        self._board_canvas.delete(self._robber_tag(hexgrid.tile_id_to_coord(event.old)))
+                    if event.new is not None:
+                        self._draw_piece(hexgrid.tile_id_to_coord(event.new), Piece(PieceType.robber, None),
+                                         self._terrain_centers)
+                elif isinstance(event, changeevents.PieceRemoved):
+                    self._board_canvas.delete(self._piece_tag(event.type, event.coord))
+                else:
+                    self._draw_piece(event.coord, Piece(event.type, event.owner), self._terrain_centers)
+            if any(isinstance(event, (changeevents.PiecePlaced, changeevents.PieceRemoved)) for event in pieces):
+                self._draw_longest_road()
 
     def draw(self, board):
         """Render the board to the canvas widget.
@@ -128,16 +337,24 @@ class BoardFrame(tkinter.Frame):
         is at 0, 0.
         """
         terrain_centers = self._draw_terrain(board)
+        self._terrain_centers = terrain_centers
+        self._drawn_layers = self._layers()
         self._draw_numbers(board, terrain_centers)
         self._draw_pieces(board, terrain_centers)
+        if self._ghost_layer is not None:
+            self._ghost_layer.begin(terrain_centers)
         if self.game.state.can_place_road():
             self._draw_piece_shadows(PieceType.road, board, terrain_centers)
         if self.game.state.can_place_settlement():
+            if self.game.state.is_in_pregame() and self.master.setup_options().get('spot_heatmap'):
+                self._draw_spot_heatmap(terrain_centers)
             self._draw_piece_shadows(PieceType.settlement, board, terrain_centers)
         if self.game.state.can_place_city():
             self._draw_piece_shadows(PieceType.city, board, terrain_centers)
         if self.game.state.can_move_robber():
             self._draw_piece_shadows(PieceType.robber, board, terrain_centers)
+        if self._ghost_layer is not None:
+            self._ghost_layer.finish()
 
         if self.game.state.is_in_game():
             self._draw_ports(board, terrain_centers)
@@ -145,8 +362,21 @@ class BoardFrame(tkinter.Frame):
             self._draw_port_shadows(board, terrain_centers)
 
     def redraw(self):
-        self._board_canvas.delete(tkinter.ALL)
-        self.draw(self._board)
+        with timings.measure('board.redraw'):
+            self._board_canvas.delete(tkinter.ALL)
+            self._longest_road_drawn = list()
+            self.draw(self._board)
+
+    def _layers(self):
+        """
+        :return: which of the shadows and ports draw() draws, for the current game state
+        """
+        state = self.game.state
+        return (bool(state.can_place_road()), bool(state.can_place_settlement()), bool(state.can_place_city()),
+                bool(state.can_move_robber()), bool(state.is_in_game()))
+
+    def _has_shadows(self):
+        return any(self._drawn_layers[:4])
 
     def _draw_terrain(self, board):
         logging.debug('Drawing terrain (resource tiles)')
@@ -211,8 +441,8 @@ class BoardFrame(tkinter.Frame):
             self._draw_port(x, y, angle, port, ghost=ghost)
 
     def _draw_port_shadows(self, board, terrain_centers):
-        coastal_coords = hexgrid.coastal_coords()
-        ports = list(map(lambda cc: board.get_port_at(*cc), coastal_coords))
+        # board.get_port_at fills an empty slot with a none port, as clicking one would
+        ports = [self.ports.port_at(*slot) or board.get_port_at(*slot) for slot in gridtables.COAST]
         self._draw_ports(board, terrain_centers, ports=ports, ghost=True)
 
 
@@ -247,6 +477,7 @@ class BoardFrame(tkinter.Frame):
         for coord, road in roads:
             self._draw_piece(coord, road, terrain_centers)
         logging.debug('Roads drawn: {}'.format(len(roads)))
+        self._draw_longest_road()
 
         for coord, settlement in settlements:
             self._draw_piece(coord, settlement, terrain_centers)
@@ -257,35 +488,69 @@ class BoardFrame(tkinter.Frame):
         coord, robber = robber
         self._draw_piece(coord, robber, terrain_centers)
 
+    def _draw_longest_road(self):
+        self._board_canvas.delete('longest_road')
+        for coord in self._longest_road_drawn:
+            road = self._board.pieces.get((hexgrid.EDGE, coord))
+            if road is not None:
+                self._board_canvas.itemconfigure(self._road_tag(coord), outline=road.owner.color, width=1)
+        self._longest_road_drawn = list()
+
+        holder = self.longest_road.holder()
+        if holder is not None:
+            for coord in self.longest_road.road(holder):
+                self._board_canvas.itemconfigure(self._road_tag(coord), outline='gold', width=3)
+            self._longest_road_drawn = list(self.longest_road.road(holder))
+
+        lengths = ['{} {}'.format(player.color, self.longest_road.length(player))
+                   for player in self.game.players if self.longest_road.length(player)]
+        if lengths:
+            text = 'Longest road: {}'.format(', '.join(lengths))
+            if holder is not None:
+                text += ' (held by {})'.format(holder.color)
+            self._board_canvas.create_text(10, 10, text=text, anchor=tkinter.NW, fill='white', tags='longest_road')
+
+    def _draw_spot_heatmap(self, terrain_centers):
+        with timings.measure('board.heatmap'):
+            if self._spot_values is None:
+                # pulls in numpy, so not until the first settlement is placed; on_changes keeps it up to date
+                import spotvalue
+                self._spot_values = spotvalue.SpotValueIndex(self.game)
+            piece = Piece(PieceType.settlement, None)
+            radius = SPOT_HEATMAP_RADIUS
+            for node, color in self._spot_values.legal_nodes().items():
+                x, y, _ = self._get_piece_center(node, piece, terrain_centers)
+                # under the shadows, and disabled, so clicks still go to the shadows
+                self._board_canvas.create_oval(x - radius, y - radius, x + radius, y + radius, fill=color,
+                                               outline='', state=tkinter.DISABLED, tags='spot_heatmap')
+
     def _draw_piece_shadows(self, piece_type, board, terrain_centers):
         logging.debug('Drawing piece shadows of type={}'.format(piece_type.value))
         piece = Piece(piece_type, self.game.get_cur_player())
-        if piece_type == PieceType.road:
-            edges = hexgrid.legal_edge_coords()
-            count = 0
-            for edge in edges:
-                if (hexgrid.EDGE, edge) in board.pieces:
-                    logging.debug('Not drawing shadow road at coord={}'.format(edge))
-                    continue
-                count += 1
-                self._draw_piece(edge, piece, terrain_centers, ghost=True)
-            logging.debug('Road shadows drawn: {}'.format(count))
-        elif piece_type == PieceType.settlement:
-            nodes = hexgrid.legal_node_coords()
-            for node in nodes:
-                if (hexgrid.NODE, node) in board.pieces:
-                    continue
-                self._draw_piece(node, piece, terrain_centers, ghost=True)
-        elif piece_type == PieceType.city:
-            for (_, node), p in board.pieces.items():
-                if p.type == PieceType.settlement and p.owner.color == piece.owner.color:
-                    self._draw_piece(node, piece, terrain_centers, ghost=True)
-        elif piece_type == PieceType.robber:
-            for coord in hexgrid.legal_tile_coords():
-                if hexgrid.tile_id_from_coord(coord) != self.game.robber_tile:
-                    self._draw_piece(coord, piece, terrain_centers, ghost=True)
-        else:
-            logging.warning('Attempted to draw piece shadows for nonexistent type={}'.format(piece_type))
+        coords = self._shadow_coords(piece, board)
+        if self._ghost_layer is not None:
+            self._ghost_layer.add(piece, coords)
+            return
+        for coord in coords:
+            self._draw_piece(coord, piece, terrain_centers, ghost=True)
+        logging.debug('Shadows drawn: {}'.format(len(coords)))
+
+    def _shadow_coords(self, piece, board):
+        """
+        :return: list of the coords to draw the piece's shadow at
+        """
+        if piece.type == PieceType.road:
+            return [edge for edge in hexgrid.legal_edge_coords() if (hexgrid.EDGE, edge) not in board.pieces]
+        elif piece.type == PieceType.settlement:
+            return [node for node in hexgrid.legal_node_coords() if (hexgrid.NODE, node) not in board.pieces]
+        elif piece.type == PieceType.city:
+            return [node for (_, node), p in board.pieces.items()
+                    if p.type == PieceType.settlement and p.owner.color == piece.owner.color]
+        elif piece.type == PieceType.robber:
+            return [coord for coord in hexgrid.legal_tile_coords()
+                    if hexgrid.tile_id_from_coord(coord) != self.game.robber_tile]
+        logging.warning('Attempted to draw piece shadows for nonexistent type={}'.format(piece.type))
+        return list()
 
     def _draw_piece(self, coord, piece, terrain_centers, ghost=False):
         x, y, angle = self._get_piece_center(coord, piece, terrain_centers)
@@ -313,19 +578,13 @@ class BoardFrame(tkinter.Frame):
 
     def _piece_tkinter_opts(self, coord, piece, **kwargs):
         opts = dict()
-        tag_funcs = {
-            PieceType.road: self._road_tag,
-            PieceType.settlement: self._settlement_tag,
-            PieceType.city: self._city_tag,
-            PieceType.robber: self._robber_tag,
-        }
         if piece.type == PieceType.robber:
             # robber has no owner
             color = 'black'
         else:
             color = piece.owner.color
 
-        opts['tags'] = tag_funcs[piece.type](coord)
+        opts['tags'] = self._piece_tag(piece.type, coord)
         opts['outline'] = color
         opts['fill'] = color
         if 'ghost' in kwargs and kwargs['ghost'] == True:
@@ -499,6 +758,15 @@ class BoardFrame(tkinter.Frame):
     def _robber_tag(self, coord):
         return 'robber_' + hex(coord)
 
+    def _piece_tag(self, piece_type, coord):
+        tag_funcs = {
+            PieceType.road: self._road_tag,
+            PieceType.settlement: self._settlement_tag,
+            PieceType.city: self._city_tag,
+            PieceType.robber: self._robber_tag,
+        }
+        return tag_funcs[piece_type](coord)
+
     def _port_tag(self, port):
         return 'port_{:02}_{}'.format(port.tile_id, port.direction)
 
@@ -546,6 +814,150 @@ class BoardFrame(tkinter.Frame):
     }
 
 
+class GhostLayer(object):
+    """
+    class GhostLayer draws the shadows of the pieces which can be placed at a level of detail.
+
+    Every legal spot is marked with a dot on one image, which is cached for the spots and color it
+    was drawn for, and only the spots within radius of the pointer are drawn as shadows which can
+    be clicked. Pointer motion is handled at most every GHOST_MOTION_INTERVAL_MS, and only the
+    shadows entering or leaving the radius are drawn or deleted.
+
+    From the keyboard, ] and [ select the next and previous legal spot, nearest the pointer first,
+    and Return places the piece there. Moving the pointer clears the selection.
+
+    :param board_frame: BoardFrame
+    :param radius: pixels, int
+    """
+    def __init__(self, board_frame, radius):
+        self.board_frame = board_frame
+        self.canvas = board_frame._board_canvas
+        self.radius = radius
+        self._terrain_centers = None
+        self._centers = dict()  # (PieceType, coord) -> (x, y), for the drawn terrain centers
+        self._overlays = collections.OrderedDict()  # (color, spots) -> PhotoImage
+        self._pieces = dict()  # PieceType -> Piece drawn as the shadow
+        self._spots = list()  # (PieceType, coord)
+        self._index = None
+        self._drawn = set()
+        self._pointer = None
+        self._pending = None
+        self._cycle = list()
+        self._selected = None
+
+        self.canvas.bind('<Motion>', self.on_motion, add='+')
+        self.canvas.bind('<Leave>', self.on_leave, add='+')
+        board_frame.bind_all(']', lambda e: self.select(+1))
+        board_frame.bind_all('[', lambda e: self.select(-1))
+        board_frame.bind_all('<Return>', self.on_place)
+
+    def begin(self, terrain_centers):
+        """
+        Start over, after the canvas was cleared.
+        """
+        if terrain_centers != self._terrain_centers:
+            self._terrain_centers = terrain_centers
+            self._centers = dict()
+        self._pieces = dict()
+        self._spots = list()
+        self._index = None
+        self._drawn = set()
+        self._cycle = list()
+        self._selected = None
+
+    def add(self, piece, coords):
+        self._pieces[piece.type] = piece
+        self._spots.extend((piece.type, coord) for coord in coords)
+
+    def finish(self):
+        if not self._spots:
+            return
+        self._index = spatialindex.SpatialIndex(self.radius)
+        for spot in self._spots:
+            self._index.add(spot, *self._center(spot))
+        self._draw_overlay()
+        self.update()
+
+    def on_motion(self, event):
+        self._pointer = (self.canvas.canvasx(event.x), self.canvas.canvasy(event.y))
+        self._selected = None
+        if self._pending is None:
+            self._pending = self.canvas.after(GHOST_MOTION_INTERVAL_MS, self._on_motion_idle)
+
+    def on_leave(self, event):
+        self._pointer = None
+        self.update()
+
+    def select(self, step):
+        if self._index is None:
+            return
+        if self._selected is None:
+            x, y = self._pointer or (CANVAS_WIDTH / 2, CANVAS_HEIGHT / 2)
+            self._cycle = self._index.nearest(x, y)
+            self._selected = 0 if step > 0 else len(self._cycle) - 1
+        else:
+            self._selected = (self._selected + step) % len(self._cycle)
+        logging.debug('ghost selected={}'.format(self._cycle[self._selected]))
+        self.update()
+
+    def on_place(self, event):
+        if self._selected is None:
+            return
+        piece_type, coord = self._cycle[self._selected]
+        self.board_frame.place_piece(piece_type, coord)
+
+    def update(self):
+        """
+        Draw the shadows near the pointer and the selected one, and delete the others.
+        """
+        if self._index is None:
+            return
+        with timings.measure('board.ghosts'):
+            shown = set(self._index.near(self._pointer[0], self._pointer[1], self.radius)) if self._pointer else set()
+            selected = self._cycle[self._selected] if self._selected is not None else None
+            if selected is not None:
+                shown.add(selected)
+            for piece_type, coord in self._drawn - shown:
+                self.canvas.delete(self.board_frame._piece_tag(piece_type, coord))
+            for piece_type, coord in shown - self._drawn:
+                self.board_frame._draw_piece(coord, self._pieces[piece_type], self._terrain_centers, ghost=True)
+            for piece_type, coord in shown:
+                fill = self._color(piece_type) if (piece_type, coord) == selected else ''
+                self.canvas.itemconfigure(self.board_frame._piece_tag(piece_type, coord), fill=fill)
+            self._drawn = shown
+
+    def _on_motion_idle(self):
+        self._pending = None
+        self.update()
+
+    def _center(self, spot):
+        if spot not in self._centers:
+            piece_type, coord = spot
+            x, y, _ = self.board_frame._get_piece_center(coord, self._pieces[piece_type], self._terrain_centers)
+            self._centers[spot] = (x, y)
+        return self._centers[spot]
+
+    def _color(self, piece_type):
+        # as _piece_tkinter_opts colors them
+        if piece_type == PieceType.robber:
+            return 'black'
+        return self._pieces[piece_type].owner.color
+
+    def _draw_overlay(self):
+        color = self._color(self._spots[0][0])
+        key = (color, tuple(self._spots))
+        image = self._overlays.pop(key, None)
+        if image is None:
+            image = tkinter.PhotoImage(width=CANVAS_WIDTH, height=CANVAS_HEIGHT)
+            for spot in self._spots:
+                x, y = self._center(spot)
+                image.put(color, to=(int(x) - 1, int(y) - 1, int(x) + 2, int(y) + 2))
+        self._overlays[key] = image
+        while len(self._overlays) > GHOST_OVERLAY_CACHE:
+            self._overlays.popitem(last=False)
+        self.canvas.create_image(0, 0, image=image, anchor=tkinter.NW, tags='ghost_overlay')
+
+
 class SetupGameToolbarFrame(tkinter.Frame):
 
     def __init__(self, master, game, options=None, *args, **kwargs):
@@ -556,7 +968,8 @@ class SetupGameToolbarFrame(tkinter.Frame):
         self.options = options or dict()
         self.options.update({
             'hex_resource_selection': True,
-            'hex_number_selection': False
+            'hex_number_selection': False,
+            'spot_heatmap': True
         })
 
         tkinter.Label(self, text="Players", anchor=tkinter.W).pack(side=tkinter.TOP, fill=tkinter.X)
@@ -573,13 +986,15 @@ class SetupGameToolbarFrame(tkinter.Frame):
         tkinter.Button(self, text="Reset Pieces", command=self.on_reset_pieces, anchor=tkinter.W).pack(side=tkinter.TOP, fill=tkinter.X)
         tkinter.Button(self, text="Move Robber", command=self.on_move_robber, anchor=tkinter.W).pack(side=tkinter.TOP, fill=tkinter.X)
         tkinter.Button(self, text="Rotate Ports", command=self.on_rotate_ports, anchor=tkinter.W).pack(side=tkinter.TOP, fill=tkinter.X)
+        tkinter.Button(self, text="Score Board", command=self.on_score_board, anchor=tkinter.W).pack(side=tkinter.TOP, fill=tkinter.X)
 
         tkinter.Label(self, text="---").pack(side=tkinter.TOP)
         btn_start_game = tkinter.Button(self, text='Start Game', command=self.on_start_game)
         btn_start_game.pack(side=tkinter.TOP, fill=tkinter.X)
 
     def on_reset_board(self):
-        self.game.board.reset()
+        import boardgen
+        boardgen.reset(self.game.board, self.master.board_rules)
         self.game.notify_observers()
 
     def on_reset_pieces(self):
@@ -594,6 +1009,16 @@ class SetupGameToolbarFrame(tkinter.Frame):
     def on_rotate_ports(self):
         self.game.board.rotate_ports()
 
+    def on_score_board(self):
+        from tkinter import messagebox
+        import fairness
+        scores = fairness.score(fairness.encode([self.game.board]))
+        logging.info('board fairness: {}'.format(fairness.describe(scores, 0)))
+        messagebox.showinfo('Board Fairness', '\n'.join(
+            ['score: {:.2f} (lower is fairer)'.format(scores.score[0])] +
+            ['{}: {:.2f}'.format(name.replace('_', ' '), getattr(scores, name)[0]) for name in fairness.METRICS]
+        ))
+
     def on_start_game(self):
         def get_name(var):
             return var.get().split(' ')[0]
@@ -625,6 +1050,7 @@ class StartGamePlayerOrderFrame(tkinter.Frame):
             var.set(default)
             entry.config(textvariable=var)
             entry.grid(row=defaults.index(default), column=1)
+            tkinterutils.exclude_from_bind_all(entry)
 
         values = ['1','2','3','4']
         self.player_order_vars = [(tkinter.Spinbox(self, values=values), tkinter.StringVar()) for i in range(len(values))]
@@ -632,45 +1058,63 @@ class StartGamePlayerOrderFrame(tkinter.Frame):
             var.set(val)
             entry.config(textvariable=var)
             entry.grid(row=int(val)-1, column=2)
+            tkinterutils.exclude_from_bind_all(entry)
 
 
 class GameToolbarFrame(tkinter.Frame):
 
-    def __init__(self, master, game, *args, **kwargs):
+    def __init__(self, master, game, production, ports, events, archive=None, *args, **kwargs):
         super(GameToolbarFrame, self).__init__()
         self.master = master
         self.game = game
+        self.production = production
+        self.ports = ports
+        self.archive = archive
 
-        self.game.observers.add(self)
+        events.subscribe(self.on_changes, changeevents.PlayerChanged)
 
         self._cur_player = self.game.get_cur_player()
         self._cur_player_name = tkinter.StringVar()
         self.set_cur_player_name()
 
+        # deferred: trading is only needed once the game starts, keep it out of startup
+        import views_trading
+
         label_cur_player_name = tkinter.Label(self, textvariable=self._cur_player_name, anchor=tkinter.W)
-        frame_roll = RollFrame(self, self.game)
-        frame_undo = UndoRedoFrame(self, self.game)
-        frame_robber = RobberFrame(self, self.game)
-        frame_build = BuildFrame(self, self.game)
-        frame_trade = views_trading.TradeFrame(self, self.game)
-        frame_play_dev = PlayDevCardFrame(self, self.game)
-        frame_end_turn = EndTurnFrame(self, self.game)
-        frame_end_game = EndGameFrame(self, self.game)
+        self.frame_roll = RollFrame(self, self.game, self.production, events)
+        self.frame_undo = UndoRedoFrame(self, self.game, events)
+        self.frame_robber = RobberFrame(self, self.game, self.production, events)
+        self.frame_build = BuildFrame(self, self.game, events)
+        self.frame_trade = views_trading.TradeFrame(self, self.game, self.ports, events)
+        self.frame_play_dev = PlayDevCardFrame(self, self.game, events)
+        self.frame_end_turn = EndTurnFrame(self, self.game, events)
+        self.frame_end_game = EndGameFrame(self, self.game, self.archive)
 
         label_cur_player_name.pack(fill=tkinter.X)
-        frame_roll.pack(fill=tkinter.X)
-        frame_undo.pack(fill=tkinter.X)
-        frame_robber.pack(fill=tkinter.X)
-        frame_build.pack(fill=tkinter.X)
-        frame_trade.pack(fill=tkinter.X)
-        frame_play_dev.pack(fill=tkinter.X)
-        frame_end_turn.pack(fill=tkinter.X)
-        frame_end_game.pack(side=tkinter.BOTTOM, fill=tkinter.BOTH)
+        self.frame_roll.pack(fill=tkinter.X)
+        self.frame_undo.pack(fill=tkinter.X)
+        self.frame_robber.pack(fill=tkinter.X)
+        self.frame_build.pack(fill=tkinter.X)
+        self.frame_trade.pack(fill=tkinter.X)
+        self.frame_play_dev.pack(fill=tkinter.X)
+        self.frame_end_turn.pack(fill=tkinter.X)
+        self.frame_end_game.pack(side=tkinter.BOTTOM, fill=tkinter.BOTH)
 
     def set_game(self, game):
         self.game = game
 
-    def notify(self, observable):
+    def rebind(self):
+        """
+        Rebind the toolbar to the players of the game which just started.
+
+        The toolbar is built once (see main.CatanSpectator) and reused across games, so anything
+        which was captured from the previous game's players is refreshed here.
+        """
+        self.set_cur_player_name()
+        self.frame_robber.rebind()
+        self.frame_trade.on_cancel()
+
+    def on_changes(self, events):
         if self._cur_player.color != self.game.get_cur_player().color:
             self.set_cur_player_name()
 
@@ -682,13 +1126,226 @@ class GameToolbarFrame(tkinter.Frame):
         ))
 
 
+class ProductionFrame(tkinter.Frame):
+    """
+    class ProductionFrame shows each player's expected income, and what the last roll paid out.
+
+    Income is in pips: the number of ways out of 36 to roll the numbers a player is on, weighted
+    by 2 for cities and not counting the tile the robber is on. See module production.
+    """
+
+    def __init__(self, master, game, production, events, *args, **kwargs):
+        super(ProductionFrame, self).__init__(master)
+        self.master = master
+        self.game = game
+        self.production = production
+        events.subscribe(self.on_changes, changeevents.Rolled, changeevents.StateChanged, changeevents.UndoApplied,
+                         *changeevents.BOARD_EVENTS)
+
+        self._drawn = None
+        self._income = tkinter.StringVar()
+        self._last_roll = tkinter.StringVar()
+
+        tkinter.Label(self, text='Production (pips/36)', anchor=tkinter.W).pack(fill=tkinter.X)
+        tkinter.Label(self, textvariable=self._income, anchor=tkinter.W, justify=tkinter.LEFT).pack(fill=tkinter.X)
+        tkinter.Label(self, textvariable=self._last_roll, anchor=tkinter.W, justify=tkinter.LEFT).pack(fill=tkinter.X)
+
+        self.redraw()
+
+    def on_changes(self, events):
+        self.redraw()
+
+    def redraw(self):
+        drawn = (self.production.version, tuple(self.game.players), self.game.last_roll)
+        if drawn == self._drawn:
+            return
+        self._drawn = drawn
+
+        lines = list()
+        for player in self.game.players:
+            income = self.production.income(player)
+            lines.append('{}: {} ({})'.format(
+                player.color,
+                sum(income.values()),
+                ', '.join('{} {}'.format(t.value, n) for t, n in income.most_common() if n)
+            ))
+        self._income.set('\n'.join(lines))
+
+        if self.game.last_roll is None:
+            self._last_roll.set('')
+        else:
+            payouts = self.production.payouts(self.game.last_roll)
+            self._last_roll.set('Rolled {}: {}'.format(self.game.last_roll, '; '.join(
+                '{} +{}'.format(player.color, ', '.join('{} {}'.format(n, t.value) for t, n in cards.items()))
+                for player, cards in payouts.items()
+            ) or 'nothing'))
+
+
+class WinProbabilityFrame(tkinter.Frame):
+    """
+    class WinProbabilityFrame shows each player's estimated chance to win as a bar, with its 95%
+    confidence interval. Estimates come from a simulation.WinProbabilityEstimator, polled on a timer.
+    """
+    bar_width = 160
+    bar_height = 14
+    poll_ms = 250
+
+    def __init__(self, master, estimator, *args, **kwargs):
+        super(WinProbabilityFrame, self).__init__(master)
+        self.master = master
+        self.estimator = estimator
+
+        tkinter.Label(self, text='Chance to win', anchor=tkinter.W).pack(fill=tkinter.X)
+        self._canvas = tkinter.Canvas(self, width=self.bar_width + 90, height=4 * (self.bar_height + 6))
+        self._canvas.pack()
+        self._playouts = tkinter.StringVar()
+        tkinter.Label(self, textvariable=self._playouts, anchor=tkinter.W).pack(fill=tkinter.X)
+
+        self._waiting = None  # (no playouts yet, game on) as last drawn
+        self._poll()
+
+    def _poll(self):
+        # without playouts, there's only something new to draw when the game starts or stops
+        waiting = (not self.estimator.playouts, self.game_on())
+        if self.estimator.poll() or waiting != self._waiting:
+            self.redraw()
+            self._waiting = (not self.estimator.playouts, self.game_on())
+        self._after = self.after(self.poll_ms, self._poll)
+
+    def redraw(self):
+        self._canvas.delete(tkinter.ALL)
+        estimates = self.estimator.estimates()
+        if not estimates:
+            self._playouts.set('waiting for the game' if not self.game_on() else 'simulating...')
+            return
+        for i, estimate in enumerate(estimates):
+            y = 3 + i * (self.bar_height + 6)
+            width = estimate.probability * self.bar_width
+            low = max(estimate.probability - estimate.half_width, 0) * self.bar_width
+            high = min(estimate.probability + estimate.half_width, 1) * self.bar_width
+            self._canvas.create_rectangle(0, y, width, y + self.bar_height,
+                                          fill=estimate.player.color, outline=estimate.player.color)
+            self._canvas.create_line(low, y + self.bar_height / 2, high, y + self.bar_height / 2, width=2)
+            self._canvas.create_text(self.bar_width + 5, y, anchor=tkinter.NW,
+                                     text='{:.0%} \u00b1{:.0%}'.format(estimate.probability, estimate.half_width))
+        self._playouts.set('{} playouts'.format(self.estimator.playouts))
+
+    def game_on(self):
+        return self.estimator.game.state.is_in_game()
+
+    def destroy(self):
+        self.after_cancel(self._after)
+        self.estimator.shutdown()
+        super(WinProbabilityFrame, self).destroy()
+
+
+class StandbyFrame(tkinter.Frame):
+    """
+    class StandbyFrame shows how far a replication.Replica has got replicating the primary, polled
+    on a timer, and a button to promote it and take over the game.
+
+    :param replica: replication.Replica
+    :param on_promote: called with no arguments when Promote is clicked
+    """
+    poll_ms = 500
+
+    def __init__(self, master, replica, on_promote, *args, **kwargs):
+        super(StandbyFrame, self).__init__(master)
+        self.master = master
+        self.replica = replica
+
+        self._status = tkinter.StringVar()
+        tkinter.Label(self, text='Standby for {}:{}'.format(*replica.address)).pack(side=tkinter.LEFT)
+        tkinter.Label(self, textvariable=self._status, anchor=tkinter.W).pack(side=tkinter.LEFT)
+        self.promote = tkinter.Button(self, text='Promote', command=on_promote)
+        self.promote.pack(side=tkinter.RIGHT)
+
+        self._poll()
+
+    def _poll(self):
+        status = self.replica.status()
+        if status.connected:
+            text = '{} lines, turn {}'.format(status.lines, status.turn if status.turn is not None else '-')
+        else:
+            text = 'disconnected ({}), {} lines'.format(status.error or 'connecting', status.lines)
+        self._status.set(text)
+        self._after = self.after(self.poll_ms, self._poll)
+
+    def destroy(self):
+        self.after_cancel(self._after)
+        super(StandbyFrame, self).destroy()
+
+
+class AutoplayFrame(tkinter.Frame):
+    """
+    class AutoplayFrame has the controls for watching a log back: play/pause, the speed in actions
+    per second, and a turn to jump to, and shows how far playback has got.
+
+    :param autoplay: autoplay.Autoplay
+    """
+    def __init__(self, master, autoplay, *args, **kwargs):
+        super(AutoplayFrame, self).__init__(master)
+        self.master = master
+        self.autoplay = autoplay
+        autoplay.on_frame = self.redraw
+
+        from autoplay import MIN_SPEED, MAX_SPEED
+        self.play = tkinter.Button(self, text='Play', width=5, command=self.on_toggle)
+        self.speed = tkinter.Scale(self, from_=MIN_SPEED, to=MAX_SPEED,
+                                   orient=tkinter.HORIZONTAL, label='Actions/s', command=self.on_speed)
+        self.speed.set(autoplay.speed)
+        self.turn = tkinter.StringVar()
+        turn_box = tkinter.Spinbox(self, from_=1, to=len(autoplay.turn_starts), width=5, textvariable=self.turn,
+                                   command=self.on_jump_to_turn)
+        turn_box.bind('<Return>', self.on_jump_to_turn)
+        for widget in (self.speed, turn_box):
+            tkinterutils.exclude_from_bind_all(widget)
+        self._status = tkinter.StringVar()
+
+        self.play.pack(side=tkinter.LEFT)
+        self.speed.pack(side=tkinter.LEFT)
+        tkinter.Label(self, text='Turn').pack(side=tkinter.LEFT)
+        turn_box.pack(side=tkinter.LEFT)
+        tkinter.Label(self, textvariable=self._status, anchor=tkinter.W).pack(side=tkinter.LEFT, fill=tkinter.X)
+
+        self.redraw()
+
+    def redraw(self):
+        autoplay = self.autoplay
+        self.play.configure(text='Pause' if autoplay.playing else 'Play')
+        text = 'line {}/{}, turn {}, {} frames, {} lines not drawn, {:.0f}ms a frame'.format(
+            autoplay.position, len(autoplay.lines), autoplay.current_turn(), autoplay.frames, autoplay.dropped,
+            autoplay.frame_cost * 1000)
+        if autoplay.error is not None:
+            text += ', stopped at {}'.format(autoplay.error)
+        self._status.set(text)
+
+    def on_toggle(self):
+        self.autoplay.toggle()
+        self.redraw()
+
+    def on_speed(self, value):
+        self.autoplay.set_speed(int(value))
+
+    def on_jump_to_turn(self, event=None):
+        try:
+            turn = int(self.turn.get())
+        except ValueError:
+            return
+        self.autoplay.jump_to_turn(turn)
+
+    def destroy(self):
+        self.autoplay.stop()
+        super(AutoplayFrame, self).destroy()
+
+
 class UndoRedoFrame(tkinter.Frame):
 
-    def __init__(self, master, game, *args, **kwargs):
+    def __init__(self, master, game, events, *args, **kwargs):
         super(UndoRedoFrame, self).__init__(master)
         self.master = master
         self.game = game
-        self.game.observers.add(self)
+        events.subscribe(self.on_changes, changeevents.HistoryChanged)
 
         tkinter.Label(self, text="Undo").pack(anchor=tkinter.W)
         self.undo = tkinter.Button(self, text="Undo", command=self.on_undo)
@@ -699,16 +1356,24 @@ class UndoRedoFrame(tkinter.Frame):
 
         self.set_states()
 
-        self.bind_all('<Left>', lambda e: self.on_undo())
-        self.bind_all('<Right>', lambda e: self.on_redo())
+        self.bind_all('<Left>', self.on_undo_event)
+        self.bind_all('<Right>', self.on_redo_event)
 
-    def notify(self, observable):
+    def on_changes(self, events):
         self.set_states()
 
     def set_states(self):
         self.undo.configure(state=can_do[self.game.undo_manager.can_undo()])
         self.redo.configure(state=can_do[self.game.undo_manager.can_redo()])
 
+    def on_undo_event(self, event):
+        if self.game.undo_manager.can_undo():
+            self.on_undo()
+
+    def on_redo_event(self, event):
+        if self.game.undo_manager.can_redo():
+            self.on_redo()
+
     def on_undo(self):
         self.game.undo()
 
@@ -718,11 +1383,12 @@ class UndoRedoFrame(tkinter.Frame):
 
 class RollFrame(tkinter.Frame):
 
-    def __init__(self, master, game, *args, **kwargs):
+    def __init__(self, master, game, production, events, *args, **kwargs):
         super(RollFrame, self).__init__(master)
         self.master = master
         self.game = game
-        self.game.observers.add(self)
+        self.production = production
+        events.subscribe(self.on_changes, changeevents.StateChanged)
 
         self.smallnumbers = tkinter.Frame (self)
         self.smallnumbers.pack (side='left')
@@ -775,7 +1441,7 @@ class RollFrame(tkinter.Frame):
                 self.on_roll(roll)
         return roll_event
 
-    def notify(self, observable):
+    def on_changes(self, events):
         self.set_states()
 
     def set_states(self):
@@ -793,17 +1459,21 @@ class RollFrame(tkinter.Frame):
 
 
     def on_roll(self, roll):
+        payouts = self.production.payouts(roll)
+        logging.info('roll={} pays out {}'.format(roll, dict((p.color, dict(c)) for p, c in payouts.items())))
         self.game.roll(roll)
         self.set_states()
 
 
 class RobberFrame(tkinter.Frame):
 
-    def __init__(self, master, game):
+    def __init__(self, master, game, production, events):
         super(RobberFrame, self).__init__(master)
         self.master = master
         self.game = game
-        self.game.observers.add(self)
+        self.production = production
+        events.subscribe(self.on_changes, changeevents.StateChanged, changeevents.PlayerChanged,
+                         *changeevents.PIECE_EVENTS)
 
         self.label = tkinter.Label(self, text="Steal", anchor=tkinter.W)
 
@@ -811,6 +1481,7 @@ class RobberFrame(tkinter.Frame):
         self.player_strs = [str(player) for player in self.game.players]
         self.player_str = tkinter.StringVar()
         self.player_picker = tkinter.OptionMenu(self.steal_frame, self.player_str, self.player_str.get(), *self.player_strs) # reassigned in set_states
+        self._stealable_strs = None
         self.steal = tkinter.Button(self.steal_frame, text="Steal", state=tkinter.DISABLED, command=self.on_steal)
 
         self.player_picker.pack(side=tkinter.LEFT, fill=tkinter.X, expand=True)
@@ -821,22 +1492,24 @@ class RobberFrame(tkinter.Frame):
         self.label.pack(fill=tkinter.X)
         self.steal_frame.pack(fill=tkinter.X, expand=True)
 
-    def notify(self, observable):
+    def on_changes(self, events):
         self.set_states()
 
     def set_states(self):
-        stealable_strs = [str(player) for player in self.game.stealable_players()]
-        if stealable_strs:
-            self.player_str.set(stealable_strs[0])
-        else:
-            self.player_str.set('')
-        if stealable_strs:
-            logging.debug('stealable set state stealable_strs({})={}, picked_str({})={}'.format(
-                type(stealable_strs[0]), stealable_strs,
-                type(self.player_str.get()), self.player_str.get()
-            ))
-        tkinterutils.refresh_option_menu(self.player_picker, self.player_str,
-                                         new_options=[s for s in stealable_strs if s != self.player_str.get()])
+        stealable_strs = sorted(str(player) for player in self.production.stealable_players())
+        # the menu is only rebuilt, and the pick reset, when who can be stolen from changes
+        if stealable_strs != self._stealable_strs:
+            self._stealable_strs = stealable_strs
+            if stealable_strs:
+                self.player_str.set(stealable_strs[0])
+            else:
+                self.player_str.set('')
+            if stealable_strs:
+                logging.debug('stealable set state stealable_strs({})={}, picked_str({})={}'.format(
+                    type(stealable_strs[0]), stealable_strs,
+                    type(self.player_str.get()), self.player_str.get()
+                ))
+            tkinterutils.refresh_option_menu(self.player_picker, self.player_str, new_options=stealable_strs)
 
         self.player_picker.configure(state=can_do[self.game.state.can_steal()])
         self.steal.configure(state=can_do[self.game.state.can_steal()])
@@ -850,6 +1523,10 @@ class RobberFrame(tkinter.Frame):
         logging.debug('in view, stealing from victim={} (victim_str={})'.format(victim, victim_str))
         self.game.steal(victim)
 
+    def rebind(self):
+        self.player_strs = [str(player) for player in self.game.players]
+        self.set_states()
+
     def _other_player_strs(self):
         cur_str = str(self.game.get_cur_player())
         return list(filter(lambda pstr: pstr != cur_str, self.player_strs))
@@ -857,11 +1534,11 @@ class RobberFrame(tkinter.Frame):
 
 class BuildFrame(tkinter.Frame):
 
-    def __init__(self, master, game):
+    def __init__(self, master, game, events):
         super(BuildFrame, self).__init__(master)
         self.master = master
         self.game = game
-        self.game.observers.add(self)
+        events.subscribe(self.on_changes, changeevents.StateChanged)
 
         self.label = tkinter.Label(self, text="Build", anchor=tkinter.W)
         self.road = tkinter.Button(self, text="Road", command=self.on_buy_road, anchor=tkinter.W)
@@ -869,10 +1546,10 @@ class BuildFrame(tkinter.Frame):
         self.city = tkinter.Button(self, text="City", command=self.on_buy_city, anchor=tkinter.W)
         self.dev_card = tkinter.Button(self, text="Dev Card", command=self.on_buy_dev_card, anchor=tkinter.E)
 
-        self.bind_all('r', lambda e: self.on_buy_road())
-        self.bind_all('s', lambda e: self.on_buy_settlement())
-        self.bind_all('c', lambda e: self.on_buy_city())
-        self.bind_all('d', lambda e: self.on_buy_dev_card())
+        self.bind_all('r', lambda e: self.game.state.can_buy_road() and self.on_buy_road())
+        self.bind_all('s', lambda e: self.game.state.can_buy_settlement() and self.on_buy_settlement())
+        self.bind_all('c', lambda e: self.game.state.can_buy_city() and self.on_buy_city())
+        self.bind_all('d', lambda e: self.game.state.can_buy_dev_card() and self.on_buy_dev_card())
 
         self.set_states()
 
@@ -882,7 +1559,7 @@ class BuildFrame(tkinter.Frame):
         self.city.grid(row=3, column=1, sticky=tkinter.EW)
         self.dev_card.grid(row=3, column=2, sticky=tkinter.EW)
 
-    def notify(self, observable):
+    def on_changes(self, events):
         self.set_states()
 
     def set_states(self):
@@ -909,18 +1586,18 @@ class BuildFrame(tkinter.Frame):
 
 class PlayDevCardFrame(tkinter.Frame):
 
-    def __init__(self, master, game):
+    def __init__(self, master, game, events):
         super(PlayDevCardFrame, self).__init__(master)
         self.master = master
         self.game = game
-        self.game.observers.add(self)
+        events.subscribe(self.on_changes, changeevents.StateChanged)
 
         self.label = tkinter.Label(self, text="Play Dev Card", anchor=tkinter.W)
         self.knight = tkinter.Button(self, text="Knight", command=self.on_knight)
         self.road_builder = tkinter.Button(self, text="Road Builder", command=self.on_road_builder)
         self.victory_point = tkinter.Button(self, text="Victory Point", command=self.on_victory_point)
 
-        self.bind_all('k', lambda e: self.on_knight())
+        self.bind_all('k', lambda e: self.game.state.can_play_knight() and self.on_knight())
 
         self.monopoly_frame = tkinter.Frame(self)
         self.monopoly = tkinter.Button(self.monopoly_frame, text="Monopoly", command=self.on_monopoly)
@@ -959,7 +1636,7 @@ class PlayDevCardFrame(tkinter.Frame):
         self.road_builder.pack(fill=tkinter.X, expand=True)
         self.victory_point.pack(fill=tkinter.X, expand=True)
 
-    def notify(self, observable):
+    def on_changes(self, events):
         self.set_states()
 
     def set_states(self):
@@ -999,11 +1676,11 @@ class PlayDevCardFrame(tkinter.Frame):
 
 class EndTurnFrame(tkinter.Frame):
 
-    def __init__(self, master, game):
+    def __init__(self, master, game, events):
         super(EndTurnFrame, self).__init__(master)
         self.master = master
         self.game = game
-        self.game.observers.add(self)
+        events.subscribe(self.on_changes, changeevents.StateChanged)
 
         self.label = tkinter.Label(self, text='--')
         self.end_turn = tkinter.Button(self, text='End Turn', state=tkinter.DISABLED, command=self.on_end_turn)
@@ -1015,7 +1692,7 @@ class EndTurnFrame(tkinter.Frame):
         self.label.pack()
         self.end_turn.pack(side=tkinter.TOP, fill=tkinter.X)
 
-    def notify(self, observable):
+    def on_changes(self, events):
         self.set_states()
 
     def set_states(self):
@@ -1030,22 +1707,29 @@ class EndTurnFrame(tkinter.Frame):
 
 
 class EndGameFrame(tkinter.Frame):
+    """
+    class EndGameFrame ends the game, and adds it to the game archive if there is one (see module archive).
+    """
 
-    def __init__(self, master, game):
+    def __init__(self, master, game, archive=None):
         super(EndGameFrame, self).__init__(master)
         self.master = master
         self.game = game
+        self.archive = archive
 
         self.end_game = tkinter.Button(self, text='End Game', state=tkinter.NORMAL, command=self.on_end_game)
         self.end_game.pack(side=tkinter.TOP, fill=tkinter.X)
 
     def on_end_game(self):
+        from tkinter import messagebox
         title = 'End Game Confirmation'
         message = 'End Game? ({0} ({1}) wins)'.format(
             self.game.get_cur_player().color, self.game.get_cur_player().name
         )
         if messagebox.askyesno(title, message):
             self.game.end()
+            if self.archive is not None:
+                self.archive.ingest_game(self.game)
 
 
 class TkinterOptionWrapper:
@@ -1073,7 +1757,8 @@ class TkinterOptionWrapper:
     Option = collections.namedtuple('_Option', ['text', 'var', 'callback'])
     _descriptions = {
         'hex_resource_selection': 'Cycle resource',
-        'hex_number_selection': 'Cycle number'
+        'hex_number_selection': 'Cycle number',
+        'spot_heatmap': 'Spot heatmap'
     }
 
     def __init__(self, option_dict):
@@ -4,6 +4,8 @@ import tkinter as tk
 from catan.board import PortType, Terrain, Port
 from catan.trading import CatanTrade
 
+import changeevents
+
 can_do = {
     True: tk.NORMAL,
     False: tk.DISABLED,
@@ -18,22 +20,29 @@ class TradeFrame(tk.Frame):
     TradeFrame contains a swappable frame. The contents of the frame are responsible for
     swapping themselves out when user input dictates it (eg click button -> swap frame)
 
+    Each step of the wizard is built once, and reset when it's swapped in, so trading doesn't
+    build any widgets.
+
     TradeFrame is used inside the larger GameToolbarFrame.
 
-    TradeFrame observes the game object. On notify, it:
+    TradeFrame subscribes to the changes which can change what can be traded. On a change, it:
     - calls the swappable frame's notify() method
     - sets the state of its buttons
     """
-    def __init__(self, master, game):
+    def __init__(self, master, game, ports, events):
         super(TradeFrame, self).__init__(master)
         self.master = master
         self.game = game
-        self.game.observers.add(self)
+        self.ports = ports
+        events.subscribe(self.on_changes, changeevents.StateChanged, changeevents.PlayerChanged,
+                         changeevents.PiecePlaced, changeevents.PieceRemoved)
 
         self.trade = CatanTrade(giver=self.game.get_cur_player())
 
         self.title = tk.Label(self, text="Trade")
-        self.frame = WithWhoFrame(self)
+        self.steps = dict((step, step(self)) for step in
+                          (WithWhoFrame, WithWhichPlayerFrame, WithWhichPortFrame, WhichResourcesFrame))
+        self.frame = self.steps[WithWhoFrame]
         self.cancel = tk.Button(self, text='Cancel', state=tk.DISABLED, command=self.on_cancel)
         self.make_trade = tk.Button(self, text='Make Trade', state=tk.DISABLED, command=self.on_make_trade)
 
@@ -44,6 +53,9 @@ class TradeFrame(tk.Frame):
 
         self.set_states()
 
+    def on_changes(self, events):
+        self.notify(None)
+
     def notify(self, observable):
         self.frame.notify(self)
         self.set_states()
@@ -52,9 +64,13 @@ class TradeFrame(tk.Frame):
         self.make_trade.configure(state=can_do[self.can_make_trade()])
         self.cancel.configure(state=can_do[self.can_cancel()])
 
-    def set_frame(self, frame):
+    def set_frame(self, step):
+        """
+        :param step: class of the wizard step to show, eg WithWhoFrame
+        """
         self.frame.grid_remove()
-        self.frame = frame
+        self.frame = self.steps[step]
+        self.frame.reset()
         self.frame.grid(row=1)
         self.notify(None)
 
@@ -77,14 +93,12 @@ class TradeFrame(tk.Frame):
 
     def on_cancel(self):
         self.trade = CatanTrade(giver=self.game.get_cur_player())
-        self.set_frame(WithWhoFrame(self))
+        self.set_frame(WithWhoFrame)
 
 
 class WithWhoFrame(tk.Frame):
     def __init__(self, *args, **kwargs):
         super(WithWhoFrame, self).__init__(*args, **kwargs)
-        self.master.game.observers.add(self)
-
         self.player = tk.Button(self, text='Player', command=self.on_player)
         self.port = tk.Button(self, text='Port', command=self.on_port)
 
@@ -96,15 +110,18 @@ class WithWhoFrame(tk.Frame):
     def notify(self, observable):
         self.set_states()
 
+    def reset(self):
+        self.set_states()
+
     def set_states(self):
         self.player.configure(state=can_do[self.master.game.state.can_trade()])
         self.port.configure(state=can_do[self.master.game.state.can_trade()])
 
     def on_player(self):
-        self.master.set_frame(WithWhichPlayerFrame(self.master))
+        self.master.set_frame(WithWhichPlayerFrame)
 
     def on_port(self):
-        self.master.set_frame(WithWhichPortFrame(self.master))
+        self.master.set_frame(WithWhichPortFrame)
 
     def can_make_trade(self):
         return False
@@ -116,23 +133,32 @@ class WithWhoFrame(tk.Frame):
 class WithWhichPlayerFrame(tk.Frame):
     def __init__(self, *args, **kwargs):
         super(WithWhichPlayerFrame, self).__init__(*args, **kwargs)
-        self.master.game.observers.add(self)
-
+        # one button per seat, relabelled for the players of each game
         self.player_btns = list()
-        count = 0
-        for p in self.master.game.players.copy():
-            b = tk.Button(self, text='{}'.format(p), state=tk.DISABLED, command=functools.partial(self.on_player, p))
-            b.grid(row=count // 2, column=count % 2, sticky=tk.NSEW)
+        for seat in range(4):
+            b = tk.Button(self, state=tk.DISABLED, command=functools.partial(self.on_seat, seat))
             self.player_btns.append(b)
-            count += 1
+        self.players = list()
 
-        self.set_states()
+        self.reset()
 
     def notify(self, observable):
         self.set_states()
 
+    def reset(self):
+        players = self.master.game.players.copy()
+        if players != self.players:
+            self.players = players
+            for count, player_btn in enumerate(self.player_btns):
+                if count < len(players):
+                    player_btn.configure(text='{}'.format(players[count]))
+                    player_btn.grid(row=count // 2, column=count % 2, sticky=tk.NSEW)
+                else:
+                    player_btn.grid_remove()
+        self.set_states()
+
     def set_states(self):
-        for player_btn, player in zip(self.player_btns, self.master.game.players.copy()):
+        for player_btn, player in zip(self.player_btns, self.players):
             state = (self.master.game.state.can_trade()
                      and self.master.game.get_cur_player() != player)
             player_btn.configure(state=can_do[state])
@@ -143,17 +169,18 @@ class WithWhichPlayerFrame(tk.Frame):
     def can_cancel(self):
         return True
 
+    def on_seat(self, seat):
+        self.on_player(self.players[seat])
+
     def on_player(self, player):
         logging.debug('trade: player={} selected'.format(player))
         self.master.trade.set_getter(player)
-        self.master.set_frame(WhichResourcesFrame(self.master))
+        self.master.set_frame(WhichResourcesFrame)
 
 
 class WithWhichPortFrame(tk.Frame):
     def __init__(self, *args, **kwargs):
         super(WithWhichPortFrame, self).__init__(*args, **kwargs)
-        self.master.game.observers.add(self)
-
         # grid of buttons
         # x x x
         # x x x
@@ -172,18 +199,22 @@ class WithWhichPortFrame(tk.Frame):
     def notify(self, observable):
         self.set_states()
 
+    def reset(self):
+        self.set_states()
+
     def set_states(self):
         can_trade = self.master.game.state.can_trade()
+        port_types = self.master.ports.port_types(self.master.game.get_cur_player())
         for btn, port_type in zip(self.port_btns, PortType):
             if port_type == PortType.any4:
                 btn.configure(state=can_do[can_trade])
             else:
-                btn.configure(state=can_do[can_trade and self.master.game.cur_player_has_port_type(port_type)])
+                btn.configure(state=can_do[can_trade and port_type in port_types])
 
     def on_port(self, port_type):
         logging.debug('trade: port_type={} selected'.format(port_type))
         self.master.trade.set_getter(Port(1, 'OO', port_type))
-        self.master.set_frame(WhichResourcesFrame(self.master))
+        self.master.set_frame(WhichResourcesFrame)
 
     def can_make_trade(self):
         return False
@@ -195,8 +226,6 @@ class WithWhichPortFrame(tk.Frame):
 class WhichResourcesFrame(tk.Frame):
     def __init__(self, *args, **kwargs):
         super(WhichResourcesFrame, self).__init__(*args, **kwargs)
-        self.master.game.observers.add(self)
-
         self.input = WhichResourcesInputFrame(self)
         self.output = WhichResourcesOutputFrame(self)
 
@@ -209,6 +238,9 @@ class WhichResourcesFrame(tk.Frame):
         self.input.notify()
         self.output.notify()
 
+    def reset(self):
+        self.notify()
+
     def can_make_trade(self):
         return True
 
@@ -248,10 +280,13 @@ class WhichResourcesInputFrame(tk.Frame):
         num_getting = self.trade().num_getting()
         giving_types = [giving_type.value for _, giving_type in self.trade().giving()]
         for btn in self.get_btns:
-            if hasattr(getter, 'type') in PortType:
+            if isinstance(getattr(getter, 'type', None), PortType):
                 btn.configure(state=can_do[num_getting < 1
                                            and btn['text'] != getter.type.value
                                            and btn['text'] not in giving_types])
+            else:
+                # the buttons are reused across trades, so undo what a port trade disabled
+                btn.configure(state=tk.NORMAL)
 
     def on_give(self, terrain):
         getter = self.trade().getter()
@@ -0,0 +1,156 @@
+"""
+module zobrist provides a 64-bit hash of the game position, updated incrementally
+
+Each feature of a position (a tile's terrain, a tile's number, a port, a piece of some owner at
+some location) has a fixed random 64-bit key, and the hash of a position is the XOR of the keys
+of its features. A placement or removal XORs one key in or out, so keeping the hash up to date
+only costs what changed (the board events of the views' changeevents.ChangePublisher), and undo
+lands back on the same hash.
+
+Keys are derived from the features themselves, so hashes are the same in every process and can
+be stored, eg in the game archive.
+
+ZobristIndex keeps
+- setup_hash: tiles, numbers and ports, ie the board before anyone builds on it
+- board_hash: setup_hash and every piece on the board, including the robber
+- position_hash: board_hash, the current player and the phase of the game
+"""
+import hashlib
+
+import hexgrid
+from catan.pieces import PieceType
+
+import changeevents
+
+_keys = dict()
+
+
+def key(*feature):
+    """
+    :param feature: tuple of str/int/None describing one feature, eg ('tile', 5, 'wood')
+    :return: the feature's 64-bit key, int
+    """
+    if feature not in _keys:
+        digest = hashlib.blake2b(repr(feature).encode('utf-8'), digest_size=8).digest()
+        _keys[feature] = int.from_bytes(digest, 'little')
+    return _keys[feature]
+
+
+def _tile_key(tile_id, terrain, number):
+    return key('terrain', tile_id, terrain.value) ^ key('number', tile_id, number)
+
+
+def _port_key(tile_id, direction, port_type):
+    return key('port', tile_id, direction, port_type.value)
+
+
+def _piece_key(hex_type, coord, piece_type, owner):
+    return key('piece', hex_type, coord, piece_type.value, getattr(owner, 'color', None))
+
+
+def _robber_key(tile_id):
+    return _piece_key(hexgrid.TILE, hexgrid.tile_id_to_coord(tile_id), PieceType.robber, None)
+
+
+def setup_hash(terrain, numbers, ports):
+    """
+    :param terrain: list of Terrain, one per tile in tile identifier order
+    :param numbers: list of int or None, one per tile in tile identifier order
+    :param ports: list of catan.board.Port
+    :return: the setup hash of a board with these tiles and ports, the same as ZobristIndex.setup_hash
+    """
+    h = 0
+    for tile_id, (terrain_type, number) in enumerate(zip(terrain, numbers), 1):
+        h ^= _tile_key(tile_id, terrain_type, number)
+    for port in ports:
+        h ^= _port_key(port.tile_id, port.direction, port.type)
+    return h
+
+
+def signed(h):
+    """
+    :param h: 64-bit hash, int
+    :return: h as a signed 64-bit int, as SQLite stores integers
+    """
+    return h - (1 << 64) if h >= 1 << 63 else h
+
+
+class ZobristIndex(object):
+    """
+    class ZobristIndex keeps the hashes of the game's position.
+
+    Without a publisher, it observes the game, and also syncs when queried, since observers are
+    notified in no particular order.
+
+    :param game: catan.game.Game
+    :param changes: changeevents.ChangePublisher to be kept up to date by, or None to observe the
+    game and diff its board instead
+    """
+    def __init__(self, game, changes=None):
+        self.game = game
+        self._diff = None
+        self._tiles = dict()  # tile_id -> key
+        self._ports = frozenset()
+        self._setup = 0
+        self._pieces = 0
+        if changes is None:
+            self._diff = changeevents.BoardDiff()
+            self.game.observers.add(self)
+            self.sync()
+        else:
+            self.on_changes(changeevents.BoardDiff().events(game.board))
+            changes.subscribe_index(self.on_changes, *changeevents.BOARD_EVENTS)
+
+    def notify(self, observable):
+        self.sync()
+
+    def sync(self):
+        if self._diff is not None:
+            events = self._diff.events(self.game.board)
+            if events:
+                self.on_changes(events)
+
+    def on_changes(self, events):
+        """
+        :param events: list of changeevents, those which aren't about the board are ignored
+        """
+        board = self.game.board
+        for event in events:
+            if isinstance(event, (changeevents.PiecePlaced, changeevents.PieceRemoved)):
+                hex_type = hexgrid.EDGE if event.type == PieceType.road else hexgrid.NODE
+                self._pieces ^= _piece_key(hex_type, event.coord, event.type, event.owner)
+            elif isinstance(event, changeevents.RobberMoved):
+                for tile_id in (event.old, event.new):
+                    if tile_id is not None:
+                        self._pieces ^= _robber_key(tile_id)
+            elif isinstance(event, changeevents.BoardEdited):
+                tile = board.tiles[event.tile_id - 1]
+                tile_key = _tile_key(event.tile_id, tile.terrain, tile.number.value)
+                self._setup ^= self._tiles.get(event.tile_id, 0) ^ tile_key
+                self._tiles[event.tile_id] = tile_key
+            elif isinstance(event, changeevents.PortsChanged):
+                # ports are cycled in place during setup; there are only nine, so compare them all
+                ports = frozenset((port.tile_id, port.direction, port.type) for port in board.ports)
+                for port in ports.symmetric_difference(self._ports):
+                    self._setup ^= _port_key(*port)
+                self._ports = ports
+
+    def setup_hash(self):
+        self.sync()
+        return self._setup
+
+    def board_hash(self):
+        self.sync()
+        return self._setup ^ self._pieces
+
+    def position_hash(self):
+        """
+        :return: the hash of the board, the current player, and the phase of the game (the game
+        state, including which piece is being placed, and whether a dev card has been played)
+        """
+        game = self.game
+        player = game.get_cur_player()
+        phase = key('phase', type(game.state).__name__,
+                    getattr(getattr(game.state, 'piece_type', None), 'value', None),
+                    type(game.dev_card_state).__name__)
+        return self.board_hash() ^ key('player', getattr(player, 'color', None)) ^ phase